@@ -0,0 +1,90 @@
+"""
+Микробенчмарк маршрутизации нажатий inline-кнопок.
+
+Сравнивает стоимость выбора обработчика для одного callback:
+  - цепочка фильтров F.data == ... / F.data.startswith(...), которые aiogram
+    проверяет по порядку регистрации (как было до CallbackRouter);
+  - CallbackRouter.resolve: словарь точных маршрутов, декодирование
+    упакованных кнопок и префиксное дерево для кнопок старого формата.
+
+Запуск из каталога бота (нужны файлы данных и BOT_TOKEN, подойдет любой):
+                python callback_router_bench.py --rounds 20000
+"""
+import argparse
+import os
+import time
+from types import SimpleNamespace
+from typing import Callable, List
+
+os.environ.setdefault('BOT_TOKEN', '123456:ABCDEF')
+
+from aiogram import F  # noqa: E402
+
+import nnd  # noqa: E402
+
+
+SAMPLE_VALUES = {nnd.CB_INT: 1, nnd.CB_STR: 'orders', nnd.CB_ORDER_ID: 'CART_123456789_1700000000'}
+
+
+def legacy_data(action: str, fields) -> str:
+    """callback_data в старом формате action_arg1_arg2"""
+    if fields is None:
+        return action
+    return '_'.join([action] + [str(SAMPLE_VALUES[field]) for field in fields])
+
+
+def packed_data(action: str, fields) -> str:
+    """callback_data, как ее сейчас строят клавиатуры"""
+    if fields is None:
+        return action
+    return nnd.callbacks.pack(action, *(SAMPLE_VALUES[field] for field in fields))
+
+
+def linear_chain() -> List:
+    """Фильтры в порядке регистрации - так их перебирал aiogram"""
+    return [F.data.startswith(f"{action}_") if fields is not None else F.data == action
+            for action, fields, _ in nnd.callbacks.registered]
+
+
+def measure(resolve: Callable[[str], object], samples: List[str], rounds: int) -> float:
+    """Среднее время выбора обработчика, нс на один callback"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for data in samples:
+            resolve(data)
+    return (time.perf_counter() - started) / (rounds * len(samples)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк маршрутизации callback")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    chain = linear_chain()
+
+    def resolve_linear(data: str):
+        event = SimpleNamespace(data=data)
+        for index, magic in enumerate(chain):
+            if magic.resolve(event):
+                return index
+        return None
+
+    registered = nnd.callbacks.registered
+    legacy = [legacy_data(action, fields) for action, fields, _ in registered]
+    packed = [packed_data(action, fields) for action, fields, _ in registered]
+    # Последний зарегистрированный маршрут с полями - худший случай для цепочки фильтров
+    last = max(index for index, (_, fields, _) in enumerate(registered) if fields is not None)
+
+    print(f"🔀 Маршрутов: {len(registered)}, раундов: {args.rounds}")
+    for title, old, new in (("все маршруты поровну", legacy, packed),
+                            (f"последний маршрут ({legacy[last]})", [legacy[last]], [packed[last]])):
+        linear = measure(resolve_linear, old, args.rounds)
+        router_legacy = measure(nnd.callbacks.resolve, old, args.rounds)
+        router = measure(nnd.callbacks.resolve, new, args.rounds)
+        print(f"📊 {title}: фильтры F.data {linear:.0f} нс, "
+              f"CallbackRouter {router:.0f} нс (старый формат {router_legacy:.0f} нс), "
+              f"в {linear / router:.1f} раза быстрее")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3301 +1,6286 @@
-import asyncio
-import json
-import os
-import traceback  
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Any
-
-from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command, CommandStart
-from aiogram.utils.keyboard import InlineKeyboardBuilder
-from dotenv import load_dotenv
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
-
-# Загружаем переменные окружения
-load_dotenv()
-
-# ==================== КОНФИГУРАЦИЯ ====================
-class Config:
-    # Администраторы
-    ADMIN_IDS = [1824049351, 5568154436]
-    ADMIN_USERNAME = "@koliin98"
-    
-    # ID каналов для заявок
-    PAYMENT_CHANNEL_ID = -1001862240317
-    ORDER_CHANNEL_ID = -1002893927706
-    
-    # Реквизиты для оплаты (только Ozon)
-    PAYMENT_DETAILS = {
-        "ozon": {
-            "name": "Ozon Банк (СБП/Карта)",
-            "card_number": "2200 2488 7412 7581",  # Замените на реальный номер
-            "phone_number": "+79225739192",  # Замените на реальный номер
-            "owner": "Иван Г."
-        }
-    }
-
-    # Файлы данных
-    DATA_FILE = "products_dat.json"
-    USERS_FILE = "users_dat.json"
-
-config = Config()
-
-# Инициализация бота
-bot = Bot(token=os.getenv('BOT_TOKEN'))
-
-# Создаем storage и dispatcher
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-# ==================== СОСТОЯНИЯ FSM ====================
-
-class AddProductStates(StatesGroup):
-    waiting_for_category = State()
-    waiting_for_name = State()
-    waiting_for_price = State()
-    waiting_for_description = State()
-
-class PaymentStates(StatesGroup):
-    waiting_for_screenshot = State()
-
-class DeleteProductStates(StatesGroup):
-    waiting_for_product_choice = State()
-
-class CartStates(StatesGroup):
-    waiting_for_quantity = State()  # Для ввода количества
-    managing_cart = State()         # Для управления корзиной
-
-# ==================== БАЗА ДАННЫХ ====================
-
-class Database:
-    def __init__(self):
-        self.products: List[Dict] = []
-        self.categories: List[Dict] = []
-        self.users: Dict[int, Dict] = {}
-        self.transactions: List[Dict] = []
-        self.pending_orders: Dict[str, Dict] = {}  # Ожидающие подтверждения заказы
-        self.load_data()
-    
-    def load_data(self):
-        """Загружаем данные из файлов"""
-        try:
-            # Загружаем товары и категории
-            if os.path.exists(config.DATA_FILE):
-                with open(config.DATA_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.products = data.get('products', [])
-                    self.categories = data.get('categories', [])
-            else:
-                self.categories = [
-                    {"id": 1, "name": "💻 Цифровые услуги"},
-                    {"id": 2, "name": "🎨 Дизайн"},
-                    {"id": 3, "name": "📝 Контент"}
-                ]
-                self.save_products_data()
-            
-            # Загружаем пользователей
-            if os.path.exists(config.USERS_FILE):
-                with open(config.USERS_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    users_data = data.get('users', {})
-                    self.users = {int(k): v for k, v in users_data.items()}
-                    self.transactions = data.get('transactions', [])
-                    self.pending_orders = data.get('pending_orders', {})
-        except Exception as e:
-            print(f"Ошибка загрузки данных: {e}")
-            self.products = []
-            self.categories = []
-            self.users = {}
-            self.transactions = []
-            self.pending_orders = {}
-    
-    def save_products_data(self):
-        """Сохраняем товары и категории"""
-        try:
-            data = {
-                "products": self.products,
-                "categories": self.categories
-            }
-            with open(config.DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Ошибка сохранения товаров: {e}")
-    
-    def save_users_data(self):
-        """Сохраняем пользователей"""
-        try:
-            data = {
-                "users": self.users,
-                "transactions": self.transactions,
-                "pending_orders": self.pending_orders
-            }
-            with open(config.USERS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Ошибка сохранения пользователей: {e}")
-    
-    # Работа с пользователями
-    def get_user(self, user_id: int) -> Dict:
-        if user_id not in self.users:
-            self.users[user_id] = {
-                "total_spent": 0.0,
-                "total_orders": 0,
-                "registration_date": datetime.now().isoformat(),
-                "last_activity": datetime.now().isoformat()
-            }
-            self.save_users_data()
-        return self.users[user_id]
-    
-    def update_user_stats(self, user_id: int, amount: float):
-        """Обновить статистику пользователя после покупки"""
-        try:
-            user = self.get_user(user_id)
-            user["total_spent"] = user.get("total_spent", 0.0) + amount
-            user["total_orders"] = user.get("total_orders", 0) + 1
-            user["last_activity"] = datetime.now().isoformat()
-            
-            transaction = {
-                "id": len(self.transactions) + 1,
-                "user_id": user_id,
-                "type": "purchase",
-                "amount": amount,
-                "description": "Оплата товара",
-                "date": datetime.now().isoformat()
-            }
-            self.transactions.append(transaction)
-            
-            self.save_users_data()
-        except Exception as e:
-            print(f"Ошибка обновления статистики: {e}")
-    
-    # Работа с ожидающими заказами
-    def add_pending_order(self, order_id: str, order_data: Dict):
-        """Добавить ожидающий заказ"""
-        self.pending_orders[order_id] = order_data
-        self.save_users_data()
-    
-    def get_pending_order(self, order_id: str) -> Optional[Dict]:
-        """Получить ожидающий заказ"""
-        return self.pending_orders.get(order_id)
-    
-    def remove_pending_order(self, order_id: str):
-        """Удалить ожидающий заказ"""
-        if order_id in self.pending_orders:
-            del self.pending_orders[order_id]
-            self.save_users_data()
-    
-    # Работа с категориями и товарами
-    def get_categories(self) -> List[Dict]:
-        return self.categories
-    
-    def get_category(self, category_id: int) -> Optional[Dict]:
-        for category in self.categories:
-            if category["id"] == category_id:
-                return category
-        return None
-    
-    def add_category(self, name: str) -> int:
-        new_id = max([cat["id"] for cat in self.categories], default=0) + 1
-        self.categories.append({"id": new_id, "name": name})
-        self.save_products_data()
-        return new_id
-    
-    def get_products_by_category(self, category_id: int) -> List[Dict]:
-        return [p for p in self.products if p["category_id"] == category_id]
-    
-    def get_all_products(self) -> List[Dict]:
-        """Получить все товары"""
-        return self.products
-    
-    def get_product(self, product_id: int) -> Optional[Dict]:
-        for product in self.products:
-            if product["id"] == product_id:
-                return product
-        return None
-    
-    def add_product(self, category_id: int, name: str, price: float, description: str = "", quantity: int = 9999) -> int:
-        new_id = max([prod["id"] for prod in self.products], default=0) + 1
-        product = {
-            "id": new_id,
-            "category_id": category_id,
-            "name": name,
-            "price": price,
-            "description": description,
-            "quantity": quantity
-        }
-        self.products.append(product)
-        self.save_products_data()
-        return new_id
-    
-    def delete_product(self, product_id: int) -> bool:
-        initial_len = len(self.products)
-        self.products = [prod for prod in self.products if prod["id"] != product_id]
-        self.save_products_data()
-        return len(self.products) < initial_len
-
-db = Database()
-
-# ==================== МЕНЕДЖЕР КОРЗИНЫ ====================
-
-class CartManager:
-    """Менеджер корзины пользователя"""
-    
-    def __init__(self):
-        self.carts: Dict[int, List[Dict]] = {}  # user_id -> список товаров в корзине
-        self.load_carts()
-    
-    def load_carts(self):
-        """Загрузить корзины из файла"""
-        try:
-            if os.path.exists('carts_data.json'):
-                with open('carts_data.json', 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # Конвертируем ключи строк в int
-                    self.carts = {int(k): v for k, v in data.items()}
-            else:
-                self.carts = {}
-        except Exception as e:
-            print(f"Ошибка загрузки корзин: {e}")
-            self.carts = {}
-    
-    def save_carts(self):
-        """Сохранить корзины в файл"""
-        try:
-            with open('carts_data.json', 'w', encoding='utf-8') as f:
-                json.dump(self.carts, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Ошибка сохранения корзин: {e}")
-    
-    def get_cart(self, user_id: int) -> List[Dict]:
-        """Получить корзину пользователя"""
-        if user_id not in self.carts:
-            self.carts[user_id] = []
-        return self.carts[user_id]
-    
-    def add_to_cart(self, user_id: int, product_id: int, quantity: int = 1) -> bool:
-        """Добавить товар в корзину"""
-        try:
-            cart = self.get_cart(user_id)
-            product = db.get_product(product_id)
-            
-            if not product:
-                return False
-            
-            # Проверяем наличие товара
-            if quantity > product.get('quantity', 9999):
-                return False
-            
-            # Проверяем, есть ли уже товар в корзине
-            for item in cart:
-                if item['product_id'] == product_id:
-                    item['quantity'] += quantity
-                    self.save_carts()
-                    return True
-            
-            # Добавляем новый товар
-            cart.append({
-                'product_id': product_id,
-                'quantity': quantity,
-                'added_at': datetime.now().isoformat()
-            })
-            self.save_carts()
-            return True
-            
-        except Exception as e:
-            print(f"Ошибка добавления в корзину: {e}")
-            return False
-    
-    def remove_from_cart(self, user_id: int, product_id: int) -> bool:
-        """Удалить товар из корзины"""
-        try:
-            cart = self.get_cart(user_id)
-            initial_len = len(cart)
-            self.carts[user_id] = [item for item in cart if item['product_id'] != product_id]
-            
-            if len(self.carts[user_id]) < initial_len:
-                self.save_carts()
-                return True
-            return False
-            
-        except Exception as e:
-            print(f"Ошибка удаления из корзины: {e}")
-            return False
-    
-    def update_quantity(self, user_id: int, product_id: int, quantity: int) -> bool:
-        """Обновить количество товара в корзине"""
-        try:
-            cart = self.get_cart(user_id)
-            product = db.get_product(product_id)
-            
-            if not product:
-                return False
-            
-            # Проверяем наличие товара
-            if quantity > product.get('quantity', 9999):
-                return False
-            
-            for item in cart:
-                if item['product_id'] == product_id:
-                    item['quantity'] = quantity
-                    self.save_carts()
-                    return True
-            
-            return False
-            
-        except Exception as e:
-            print(f"Ошибка обновления количества: {e}")
-            return False
-    
-    def clear_cart(self, user_id: int) -> bool:
-        """Очистить корзину"""
-        try:
-            if user_id in self.carts:
-                del self.carts[user_id]
-                self.save_carts()
-                return True
-            return False
-        except Exception as e:
-            print(f"Ошибка очистки корзины: {e}")
-            return False
-    
-    def get_cart_total(self, user_id: int) -> Dict:
-        """Получить итог корзины"""
-        try:
-            cart = self.get_cart(user_id)
-            total_amount = 0.0
-            total_quantity = 0
-            items_details = []
-            
-            for item in cart:
-                product = db.get_product(item['product_id'])
-                if product:
-                    price = float(product['price'])
-                    quantity = item['quantity']
-                    item_total = price * quantity
-                    
-                    total_amount += item_total
-                    total_quantity += quantity
-                    
-                    items_details.append({
-                        'product_id': product['id'],
-                        'name': product['name'],
-                        'price': price,
-                        'quantity': quantity,
-                        'item_total': item_total
-                    })
-            
-            return {
-                'total_amount': total_amount,
-                'total_quantity': total_quantity,
-                'items': items_details,
-                'items_count': len(items_details)
-            }
-            
-        except Exception as e:
-            print(f"Ошибка расчета итога корзины: {e}")
-            return {'total_amount': 0, 'total_quantity': 0, 'items': [], 'items_count': 0}
-    
-    def get_cart_items_count(self, user_id: int) -> int:
-        """Получить количество товаров в корзине"""
-        return len(self.get_cart(user_id))
-
-# Создаем экземпляр менеджера корзины
-cart_manager = CartManager()
-
-# ==================== УТИЛИТЫ ====================
-
-async def send_to_order_channel(order_data: Dict, screenshot_file_id: str = None) -> Optional[int]:
-    """
-    Отправить заявку на покупку в канал заказов с кнопками подтверждения
-    """
-    try:
-        print(f"DEBUG: Начинаем отправку в канал заказов...")
-        print(f"DEBUG: Канал ID: {config.ORDER_CHANNEL_ID}")
-        print(f"DEBUG: Есть скриншот: {screenshot_file_id is not None}")
-        
-        # Проверяем, доступен ли канал
-        try:
-            chat = await bot.get_chat(config.ORDER_CHANNEL_ID)
-            print(f"DEBUG: Канал найден: {chat.title}")
-        except Exception as e:
-            print(f"ERROR: Не могу получить доступ к каналу {config.ORDER_CHANNEL_ID}: {e}")
-            return None
-        
-        # Формируем основную информацию
-        user_info = order_data.get('username', 'без username')
-        user_id = order_data.get('user_id')
-        order_id = order_data.get('order_id', 'N/A')
-        total_amount = order_data.get('total', 0)
-        product_name = order_data.get('product_name', 'Неизвестный товар')
-        product_price = order_data.get('product_price', 0)
-        
-        # Проверяем наличие username
-        if user_info == 'без username':
-            username_warning = "⚠️ ВНИМАНИЕ: У покупателя НЕТ USERNAME!"
-        else:
-            username_warning = ""
-        
-        message_text = f"""🛒 НОВЫЙ ЗАКАЗ
-
-👤 Покупатель: @{user_info}
-🆔 ID: {user_id}
-📦 Товар: {product_name}
-💰 Цена: {product_price:.2f}₽
-💳 Способ оплаты: Ozon (СБП/Карта)
-📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}
-🆔 ID заказа: {order_id}
-"""
-        
-        if username_warning:
-            message_text += f"\n{username_warning}"
-        
-        if screenshot_file_id:
-            message_text += "\n📸 Прикреплен скриншот оплаты"
-        
-        # Сохраняем данные заказа
-        db.add_pending_order(order_id, {
-            'user_id': user_id,
-            'username': user_info,
-            'order_id': order_id,
-            'total': total_amount,
-            'product_name': product_name,
-            'product_price': product_price,
-            'payment_method': 'Ozon (СБП/Карта)',
-            'date': datetime.now().isoformat(),
-            'has_username': user_info != 'без username'  # Флаг наличия username
-        })
-        
-        # Создаем клавиатуру с кнопками подтверждения
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(
-                text='✅ Подтвердить заказ',
-                callback_data=f'confirm_order_{order_id}'
-            )
-        )
-        builder.row(
-            InlineKeyboardButton(
-                text='❌ Отклонить',
-                callback_data=f'reject_order_{order_id}'
-            )
-        )
-        
-        # Если у пользователя нет username, добавляем предупреждение
-        if user_info == 'без username':
-            builder.row(
-                InlineKeyboardButton(
-                    text='⚠️ НЕТ USERNAME!',
-                    callback_data=f'no_username_{order_id}'
-                )
-            )
-        
-        keyboard = builder.as_markup()
-        
-        # Отправляем сообщение в канал
-        try:
-            if screenshot_file_id:
-                print(f"DEBUG: Отправляю фото с ID: {screenshot_file_id}")
-                message = await bot.send_photo(
-                    chat_id=config.ORDER_CHANNEL_ID,
-                    photo=screenshot_file_id,
-                    caption=message_text,
-                    reply_markup=keyboard
-                )
-            else:
-                print(f"DEBUG: Отправляю текстовое сообщение")
-                message = await bot.send_message(
-                    chat_id=config.ORDER_CHANNEL_ID,
-                    text=message_text,
-                    reply_markup=keyboard
-                )
-            
-            print(f"✅ Заказ успешно отправлен в канал. Message ID: {message.message_id}")
-            return message.message_id
-            
-        except Exception as e:
-            print(f"❌ Ошибка отправки в канал: {e}")
-            print(f"❌ Тип ошибки: {type(e).__name__}")
-            import traceback
-            print(f"❌ Трассировка ошибки:\n{traceback.format_exc()}")
-            return None
-        
-    except Exception as e:
-        print(f"❌ Критическая ошибка в send_to_order_channel: {e}")
-        import traceback
-        print(f"❌ Трассировка ошибки:\n{traceback.format_exc()}")
-        return None
-
-async def send_cart_to_order_channel(order_data: Dict, screenshot_file_id: str = None) -> Optional[int]:
-    """
-    Отправить заказ из корзины в канал заказов
-    """
-    try:
-        user_info = order_data.get('username', 'без username')
-        user_id = order_data.get('user_id')
-        order_id = order_data.get('order_id', 'N/A')
-        cart_total = order_data.get('cart_total', {})
-        
-        if cart_total['items_count'] == 0:
-            print("❌ Пустая корзина при отправке в канал")
-            return None
-        
-        # Формируем текст с товарами
-        items_text = "📦 Состав заказа:\n"
-        for item in cart_total['items']:
-            items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
-        
-        message_text = f"""🛒 НОВЫЙ ЗАКАЗ ИЗ КОРЗИНЫ
-
-👤 Покупатель: @{user_info}
-🆔 ID: {user_id}
-{items_text}
-📦 Всего товаров: {cart_total['total_quantity']} шт.
-💰 Общая сумма: {cart_total['total_amount']:.2f}₽
-💳 Способ оплаты: Ozon (СБП/Карта)
-📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}
-🆔 ID заказа: {order_id}
-"""
-        
-        if user_info == 'без username':
-            message_text += "\n⚠️ ВНИМАНИЕ: У покупателя НЕТ USERNAME!"
-        
-        if screenshot_file_id:
-            message_text += "\n📸 Прикреплен скриншот оплаты"
-        
-        # Сохраняем данные заказа
-        db.add_pending_order(order_id, {
-            'user_id': user_id,
-            'username': user_info,
-            'order_id': order_id,
-            'total': cart_total['total_amount'],
-            'is_cart_order': True,
-            'cart_items': cart_total['items'],
-            'total_quantity': cart_total['total_quantity'],
-            'payment_method': 'Ozon (СБП/Карта)',
-            'date': datetime.now().isoformat(),
-            'has_username': user_info != 'без username'
-        })
-        
-        # Создаем клавиатуру
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(
-                text='✅ Подтвердить заказ',
-                callback_data=f'confirm_order_{order_id}'
-            )
-        )
-        builder.row(
-            InlineKeyboardButton(
-                text='❌ Отклонить',
-                callback_data=f'reject_order_{order_id}'
-            )
-        )
-        
-        if user_info == 'без username':
-            builder.row(
-                InlineKeyboardButton(
-                    text='⚠️ НЕТ USERNAME!',
-                    callback_data=f'no_username_{order_id}'
-                )
-            )
-        
-        keyboard = builder.as_markup()
-        
-        # Отправляем сообщение в канал
-        if screenshot_file_id:
-            message = await bot.send_photo(
-                chat_id=config.ORDER_CHANNEL_ID,
-                photo=screenshot_file_id,
-                caption=message_text,
-                reply_markup=keyboard
-            )
-        else:
-            message = await bot.send_message(
-                chat_id=config.ORDER_CHANNEL_ID,
-                text=message_text,
-                reply_markup=keyboard
-            )
-        
-        print(f"✅ Заказ из корзины отправлен в канал. Message ID: {message.message_id}")
-        return message.message_id
-        
-    except Exception as e:
-        print(f"❌ Ошибка отправки заказа из корзины: {e}")
-        import traceback
-        print(f"❌ Трассировка ошибки:\n{traceback.format_exc()}")
-        return None
-
-# ==================== КЛАВИАТУРЫ ====================
-
-def main_menu_kb(user_id: int = None) -> InlineKeyboardMarkup:
-    """Главное меню с учетом прав администратора"""
-    builder = InlineKeyboardBuilder()
-    
-    # Добавляем кнопку корзины с количеством товаров
-    cart_count = cart_manager.get_cart_items_count(user_id) if user_id else 0
-    cart_text = f'🛒 Корзина ({cart_count})' if cart_count > 0 else '🛒 Корзина'
-    
-    builder.row(
-        InlineKeyboardButton(text='🛒 Посмотреть услуги', callback_data='view_categories'),
-    )
-    builder.row(
-        InlineKeyboardButton(text=cart_text, callback_data='view_cart'),
-        InlineKeyboardButton(text='🆘 Поддержка', callback_data='support'),
-    )
-    
-    # Добавляем кнопку админ-панели для администраторов
-    if user_id in config.ADMIN_IDS:
-        builder.row(
-            InlineKeyboardButton(text='👨‍💼 Админ-панель', callback_data='admin_panel'),
-        )
-    
-    return builder.as_markup()
-
-def categories_kb() -> InlineKeyboardMarkup:
-    """Категории товаров"""
-    builder = InlineKeyboardBuilder()
-    categories = db.get_categories()
-    
-    for category in categories:
-        builder.row(
-            InlineKeyboardButton(
-                text=category["name"], 
-                callback_data=f"category_{category['id']}"
-            )
-        )
-    
-    # Добавляем кнопку корзины
-    cart_count = cart_manager.get_cart_items_count(categories_kb.__code__.co_argcount)  # Пример
-    cart_text = f'🛒 Корзина ({cart_count})' if cart_count > 0 else '🛒 Корзина'
-    
-    builder.row(
-        InlineKeyboardButton(text=cart_text, callback_data='view_cart'),
-        InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu'),
-    )
-    return builder.as_markup()
-
-def products_kb(category_id: int, page: int = 0, items_per_page: int = 5) -> InlineKeyboardMarkup:
-    """Товары в категории с пагинацией"""
-    builder = InlineKeyboardBuilder()
-    products = db.get_products_by_category(category_id)
-    
-    if not products:
-        builder.row(
-            InlineKeyboardButton(
-                text="📭 Нет товаров в этой категории",
-                callback_data="no_action"
-            )
-        )
-    else:
-        # Разбиваем на страницы
-        total_pages = max(1, (len(products) + items_per_page - 1) // items_per_page)
-        start_idx = page * items_per_page
-        end_idx = min(start_idx + items_per_page, len(products))
-        
-        # Показываем товары текущей страницы
-        for product in products[start_idx:end_idx]:
-            # Сокращаем название если слишком длинное
-            product_name = product['name']
-            if len(product_name) > 25:
-                product_name = product_name[:22] + "..."
-            
-            builder.row(
-                InlineKeyboardButton(
-                    text=f"📦 {product_name} - {product['price']}₽",
-                    callback_data=f"product_{product['id']}"
-                )
-            )
-        
-        # Кнопки навигации
-        nav_buttons = []
-        if page > 0:
-            nav_buttons.append(
-                InlineKeyboardButton(
-                    text="⬅️ Назад",
-                    callback_data=f"page_{category_id}_{page-1}"
-                )
-            )
-        
-        # Кнопка "информация о странице" в центре
-        if total_pages > 1:
-            nav_buttons.append(
-                InlineKeyboardButton(
-                    text=f"{page+1}/{total_pages}",
-                    callback_data="no_action"
-                )
-            )
-        
-        if page < total_pages - 1:
-            nav_buttons.append(
-                InlineKeyboardButton(
-                    text="Вперед ➡️",
-                    callback_data=f"page_{category_id}_{page+1}"
-                )
-            )
-        
-        if nav_buttons:
-            builder.row(*nav_buttons)
-    
-    # Кнопка корзины
-    cart_count = cart_manager.get_cart_items_count(products_kb.__code__.co_argcount)
-    cart_text = f'🛒 Корзина ({cart_count})' if cart_count > 0 else '🛒 Корзина'
-    
-    builder.row(
-        InlineKeyboardButton(text=cart_text, callback_data='view_cart'),
-    )
-    builder.row(
-        InlineKeyboardButton(text='🔙 Назад к категориям', callback_data='view_categories'),
-        InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu')
-    )
-    
-    return builder.as_markup()
-
-def product_detail_kb(product_id: int, category_id: int) -> InlineKeyboardMarkup:
-    """Детали товара - ОБНОВЛЕНО с корзиной"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text='🛒 Добавить в корзину', callback_data=f'add_to_cart_{product_id}'),
-        InlineKeyboardButton(text='💳 Купить сейчас', callback_data=f'buy_product_{product_id}')
-    )
-    
-    # Кнопка корзины
-    cart_count = cart_manager.get_cart_items_count(product_detail_kb.__code__.co_argcount)
-    cart_text = f'🛒 Моя корзина ({cart_count})' if cart_count > 0 else '🛒 Моя корзина'
-    
-    builder.row(
-        InlineKeyboardButton(text=cart_text, callback_data='view_cart'),
-    )
-    builder.row(
-        InlineKeyboardButton(text='🔙 Назад', callback_data=f'category_{category_id}'),
-        InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu')
-    )
-    return builder.as_markup()
-
-def cart_kb(cart_items: List[Dict], show_checkout: bool = True) -> InlineKeyboardMarkup:
-    """Клавиатура для управления корзиной"""
-    builder = InlineKeyboardBuilder()
-    
-    # Кнопки для каждого товара в корзине
-    for item in cart_items:
-        product = db.get_product(item['product_id'])
-        if product:
-            product_name = product['name']
-            if len(product_name) > 20:
-                product_name = product_name[:17] + "..."
-            
-            builder.row(
-                InlineKeyboardButton(
-                    text=f"➖ {product_name} x{item['quantity']}",
-                    callback_data=f"cart_remove_{item['product_id']}"
-                )
-            )
-    
-    # Кнопки управления
-    if cart_items:
-        if show_checkout:
-            builder.row(
-                InlineKeyboardButton(text='✅ Оформить заказ', callback_data='cart_checkout'),
-                InlineKeyboardButton(text='🗑️ Очистить корзину', callback_data='cart_clear')
-            )
-        
-        builder.row(
-            InlineKeyboardButton(text='➕ Добавить еще товары', callback_data='view_categories'),
-            InlineKeyboardButton(text='✏️ Изменить количество', callback_data='cart_edit_quantity')
-        )
-    
-    builder.row(
-        InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu')
-    )
-    
-    return builder.as_markup()
-
-def cart_checkout_kb() -> InlineKeyboardMarkup:
-    """Клавиатура для оформления заказа из корзины"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text='✅ Подтвердить заказ', callback_data='cart_confirm_payment'),
-        InlineKeyboardButton(text='✏️ Изменить корзину', callback_data='view_cart')
-    )
-    builder.row(
-        InlineKeyboardButton(text='❌ Отменить', callback_data='main_menu')
-    )
-    return builder.as_markup()
-
-def cancel_kb() -> InlineKeyboardMarkup:
-    """Клавиатура отмены"""
-    builder = InlineKeyboardBuilder()
-    builder.row(InlineKeyboardButton(text='❌ Отмена', callback_data='main_menu'))
-    return builder.as_markup()
-
-def admin_panel_kb() -> InlineKeyboardMarkup:
-    """Клавиатура админ-панели"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text='📦 Управление товарами', callback_data='admin_products'),
-        InlineKeyboardButton(text='📁 Управление категориями', callback_data='admin_categories')
-    )
-    builder.row(
-        InlineKeyboardButton(text='👥 Пользователи', callback_data='admin_users'),
-        InlineKeyboardButton(text='📊 Статистика', callback_data='admin_stats')
-    )
-    builder.row(
-        InlineKeyboardButton(text='⏳ Ожидающие заявки', callback_data='admin_pending'),
-    )
-    builder.row(
-        InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu')
-    )
-    return builder.as_markup()
-
-def admin_products_kb() -> InlineKeyboardMarkup:
-    """Клавиатура управления товарами"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text='➕ Добавить товар', callback_data='admin_add_product'),
-        InlineKeyboardButton(text='🗑️ Удалить товар', callback_data='admin_delete_product')
-    )
-    builder.row(
-        InlineKeyboardButton(text='📋 Список товаров', callback_data='admin_list_products')
-    )
-    builder.row(
-        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
-    )
-    return builder.as_markup()
-
-def admin_categories_kb() -> InlineKeyboardMarkup:
-    """Клавиатура управления категориями"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text='➕ Добавить категорию', callback_data='admin_add_category'),
-        InlineKeyboardButton(text='📋 Список категорий', callback_data='admin_list_categories')
-    )
-    builder.row(
-        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
-    )
-    return builder.as_markup()
-
-def admin_list_products_kb() -> InlineKeyboardMarkup:
-    """Клавиатура списка товаров"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_products')
-    )
-    return builder.as_markup()
-
-def admin_list_categories_kb() -> InlineKeyboardMarkup:
-    """Клавиатура списка категорий"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_categories')
-    )
-    return builder.as_markup()
-
-# ==================== ОБРАБОТЧИКИ КОМАНД ====================
-
-@dp.message(CommandStart())
-async def handle_start(message: Message):
-    """Обработка команды /start"""
-    try:
-        user_id = message.from_user.id
-        username = message.from_user.username
-        
-        # Проверяем наличие юзернейма
-        if not username:
-            warning_text = """⚠️ ВНИМАНИЕ!
-
-У вас не установлен username в Telegram.
-
-Это может привести к проблемам:
-1. Я не смогу связаться с вами для отправки товара
-2. Администраторы не смогут уточнить детали заказа
-
-📌 Как установить username:
-1. Откройте Настройки Telegram
-2. Выберите "Имя пользователя" (Username)
-3. Установите уникальное имя (например, @ivan_ivanov)
-4. Сохраните изменения
-
-После установки username нажмите /start снова."""
-            
-            await message.answer(
-                text=warning_text,
-                reply_markup=main_menu_kb(user_id)
-            )
-            return
-        
-        # Регистрируем пользователя
-        db.get_user(user_id)
-        
-        # Показываем количество товаров в корзине
-        cart_count = cart_manager.get_cart_items_count(user_id)
-        cart_info = f"\n🛒 Товаров в корзине: {cart_count}" if cart_count > 0 else ""
-        
-        welcome_text = f"""👋 Добро пожаловать, @{username}!{cart_info}
-
-✨ Возможности:
-• 🛒 Просмотр и покупка услуг
-• 🛍️ Корзина для покупки нескольких товаров
-• 💳 Оплата через Ozon (СБП/Карта)
-• ✅ Подтверждение заказов администраторами
-
-Используйте кнопки ниже для навигации:
-"""
-        
-        await message.answer(
-            text=welcome_text,
-            reply_markup=main_menu_kb(user_id)
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при обработке /start: {e}")
-        await message.answer("❌ Произошла ошибка при запуске")
-
-@dp.message(Command("support"))
-async def handle_support_command(message: Message):
-    """Обработка команды /support"""
-    try:
-        user_id = message.from_user.id
-        username = message.from_user.username or message.from_user.first_name
-        
-        support_text = f"""🆘 Поддержка
-
-По всем вопросам обращайтесь:
-👨‍💼 Администратор: {config.ADMIN_USERNAME}
-
-📞 Контакты:
-• Telegram: {config.ADMIN_USERNAME}
-• Наш бот: @{message.bot.username}
-
-🕐 Режим работы: 24/7
-⏱️ Среднее время ответа: 5-15 минут
-
-💬 Мы поможем с:
-• Выбором и оформлением заказа
-• Оплатой товара
-• Получением товара
-• Возвратом средств
-• Техническими проблемами
-
-Ваш ID для связи: {user_id}
-"""
-        
-        # Создаем клавиатуру
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(
-                text='💬 Написать администратору',
-                url=f'https://t.me/{config.ADMIN_USERNAME.replace("@", "")}'
-            )
-        )
-        builder.row(
-            InlineKeyboardButton(
-                text='🛒 Посмотреть товары',
-                callback_data='view_categories'
-            ),
-            InlineKeyboardButton(
-                text='🏠 Главное меню',
-                callback_data='main_menu'
-            )
-        )
-        
-        await message.answer(
-            text=support_text,
-            reply_markup=builder.as_markup(),
-            disable_web_page_preview=True
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при обработке команды /support: {e}")
-        await message.answer("❌ Произошла ошибка при загрузке информации о поддержке")
-
-@dp.message(Command("admin"))
-async def handle_admin_command(message: Message):
-    """Обработка команды /admin"""
-    try:
-        user_id = message.from_user.id
-        
-        if user_id not in config.ADMIN_IDS:
-            await message.answer("⛔ У вас нет прав администратора")
-            return
-        
-        admin_text = """👨‍💼 Админ-панель
-
-Доступные команды:
-• /addproduct - Добавить новый товар
-• /addcategory <название> - Добавить категорию
-• /stats - Показать статистику
-
-Или используйте кнопки ниже:
-"""
-        
-        await message.answer(
-            text=admin_text,
-            reply_markup=admin_panel_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при обработке /admin: {e}")
-        await message.answer("❌ Ошибка при загрузке админ-панели")
-
-# ==================== ОСНОВНЫЕ ОБРАБОТЧИКИ ====================
-
-@dp.callback_query(F.data == 'main_menu')
-async def handle_main_menu(callback: CallbackQuery, state: FSMContext):
-    """Обработка перехода в главное меню"""
-    try:
-        await state.clear()
-        
-        await callback.message.edit_text(
-            text="🏠 Главное меню\n\nВыберите действие:",
-            reply_markup=main_menu_kb(callback.from_user.id)
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при переходе в главное меню: {e}")
-        await callback.answer("Произошла ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'view_categories')
-async def handle_view_categories(callback: CallbackQuery):
-    """Показать список категорий"""
-    try:
-        categories = db.get_categories()
-        
-        if not categories:
-            text = "📭 Категории пока отсутствуют"
-        else:
-            text = "📁 Выберите категорию:"
-        
-        await callback.message.edit_text(
-            text=text,
-            reply_markup=categories_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при загрузке категорий: {e}")
-        await callback.answer("Ошибка загрузки категорий", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('category_'))
-async def handle_category_products(callback: CallbackQuery):
-    """Показать товары в выбранной категории"""
-    try:
-        # Извлекаем ID категории
-        _, category_id_str = callback.data.split('_')
-        category_id = int(category_id_str)
-        
-        # Получаем категорию и товары
-        category = db.get_category(category_id)
-        products = db.get_products_by_category(category_id)
-        
-        if not products:
-            category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
-            text = f"📭 В категории '{category_name}' пока нет товаров"
-        else:
-            category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
-            items_per_page = 5
-            total_pages = max(1, (len(products) + items_per_page - 1) // items_per_page)
-            
-            text = f"🛒 Товары в категории '{category_name}':\n"
-            text += f"📄 Показано 1-{min(items_per_page, len(products))} из {len(products)} товаров\n\n"
-            text += "Выберите товар:"
-        
-        # Всегда показываем первую страницу при первом входе
-        await callback.message.edit_text(
-            text=text,
-            reply_markup=products_kb(category_id, page=0)
-        )
-        
-    except ValueError:
-        await callback.answer("Неверный ID категории", show_alert=True)
-    except Exception as e:
-        print(f"Ошибка при загрузке товаров категории: {e}")
-        await callback.answer("Ошибка загрузки товаров", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('product_'))
-async def handle_product_detail(callback: CallbackQuery):
-    """Показать детали товара"""
-    try:
-        # Извлекаем ID товара
-        _, product_id_str = callback.data.split('_')
-        product_id = int(product_id_str)
-        
-        # Получаем информацию о товаре
-        product = db.get_product(product_id)
-        if not product:
-            await callback.answer("Товар не найден", show_alert=True)
-            return
-        
-        # Получаем информацию о категории
-        category = db.get_category(product["category_id"])
-        
-        # Показываем количество товаров в корзине
-        cart_count = cart_manager.get_cart_items_count(callback.from_user.id)
-        cart_info = f"\n🛒 Товаров в корзине: {cart_count}" if cart_count > 0 else ""
-        
-        # Формируем текст
-        product_text = f"""📦 {product['name']}{cart_info}
-
-💰 Цена: {product['price']:.2f}₽
-📝 Описание: {product.get('description', 'Нет описания')}
-📊 В наличии: {product.get('quantity', 9999)} шт.
-📁 Категория: {category.get('name', 'Не указана') if category else 'Не указана'}
-"""
-        
-        await callback.message.edit_text(
-            text=product_text,
-            reply_markup=product_detail_kb(product_id, product["category_id"])
-        )
-        
-    except ValueError:
-        await callback.answer("Неверный ID товара", show_alert=True)
-    except Exception as e:
-        print(f"Ошибка при загрузке товара: {e}")
-        await callback.answer("Ошибка загрузки товара", show_alert=True)
-    
-    await callback.answer()
-
-# ==================== ОБРАБОТЧИКИ КОРЗИНЫ ====================
-
-@dp.callback_query(F.data == 'view_cart')
-async def handle_view_cart(callback: CallbackQuery, state: FSMContext):
-    """Показать корзину пользователя"""
-    try:
-        user_id = callback.from_user.id
-        cart = cart_manager.get_cart(user_id)
-        cart_total = cart_manager.get_cart_total(user_id)
-        
-        if not cart:
-            await callback.message.edit_text(
-                text="🛒 Ваша корзина пуста\n\n"
-                     "Добавьте товары из категорий!",
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🛍️ Посмотреть товары', callback_data='view_categories'))
-                    .add(InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu'))
-                    .adjust(1)
-                    .as_markup()
-            )
-            return
-        
-        # Формируем текст корзины
-        cart_text = "🛒 Ваша корзина:\n\n"
-        
-        for i, item_detail in enumerate(cart_total['items'], 1):
-            cart_text += f"{i}. {item_detail['name']}\n"
-            cart_text += f"   💰 {item_detail['price']:.2f}₽ × {item_detail['quantity']} = {item_detail['item_total']:.2f}₽\n\n"
-        
-        cart_text += f"📦 Всего товаров: {cart_total['total_quantity']} шт.\n"
-        cart_text += f"💸 Общая сумма: {cart_total['total_amount']:.2f}₽\n\n"
-        cart_text += "Выберите действие:"
-        
-        await state.set_state(CartStates.managing_cart)
-        await callback.message.edit_text(
-            text=cart_text,
-            reply_markup=cart_kb(cart)
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при показе корзины: {e}")
-        await callback.answer("Ошибка при загрузке корзины", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('add_to_cart_'))
-async def handle_add_to_cart(callback: CallbackQuery, state: FSMContext):
-    """Добавить товар в корзину"""
-    try:
-        # Извлекаем ID товара
-        product_id = int(callback.data.replace('add_to_cart_', ''))
-        
-        # Получаем информацию о товаре
-        product = db.get_product(product_id)
-        if not product:
-            await callback.answer("Товар не найден", show_alert=True)
-            return
-        
-        # Проверяем наличие товара
-        if product.get('quantity', 9999) <= 0:
-            await callback.answer("❌ Товар закончился", show_alert=True)
-            return
-        
-        # Добавляем в корзину
-        if cart_manager.add_to_cart(callback.from_user.id, product_id, 1):
-            # Обновляем кнопки в сообщении товара
-            product = db.get_product(product_id)
-            if product:
-                # Получаем информацию о категории
-                category = db.get_category(product["category_id"])
-                
-                # Показываем количество товаров в корзине
-                cart_count = cart_manager.get_cart_items_count(callback.from_user.id)
-                
-                product_text = f"""📦 {product['name']}
-
-💰 Цена: {product['price']:.2f}₽
-📝 Описание: {product.get('description', 'Нет описания')}
-📊 В наличии: {product.get('quantity', 9999)} шт.
-📁 Категория: {category.get('name', 'Не указана') if category else 'Не указана'}
-
-✅ Товар добавлен в корзину!
-🛒 Товаров в корзине: {cart_count}
-"""
-                
-                await callback.message.edit_text(
-                    text=product_text,
-                    reply_markup=product_detail_kb(product_id, product["category_id"])
-                )
-            
-            await callback.answer(f"✅ {product['name']} добавлен в корзину!")
-        else:
-            await callback.answer("❌ Ошибка при добавлении в корзину", show_alert=True)
-        
-    except Exception as e:
-        print(f"Ошибка при добавлении в корзину: {e}")
-        await callback.answer("❌ Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('cart_remove_'))
-async def handle_cart_remove(callback: CallbackQuery, state: FSMContext):
-    """Удалить товар из корзины"""
-    try:
-        # Извлекаем ID товара
-        product_id = int(callback.data.replace('cart_remove_', ''))
-        
-        # Удаляем из корзины
-        if cart_manager.remove_from_cart(callback.from_user.id, product_id):
-            # Обновляем сообщение корзины
-            cart = cart_manager.get_cart(callback.from_user.id)
-            cart_total = cart_manager.get_cart_total(callback.from_user.id)
-            
-            if not cart:
-                await callback.message.edit_text(
-                    text="✅ Товар удален из корзины!\n\n"
-                         "🛒 Ваша корзина теперь пуста",
-                    reply_markup=InlineKeyboardBuilder()
-                        .add(InlineKeyboardButton(text='🛍️ Посмотреть товары', callback_data='view_categories'))
-                        .add(InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu'))
-                        .adjust(1)
-                        .as_markup()
-                )
-            else:
-                cart_text = "🛒 Ваша корзина:\n\n"
-                
-                for i, item_detail in enumerate(cart_total['items'], 1):
-                    cart_text += f"{i}. {item_detail['name']}\n"
-                    cart_text += f"   💰 {item_detail['price']:.2f}₽ × {item_detail['quantity']} = {item_detail['item_total']:.2f}₽\n\n"
-                
-                cart_text += f"📦 Всего товаров: {cart_total['total_quantity']} шт.\n"
-                cart_text += f"💸 Общая сумма: {cart_total['total_amount']:.2f}₽\n\n"
-                cart_text += "Выберите действие:"
-                
-                await callback.message.edit_text(
-                    text=cart_text,
-                    reply_markup=cart_kb(cart)
-                )
-            
-            await callback.answer("✅ Товар удален из корзины")
-        else:
-            await callback.answer("❌ Товар не найден в корзине", show_alert=True)
-        
-    except Exception as e:
-        print(f"Ошибка при удалении из корзины: {e}")
-        await callback.answer("❌ Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'cart_clear')
-async def handle_cart_clear(callback: CallbackQuery, state: FSMContext):
-    """Очистить корзину"""
-    try:
-        if cart_manager.clear_cart(callback.from_user.id):
-            await callback.message.edit_text(
-                text="✅ Корзина очищена!",
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🛍️ Посмотреть товары', callback_data='view_categories'))
-                    .add(InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu'))
-                    .adjust(1)
-                    .as_markup()
-            )
-            await callback.answer("Корзина очищена")
-        else:
-            await callback.answer("❌ Корзина уже пуста", show_alert=True)
-        
-    except Exception as e:
-        print(f"Ошибка при очистке корзины: {e}")
-        await callback.answer("❌ Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'cart_checkout')
-async def handle_cart_checkout(callback: CallbackQuery, state: FSMContext):
-    """Оформление заказа из корзины"""
-    try:
-        user_id = callback.from_user.id
-        username = callback.from_user.username
-        
-        # Проверяем наличие юзернейма
-        if not username:
-            error_text = """⚠️ У вас не установлен username!
-
-Для оформления заказа необходимо:
-1. Установить username в настройках Telegram
-2. Нажать /start в этом боте
-3. Повторить покупку
-
-📌 Как установить username:
-1. Откройте Настройки Telegram
-2. Выберите "Имя пользователя" (Username)
-3. Установите уникальное имя
-4. Сохраните изменения"""
-            
-            await callback.message.edit_text(
-                text=error_text,
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🚀 Начать заново (/start)', callback_data='force_start'))
-                    .as_markup()
-            )
-            await callback.answer("❌ Установите username для покупки", show_alert=True)
-            return
-        
-        # Получаем итог корзины
-        cart_total = cart_manager.get_cart_total(user_id)
-        
-        if cart_total['items_count'] == 0:
-            await callback.answer("❌ Корзина пуста", show_alert=True)
-            return
-        
-        # Сохраняем данные для оплаты
-        await state.set_state(PaymentStates.waiting_for_screenshot)
-        
-        # Генерируем ID заказа
-        order_id = f"CART_{user_id}_{int(datetime.now().timestamp())}"
-        
-        # Получаем информацию о методе оплаты
-        payment_info = config.PAYMENT_DETAILS["ozon"]
-        
-        # Сохраняем данные корзины для отправки в канал
-        await state.update_data(
-            user_id=user_id,
-            username=username,
-            order_id=order_id,
-            payment_method='ozon',
-            payment_name=payment_info['name'],
-            cart_total=cart_total,
-            is_cart_order=True
-        )
-        
-        # Формируем текст с товарами из корзины
-        cart_items_text = ""
-        for item in cart_total['items']:
-            cart_items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
-        
-        payment_text = f"""🏦 Оплата через {payment_info['name']}
-
-🛒 Ваш заказ из корзины:
-{cart_items_text}
-📦 Всего товаров: {cart_total['total_quantity']} шт.
-💰 Общая сумма: {cart_total['total_amount']:.2f}₽
-
-👤 Ваш username: @{username}
-
-💳 Номер карты для перевода:
-{payment_info['card_number']}
-
-📱 Номер телефона для СБП:
-{payment_info['phone_number']}
-
-👤 Получатель:
-{payment_info['owner']}
-
-📝 В комментарии к переводу укажите:
-Заказ {order_id}
-
-📸 После оплаты отправьте скриншот чека в этот чат
-"""
-        
-        await callback.message.edit_text(
-            text=payment_text,
-            reply_markup=cart_checkout_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при оформлении заказа из корзины: {e}")
-        await callback.answer("❌ Ошибка", show_alert=True)
-        await state.clear()
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'cart_edit_quantity')
-async def handle_cart_edit_quantity(callback: CallbackQuery, state: FSMContext):
-    """Редактирование количества товаров в корзине"""
-    try:
-        user_id = callback.from_user.id
-        cart = cart_manager.get_cart(user_id)
-        
-        if not cart:
-            await callback.answer("Корзина пуста", show_alert=True)
-            return
-        
-        # Создаем клавиатуру для выбора товара для редактирования
-        builder = InlineKeyboardBuilder()
-        cart_total = cart_manager.get_cart_total(user_id)
-        
-        for item_detail in cart_total['items']:
-            product_name = item_detail['name']
-            if len(product_name) > 20:
-                product_name = product_name[:17] + "..."
-            
-            builder.row(
-                InlineKeyboardButton(
-                    text=f"✏️ {product_name} x{item_detail['quantity']}",
-                    callback_data=f"cart_edit_{item_detail['product_id']}"
-                )
-            )
-        
-        builder.row(
-            InlineKeyboardButton(text='🔙 Назад', callback_data='view_cart')
-        )
-        
-        await state.set_state(CartStates.waiting_for_quantity)
-        await callback.message.edit_text(
-            text="✏️ Редактирование количества\n\n"
-                 "Выберите товар, количество которого хотите изменить:",
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при редактировании количества: {e}")
-        await callback.answer("❌ Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('cart_edit_'))
-async def handle_cart_edit_item(callback: CallbackQuery, state: FSMContext):
-    """Выбор товара для редактирования количества"""
-    try:
-        product_id = int(callback.data.replace('cart_edit_', ''))
-        
-        # Сохраняем ID товара для редактирования
-        await state.update_data(edit_product_id=product_id)
-        
-        product = db.get_product(product_id)
-        if product:
-            product_name = product['name']
-        else:
-            product_name = "Товар"
-        
-        await callback.message.edit_text(
-            text=f"✏️ Введите новое количество для товара:\n"
-                 f"📦 {product_name}\n\n"
-                 f"Текущее количество: {cart_manager.get_cart(callback.from_user.id)[0]['quantity'] if cart_manager.get_cart(callback.from_user.id) else 1}\n\n"
-                 f"Введите число:",
-            reply_markup=InlineKeyboardBuilder()
-                .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
-                .as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при выборе товара для редактирования: {e}")
-        await callback.answer("❌ Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.message(CartStates.waiting_for_quantity)
-async def handle_quantity_input(message: Message, state: FSMContext):
-    """Обработка ввода нового количества"""
-    try:
-        # Получаем ID товара из состояния
-        data = await state.get_data()
-        product_id = data.get('edit_product_id')
-        
-        if not product_id:
-            await message.answer("❌ Ошибка: товар не выбран", reply_markup=cancel_kb())
-            await state.clear()
-            return
-        
-        # Проверяем ввод
-        try:
-            quantity = int(message.text.strip())
-        except ValueError:
-            await message.answer(
-                "❌ Неверный формат!\n\n"
-                "Введите целое число (например: 1, 2, 3):",
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
-                    .as_markup()
-            )
-            return
-        
-        if quantity <= 0:
-            await message.answer(
-                "❌ Количество должно быть больше 0!\n\n"
-                "Введите новое количество:",
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
-                    .as_markup()
-            )
-            return
-        
-        # Проверяем наличие товара
-        product = db.get_product(product_id)
-        if product and quantity > product.get('quantity', 9999):
-            await message.answer(
-                f"❌ Доступно только {product.get('quantity', 9999)} шт.!\n\n"
-                "Введите другое количество:",
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
-                    .as_markup()
-            )
-            return
-        
-        # Обновляем количество
-        if cart_manager.update_quantity(message.from_user.id, product_id, quantity):
-            # Очищаем состояние
-            await state.clear()
-            
-            # Показываем обновленную корзину
-            cart = cart_manager.get_cart(message.from_user.id)
-            cart_total = cart_manager.get_cart_total(message.from_user.id)
-            
-            cart_text = "🛒 Ваша корзина:\n\n"
-            
-            for i, item_detail in enumerate(cart_total['items'], 1):
-                cart_text += f"{i}. {item_detail['name']}\n"
-                cart_text += f"   💰 {item_detail['price']:.2f}₽ × {item_detail['quantity']} = {item_detail['item_total']:.2f}₽\n\n"
-            
-            cart_text += f"📦 Всего товаров: {cart_total['total_quantity']} шт.\n"
-            cart_text += f"💸 Общая сумма: {cart_total['total_amount']:.2f}₽\n\n"
-            cart_text += "✅ Количество обновлено!\n\n"
-            cart_text += "Выберите действие:"
-            
-            await message.answer(
-                text=cart_text,
-                reply_markup=cart_kb(cart)
-            )
-        else:
-            await message.answer(
-                "❌ Ошибка обновления количества",
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🛒 Вернуться в корзину', callback_data='view_cart'))
-                    .as_markup()
-            )
-            await state.clear()
-        
-    except Exception as e:
-        print(f"Ошибка при вводе количества: {e}")
-        await message.answer("❌ Ошибка", reply_markup=cancel_kb())
-        await state.clear()
-
-# ==================== ОБРАБОТКА ПОКУПКИ ТОВАРА ====================
-
-@dp.callback_query(F.data.startswith('buy_product_'))
-async def handle_buy_product(callback: CallbackQuery, state: FSMContext):
-    """Обработать покупку товара"""
-    try:
-        print(f"DEBUG: Начало обработки покупки: {callback.data}")
-        
-        # Проверяем наличие юзернейма у пользователя
-        username = callback.from_user.username
-        user_id = callback.from_user.id
-        
-        if not username:
-            print(f"DEBUG: У пользователя {user_id} нет username")
-            
-            error_text = """⚠️ У вас не установлен username!
-
-Для оформления заказа необходимо:
-1. Установить username в настройках Telegram
-2. Нажать /start в этом боте
-3. Повторить покупку
-
-📌 Как установить username:
-1. Откройте Настройки Telegram
-2. Выберите "Имя пользователя" (Username)
-3. Установите уникальное имя
-4. Сохраните изменения
-
-После установки username нажмите /start и попробуйте снова."""
-            
-            # Создаем клавиатуру с кнопкой /start
-            builder = InlineKeyboardBuilder()
-            builder.row(
-                InlineKeyboardButton(
-                    text='🚀 Начать заново (/start)',
-                    callback_data='force_start'
-                )
-            )
-            
-            await callback.message.edit_text(
-                text=error_text,
-                reply_markup=builder.as_markup()
-            )
-            
-            await callback.answer("❌ Установите username для покупки", show_alert=True)
-            return
-        
-        # Извлекаем ID товара
-        parts = callback.data.split('_')
-        print(f"DEBUG: parts = {parts}")
-        
-        if len(parts) != 3:
-            print(f"DEBUG: Неверный формат callback_data: {callback.data}")
-            await callback.answer("❌ Неверный формат запроса", show_alert=True)
-            return
-            
-        product_id_str = parts[2]
-        print(f"DEBUG: product_id_str = {product_id_str}")
-        
-        try:
-            product_id = int(product_id_str)
-        except ValueError:
-            print(f"DEBUG: Не удалось преобразовать '{product_id_str}' в число")
-            await callback.answer("❌ Неверный ID товара", show_alert=True)
-            return
-            
-        print(f"DEBUG: ID товара: {product_id}")
-        
-        # Получаем информацию о товаре
-        product = db.get_product(product_id)
-        print(f"DEBUG: Найден товар: {product}")
-        
-        if not product:
-            print("DEBUG: ❌ Товар не найден в базе")
-            await callback.answer("Товар не найден", show_alert=True)
-            return
-        
-        # Проверяем наличие товара
-        quantity = product.get('quantity', 9999)
-        print(f"DEBUG: Количество товара: {quantity}")
-        
-        if quantity <= 0:
-            print("DEBUG: ❌ Товар закончился")
-            await callback.answer("❌ Товар закончился", show_alert=True)
-            return
-        
-        # Генерируем ID заказа
-        order_id = f"ORD_{user_id}_{int(datetime.now().timestamp())}"
-        print(f"DEBUG: Сгенерирован order_id: {order_id}")
-        
-        # Получаем информацию о методе оплаты
-        payment_info = config.PAYMENT_DETAILS["ozon"]
-        
-        # Получаем цену товара безопасным способом
-        try:
-            if isinstance(product.get('price'), (int, float)):
-                product_price = float(product['price'])
-            elif isinstance(product.get('price'), str):
-                price_str = product['price'].replace('₽', '').replace('руб', '').replace(' ', '').strip()
-                product_price = float(price_str)
-            else:
-                print(f"DEBUG: Неизвестный формат цены: {product.get('price')}")
-                product_price = 0.0
-        except (ValueError, TypeError) as e:
-            print(f"DEBUG: Ошибка при обработке цены: {e}")
-            product_price = 0.0
-            
-        print(f"DEBUG: Цена товара: {product_price}")
-        print(f"DEBUG: Username пользователя: @{username}")
-        
-        # Устанавливаем состояние ожидания скриншота
-        await state.set_state(PaymentStates.waiting_for_screenshot)
-        print("DEBUG: Установлено состояние ожидания скриншота")
-        
-        # Сохраняем данные платежа
-        await state.update_data(
-            user_id=user_id,
-            username=username,
-            product_id=product_id,
-            product_name=product['name'],
-            product_price=product_price,
-            order_id=order_id,
-            payment_method='ozon',
-            payment_name=payment_info['name']
-        )
-        print("DEBUG: Данные сохранены в state")
-        
-        # Формируем инструкцию для пользователя
-        payment_text = f"""🏦 Оплата через {payment_info['name']}
-
-📦 Товар: {product['name']}
-💰 Сумма к оплате: {product_price:.2f}₽
-👤 Ваш username: @{username}
-
-💳 Номер карты для перевода:
-{payment_info['card_number']}
-
-📱 Номер телефона для СБП:
-{payment_info['phone_number']}
-
-👤 Получатель:
-{payment_info['owner']}
-
-📝 В комментарии к переводу укажите:
-Заказ {order_id}
-
-📸 После оплаты отправьте скриншот чека в этот чат
-"""
-        
-        await callback.message.edit_text(
-            text=payment_text,
-            reply_markup=cancel_kb()
-        )
-        print("DEBUG: Сообщение с инструкцией отправлено")
-        
-    except ValueError as e:
-        print(f"ERROR: ValueError при обработке покупки: {e}")
-        print(f"ERROR: Traceback: {traceback.format_exc()}")
-        await callback.answer("❌ Ошибка при обработке заказа", show_alert=True)
-        await state.clear()
-    except Exception as e:
-        print(f"ERROR: Общая ошибка при покупке товара: {e}")
-        print(f"ERROR: Traceback: {traceback.format_exc()}")
-        await callback.answer("❌ Ошибка при покупке", show_alert=True)
-        await state.clear()
-    
-    await callback.answer()
-
-# ==================== ОБРАБОТКА СКРИНШОТОВ ====================
-
-@dp.message(PaymentStates.waiting_for_screenshot, F.photo)
-async def handle_payment_screenshot(message: Message, state: FSMContext):
-    """Обработать полученный скриншот оплаты (обновленная версия)"""
-    try:
-        # Получаем file_id самого большого размера фото
-        file_id = message.photo[-1].file_id
-        
-        # Получаем данные платежа из состояния
-        data = await state.get_data()
-        
-        # Проверяем, это заказ из корзины или одиночный товар
-        is_cart_order = data.get('is_cart_order', False)
-        
-        # Очищаем состояние
-        await state.clear()
-        
-        if is_cart_order:
-            # Обработка заказа из корзины
-            await _process_cart_purchase_screenshot(message, data, file_id)
-        else:
-            # Обработка одиночного товара (старая логика)
-            await _process_purchase_screenshot(message, data, file_id)
-        
-    except Exception as e:
-        print(f"Ошибка при обработке скриншота: {e}")
-        await message.answer(
-            text="❌ Ошибка при обработке скриншота",
-            reply_markup=main_menu_kb(message.from_user.id)
-        )
-        await state.clear()
-
-async def _process_purchase_screenshot(message: Message, data: dict, file_id: str):
-    """Обработать скриншот оплаты заказа"""
-    try:
-        user_id = data.get('user_id')
-        username = data.get('username')
-        payment_name = data.get('payment_name')
-        order_id = data.get('order_id')
-        
-        # Явно преобразуем в float
-        try:
-            product_price = float(data.get('product_price', 0))
-        except (ValueError, TypeError) as e:
-            print(f"ERROR: Ошибка преобразования цены: {e}")
-            product_price = 0.0
-            
-        product_name = data.get('product_name', 'Неизвестный товар')
-        
-        print(f"DEBUG: Обработка скриншота для заказа {order_id}")
-        print(f"DEBUG: Пользователь: {username} (ID: {user_id})")
-        print(f"DEBUG: Товар: {product_name}, Цена: {product_price}")
-        print(f"DEBUG: File ID скриншота: {file_id}")
-        
-        # Формируем данные заказа
-        order_data = {
-            'user_id': user_id,
-            'username': username,
-            'order_id': order_id,
-            'total': product_price,
-            'product_name': product_name,
-            'product_price': product_price,
-            'payment_method': payment_name
-        }
-        
-        # Отправляем в канал
-        print(f"DEBUG: Вызываю send_to_order_channel...")
-        result = await send_to_order_channel(order_data, file_id)
-        
-        if result is None:
-            error_text = """❌ Не удалось отправить заявку.
-
-Возможные причины:
-1. Бот не добавлен в канал заказов
-2. У бота нет прав на отправку сообщений в канал
-3. Технические проблемы с Telegram
-
-Пожалуйста, обратитесь к администратору: @koliin98
-"""
-            await message.answer(
-                text=error_text,
-                reply_markup=main_menu_kb(user_id)
-            )
-            return
-        
-        # Обновляем статистику пользователя
-        try:
-            db.update_user_stats(user_id, product_price)
-            print(f"DEBUG: Статистика пользователя {user_id} обновлена")
-        except Exception as e:
-            print(f"ERROR: Ошибка обновления статистики: {e}")
-        
-        # Уведомляем пользователя
-        success_text = f"""✅ Заказ оформлен!
-
-🆔 Номер заказа: {order_id}
-📦 Товар: {product_name}
-💰 Сумма: {product_price:.2f}₽
-💳 Способ оплаты: {payment_name}
-
-📋 Заказ отправлен на обработку.
-Мы свяжемся с вами в ближайшее время.
-"""
-        
-        await message.answer(
-            text=success_text,
-            reply_markup=main_menu_kb(user_id)
-        )
-        print(f"DEBUG: Пользователь уведомлен об успешной отправке")
-        
-    except Exception as e:
-        print(f"❌ Ошибка при обработке скриншота заказа: {e}")
-        import traceback
-        print(f"❌ Трассировка ошибки:\n{traceback.format_exc()}")
-        
-        error_text = f"""❌ Ошибка при обработке заказа
-
-Произошла техническая ошибка.
-Пожалуйста, обратитесь к администратору: @koliin98
-
-Ошибка: {str(e)}
-"""
-        await message.answer(
-            text=error_text,
-            reply_markup=main_menu_kb(message.from_user.id)
-        )
-
-async def _process_cart_purchase_screenshot(message: Message, data: dict, file_id: str):
-    """Обработать скриншот оплаты заказа из корзины"""
-    try:
-        user_id = data.get('user_id')
-        username = data.get('username')
-        payment_name = data.get('payment_name')
-        order_id = data.get('order_id')
-        cart_total = data.get('cart_total', {})
-        
-        print(f"DEBUG: Обработка заказа из корзины {order_id}")
-        print(f"DEBUG: Пользователь: {username} (ID: {user_id})")
-        print(f"DEBUG: Товаров в корзине: {cart_total.get('items_count', 0)}")
-        print(f"DEBUG: Общая сумма: {cart_total.get('total_amount', 0)}")
-        
-        # Формируем данные заказа
-        order_data = {
-            'user_id': user_id,
-            'username': username,
-            'order_id': order_id,
-            'cart_total': cart_total,
-            'total': cart_total.get('total_amount', 0),
-            'payment_method': payment_name,
-            'is_cart_order': True
-        }
-        
-        # Отправляем в канал
-        result = await send_cart_to_order_channel(order_data, file_id)
-        
-        if result is None:
-            error_text = """❌ Не удалось отправить заявку.
-
-Возможные причины:
-1. Бот не добавлен в канал заказов
-2. У бота нет прав на отправку сообщений в канал
-3. Технические проблемы с Telegram
-
-Пожалуйста, обратитесь к администратору: @koliin98
-"""
-            await message.answer(
-                text=error_text,
-                reply_markup=main_menu_kb(user_id)
-            )
-            return
-        
-        # Обновляем статистику пользователя
-        try:
-            db.update_user_stats(user_id, cart_total.get('total_amount', 0))
-            print(f"DEBUG: Статистика пользователя {user_id} обновлена")
-        except Exception as e:
-            print(f"ERROR: Ошибка обновления статистики: {e}")
-        
-        # Очищаем корзину после успешной оплаты
-        cart_manager.clear_cart(user_id)
-        
-        # Формируем текст с товарами для уведомления пользователя
-        items_text = ""
-        for item in cart_total.get('items', []):
-            items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
-        
-        # Уведомляем пользователя
-        success_text = f"""✅ Заказ из корзины оформлен!
-
-🆔 Номер заказа: {order_id}
-🛒 Состав заказа:
-{items_text}
-📦 Всего товаров: {cart_total.get('total_quantity', 0)} шт.
-💰 Общая сумма: {cart_total.get('total_amount', 0):.2f}₽
-💳 Способ оплаты: {payment_name}
-
-📋 Заказ отправлен на обработку.
-Мы свяжемся с вами в ближайшее время.
-"""
-        
-        await message.answer(
-            text=success_text,
-            reply_markup=main_menu_kb(user_id)
-        )
-        print(f"DEBUG: Пользователь уведомлен об успешной отправке заказа из корзины")
-        
-    except Exception as e:
-        print(f"❌ Ошибка при обработке скриншота заказа из корзины: {e}")
-        import traceback
-        print(f"❌ Трассировка ошибки:\n{traceback.format_exc()}")
-        
-        error_text = f"""❌ Ошибка при обработке заказа
-
-Произошла техническая ошибка.
-Пожалуйста, обратитесь к администратору: @koliin98
-
-Ошибка: {str(e)}
-"""
-        await message.answer(
-            text=error_text,
-            reply_markup=main_menu_kb(message.from_user.id)
-        )
-
-@dp.callback_query(PaymentStates.waiting_for_screenshot, F.data == 'cancel')
-async def handle_cancel_payment(callback: CallbackQuery, state: FSMContext):
-    """Отмена оплаты"""
-    try:
-        await state.clear()
-        await callback.message.edit_text(
-            text="❌ Оплата отменена",
-            reply_markup=main_menu_kb(callback.from_user.id)
-        )
-    except Exception as e:
-        print(f"Ошибка при отмене оплаты: {e}")
-        await callback.answer("Ошибка при отмене", show_alert=True)
-    await callback.answer()
-
-@dp.callback_query(F.data == 'support')
-async def handle_support(callback: CallbackQuery):
-    """Обработка кнопки поддержки"""
-    try:
-        user_id = callback.from_user.id
-        username = callback.from_user.username or callback.from_user.first_name
-        
-        support_text = f"""🆘 Поддержка
-
-По всем вопросам обращайтесь:
-👨‍💼 Администратор: {config.ADMIN_USERNAME}
-
-🕐 Время ответа: 24/7
-💬 Мы поможем с:
-• Оформлением заказа
-• Оплатой товара
-• Получением товара
-• Техническими проблемами
-
-📝 Вы также можете написать напрямую администратору.
-Ваш ID для связи: {user_id}
-"""
-        
-        # Создаем клавиатуру с ссылкой на администратора
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(
-                text='💬 Написать администратору',
-                url=f'https://t.me/{config.ADMIN_USERNAME.replace("@", "")}'
-            )
-        )
-        builder.row(
-            InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu')
-        )
-        
-        await callback.message.edit_text(
-            text=support_text,
-            reply_markup=builder.as_markup(),
-            disable_web_page_preview=True
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при обработке поддержки: {e}")
-        await callback.answer("Произошла ошибка", show_alert=True)
-    
-    await callback.answer()
-
-# ==================== ОБРАБОТЧИКИ ПОДТВЕРЖДЕНИЯ АДМИНИСТРАТОРОМ ====================
-
-@dp.callback_query(F.data.startswith('confirm_order_'))
-async def handle_confirm_order(callback: CallbackQuery):
-    """Подтвердить заказ администратором"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        # Извлекаем ID заказа
-        order_id = callback.data.replace('confirm_order_', '')
-        
-        # Получаем данные заказа
-        order_data = db.get_pending_order(order_id)
-        if not order_data:
-            await callback.answer("Заказ не найден", show_alert=True)
-            return
-        
-        user_id = order_data.get('user_id')
-        total_amount = order_data.get('total', 0)
-        username = callback.from_user.username or callback.from_user.first_name
-        
-        # Проверяем, это заказ из корзины или одиночный
-        is_cart_order = order_data.get('is_cart_order', False)
-        
-        if is_cart_order:
-            product_name = f"Заказ из корзины ({order_data.get('total_quantity', 0)} товаров)"
-        else:
-            product_name = order_data.get('product_name', 'Неизвестный товар')
-        
-        # Удаляем из ожидающих
-        db.remove_pending_order(order_id)
-        
-        # Обновляем сообщение в канале
-        try:
-            if callback.message.photo:
-                # Для сообщений с фото
-                new_caption = callback.message.caption + f"\n\n✅ ПОДТВЕРЖДЕНО АДМИНИСТРАТОРОМ: @{username}"
-                await bot.edit_message_caption(
-                    chat_id=callback.message.chat.id,
-                    message_id=callback.message.message_id,
-                    caption=new_caption,
-                    reply_markup=None
-                )
-            else:
-                # Для текстовых сообщений
-                new_text = callback.message.text + f"\n\n✅ ПОДТВЕРЖДЕНО АДМИНИСТРАТОРОМ: @{username}"
-                await bot.edit_message_text(
-                    chat_id=callback.message.chat.id,
-                    message_id=callback.message.message_id,
-                    text=new_text,
-                    reply_markup=None
-                )
-        except Exception as e:
-            print(f"Ошибка обновления сообщения: {e}")
-        
-        # Уведомляем пользователя
-        try:
-            if is_cart_order:
-                # Формируем текст для заказа из корзины
-                cart_items_text = ""
-                cart_items = order_data.get('cart_items', [])
-                for item in cart_items:
-                    cart_items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
-                
-                user_message = f"""✅ Ваш заказ из корзины подтвержден администратором!
-
-🆔 Номер заказа: {order_id}
-🛒 Состав заказа:
-{cart_items_text}
-📦 Всего товаров: {order_data.get('total_quantity', 0)} шт.
-💰 Общая сумма: {total_amount:.2f}₽
-
-📦 Товары будут отправлены вам в ближайшее время.
-"""
-            else:
-                # Формируем текст для одиночного заказа
-                user_message = f"""✅ Ваш заказ подтвержден администратором!
-
-🆔 Номер заказа: {order_id}
-📦 Товар: {product_name}
-💰 Сумма: {total_amount:.2f}₽
-
-📦 Товар будет отправлен вам в ближайшее время.
-"""
-            
-            await bot.send_message(
-                chat_id=user_id,
-                text=user_message
-            )
-            print(f"✅ Заказ {order_id} подтвержден для пользователя {user_id}")
-        except Exception as e:
-            print(f"Ошибка уведомления пользователя: {e}")
-            await callback.answer("Пользователь не получил уведомление", show_alert=True)
-        
-        await callback.answer("✅ Заказ подтвержден")
-        
-    except Exception as e:
-        print(f"Ошибка при подтверждении заказа: {e}")
-        await callback.answer("❌ Ошибка при подтверждении", show_alert=True)
-
-@dp.callback_query(F.data.startswith('page_'))
-async def handle_page_change(callback: CallbackQuery):
-    """Обработка смены страницы"""
-    try:
-        # Извлекаем данные из callback_data: page_123_1 (где 123 - category_id, 1 - page)
-        parts = callback.data.split('_')
-        if len(parts) != 3:
-            await callback.answer("Неверный формат запроса", show_alert=True)
-            return
-            
-        category_id = int(parts[1])
-        page = int(parts[2])
-        
-        # Получаем категорию для отображения названия
-        category = db.get_category(category_id)
-        category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
-        
-        products = db.get_products_by_category(category_id)
-        items_per_page = 5
-        total_pages = max(1, (len(products) + items_per_page - 1) // items_per_page)
-        
-        if not products:
-            text = f"📭 В категории '{category_name}' пока нет товаров"
-        else:
-            start_idx = page * items_per_page + 1
-            end_idx = min((page + 1) * items_per_page, len(products))
-            
-            text = f"🛒 Товары в категории '{category_name}':\n"
-            text += f"📄 Показано {start_idx}-{end_idx} из {len(products)} товаров\n\n"
-            text += "Выберите товар:"
-        
-        await callback.message.edit_text(
-            text=text,
-            reply_markup=products_kb(category_id, page)
-        )
-        
-    except ValueError:
-        await callback.answer("Неверный ID категории", show_alert=True)
-    except Exception as e:
-        print(f"Ошибка при смене страницы: {e}")
-        await callback.answer("Ошибка загрузки товаров", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('reject_order_'))
-async def handle_reject_order(callback: CallbackQuery):
-    """Отклонить заказ администратором"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        # Извлекаем ID заказа
-        order_id = callback.data.replace('reject_order_', '')
-        
-        # Получаем данные заказа
-        order_data = db.get_pending_order(order_id)
-        if not order_data:
-            await callback.answer("Заказ не найден", show_alert=True)
-            return
-        
-        user_id = order_data.get('user_id')
-        total_amount = order_data.get('total', 0)
-        
-        # Проверяем, это заказ из корзины или одиночный
-        is_cart_order = order_data.get('is_cart_order', False)
-        
-        if is_cart_order:
-            product_name = f"Заказ из корзины ({order_data.get('total_quantity', 0)} товаров)"
-        else:
-            product_name = order_data.get('product_name', 'Неизвестный товар')
-        
-        # Удаляем из ожидающих
-        db.remove_pending_order(order_id)
-        
-        # Обновляем сообщение в канале
-        try:
-            if callback.message.photo:
-                await bot.edit_message_caption(
-                    chat_id=callback.message.chat.id,
-                    message_id=callback.message.message_id,
-                    caption=callback.message.caption + f"\n\n❌ ОТКЛОНЕНО АДМИНИСТРАТОРОМ: @{callback.from_user.username}",
-                    reply_markup=None
-                )
-            else:
-                await bot.edit_message_text(
-                    chat_id=callback.message.chat.id,
-                    message_id=callback.message.message_id,
-                    text=callback.message.text + f"\n\n❌ ОТКЛОНЕНО АДМИНИСТРАТОРОМ: @{callback.from_user.username}",
-                    reply_markup=None
-                )
-        except Exception as e:
-            print(f"Ошибка обновления сообщения: {e}")
-        
-        # Уведомляем пользователя
-        try:
-            message_text = f"""❌ Ваш заказ отклонен администратором!
-
-🆔 Номер заказа: {order_id}
-📦 Товар: {product_name}
-💰 Сумма: {total_amount:.2f}₽
-
-💳 Если есть вопросы, обратитесь в поддержку: {config.ADMIN_USERNAME}
-"""
-            
-            await bot.send_message(chat_id=user_id, text=message_text)
-        except Exception as e:
-            print(f"Ошибка уведомления пользователя: {e}")
-        
-        await callback.answer("❌ Заказ отклонен")
-        
-    except Exception as e:
-        print(f"Ошибка при отклонении заказа: {e}")
-        await callback.answer("❌ Ошибка при отклонении", show_alert=True)
-
-# ==================== АДМИН-ПАНЕЛЬ ====================
-
-@dp.callback_query(F.data == 'admin_panel')
-async def handle_admin_panel(callback: CallbackQuery):
-    """Показать админ-панель"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        # Статистика для админ-панели
-        pending_orders = len(db.pending_orders)
-        
-        admin_text = f"""👨‍💼 Админ-панель
-
-📊 Быстрая статистика:
-• 🛒 Ожидающих заказов: {pending_orders}
-• 👥 Пользователей: {len(db.users)}
-• 📦 Товаров: {len(db.products)}
-• 🛍️ Активных корзин: {len(cart_manager.carts)}
-
-Выберите раздел для управления:
-"""
-        
-        await callback.message.edit_text(
-            text=admin_text,
-            reply_markup=admin_panel_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при открытии админ-панели: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_pending')
-async def handle_admin_pending(callback: CallbackQuery):
-    """Показать ожидающие заявки"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        pending_orders = db.pending_orders
-        
-        if not pending_orders:
-            text = "📭 Нет ожидающих заказов"
-        else:
-            text = "⏳ Ожидающие заказы:\n\n"
-            
-            for i, (order_id, order_data) in enumerate(pending_orders.items(), 1):
-                text += f"{i}. 🆔 {order_id}\n"
-                text += f"   👤 @{order_data.get('username', 'N/A')} ({order_data.get('user_id')})\n"
-                
-                if order_data.get('is_cart_order'):
-                    text += f"   🛍️ Заказ из корзины ({order_data.get('total_quantity', 0)} товаров)\n"
-                else:
-                    text += f"   📦 {order_data.get('product_name', 'Неизвестно')}\n"
-                
-                text += f"   💰 {order_data.get('total', 0)}₽\n\n"
-        
-        # Создаем клавиатуру
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(text='🔄 Обновить', callback_data='admin_pending'),
-            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
-        )
-        
-        await callback.message.edit_text(
-            text=text,
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при показе ожидающих заявок: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_users')
-async def handle_admin_users(callback: CallbackQuery):
-    """Показать пользователей"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        users = db.users
-        if not users:
-            text = "📭 Пользователей пока нет"
-        else:
-            text = "👥 Пользователи:\n\n"
-            
-            # Сортируем по количеству заказов
-            sorted_users = sorted(
-                users.items(),
-                key=lambda x: x[1].get('total_orders', 0),
-                reverse=True
-            )
-            
-            for i, (user_id, user_data) in enumerate(sorted_users[:10], 1):  # Первые 10
-                total_spent = user_data.get('total_spent', 0)
-                total_orders = user_data.get('total_orders', 0)
-                reg_date = datetime.fromisoformat(user_data.get('registration_date', '2000-01-01')).strftime('%d.%m.%Y')
-                
-                text += f"{i}. 🆔 {user_id}\n"
-                text += f"   💸 Всего потрачено: {total_spent:.2f}₽\n"
-                text += f"   📦 Заказов: {total_orders}\n"
-                text += f"   📅 Регистрация: {reg_date}\n\n"
-        
-        # Создаем клавиатуру
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
-        )
-        
-        await callback.message.edit_text(
-            text=text,
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при показе пользователей: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_stats')
-async def handle_admin_stats(callback: CallbackQuery):
-    """Показать статистику"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        # Собираем статистику
-        categories_count = len(db.get_categories())
-        products_count = len(db.products)
-        users_count = len(db.users)
-        
-        # Статистика по транзакциям
-        purchases = [t for t in db.transactions if t['type'] == 'purchase']
-        total_purchases = sum(abs(t['amount']) for t in purchases)
-        
-        # Статистика по пользователям
-        total_orders = sum(user.get('total_orders', 0) for user in db.users.values())
-        total_spent = sum(user.get('total_spent', 0) for user in db.users.values())
-        
-        # Статистика по корзинам
-        active_carts = len(cart_manager.carts)
-        total_cart_items = sum(len(cart) for cart in cart_manager.carts.values())
-        
-        # Формируем сообщение
-        stats_text = f"""📊 СТАТИСТИКА БОТА
-
-📈 Общая статистика:
-• 📁 Категорий: {categories_count}
-• 📦 Товаров: {products_count}
-• 👥 Пользователей: {users_count}
-• ⏳ Ожидающих заказов: {len(db.pending_orders)}
-• 🛍️ Активных корзин: {active_carts}
-• 🛒 Товаров в корзинах: {total_cart_items}
-
-💰 Финансовая статистика:
-• 🛒 Покупок: {len(purchases)} на {total_purchases:.2f}₽
-• 💸 Всего потрачено: {total_spent:.2f}₽
-• 📦 Всего заказов: {total_orders}
-
-💳 Способ оплаты:
-• 🏦 Только Ozon (СБП/Карта)
-"""
-        
-        # Создаем клавиатуру
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
-        )
-        
-        await callback.message.edit_text(
-            text=stats_text,
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при показе статистики: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_products')
-async def handle_admin_products(callback: CallbackQuery):
-    """Управление товарами"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        await callback.message.edit_text(
-            text="📦 Управление товарами\n\nВыберите действие:",
-            reply_markup=admin_products_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при управлении товарами: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_categories')
-async def handle_admin_categories(callback: CallbackQuery):
-    """Управление категориями"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        await callback.message.edit_text(
-            text="📁 Управление категориями\n\nВыберите действие:",
-            reply_markup=admin_categories_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при управлении категориями: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_list_products')
-async def handle_admin_list_products(callback: CallbackQuery):
-    """Список товаров"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        products = db.get_all_products()
-        
-        if not products:
-            text = "📭 Товары пока отсутствуют"
-        else:
-            text = "📦 Список всех товаров:\n\n"
-            
-            for i, product in enumerate(products, 1):
-                category = db.get_category(product.get('category_id', 0))
-                category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
-                
-                text += f"{i}. 📦 {product['name']}\n"
-                text += f"   🆔 ID: {product['id']}\n"
-                text += f"   💰 Цена: {product['price']:.2f}₽\n"
-                text += f"   📁 Категория: {category_name}\n"
-                text += f"   📊 В наличии: {product.get('quantity', 9999)} шт.\n"
-                
-                if product.get('description'):
-                    text += f"   📝 Описание: {product['description'][:50]}...\n"
-                
-                text += "\n"
-        
-        await callback.message.edit_text(
-            text=text,
-            reply_markup=admin_list_products_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при показе списка товаров: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'force_start')
-async def handle_force_start(callback: CallbackQuery, state: FSMContext):
-    """Принудительный запуск бота с проверкой username"""
-    try:
-        await state.clear()
-        
-        user_id = callback.from_user.id
-        username = callback.from_user.username
-        
-        if not username:
-            error_text = """❌ Username не найден!
-
-Вы не установили username в Telegram.
-
-📌 Как установить username:
-1. Откройте Настройки Telegram
-2. Выберите "Имя пользователя" (Username)
-3. Установите уникальное имя
-4. Сохраните изменения
-
-После установки username нажмите /start"""
-            
-            await callback.message.edit_text(
-                text=error_text,
-                reply_markup=InlineKeyboardBuilder()
-                    .add(InlineKeyboardButton(text='🔄 Проверить снова', callback_data='force_start'))
-                    .as_markup()
-            )
-            return
-        
-        # Регистрируем пользователя
-        db.get_user(user_id)
-        
-        # Показываем количество товаров в корзине
-        cart_count = cart_manager.get_cart_items_count(user_id)
-        cart_info = f"\n🛒 Товаров в корзине: {cart_count}" if cart_count > 0 else ""
-        
-        welcome_text = f"""✅ Username обнаружен: @{username}{cart_info}
-
-👋 Добро пожаловать в магазин виртуальных услуг!
-
-✨ Возможности:
-• 🛒 Просмотр и покупка услуг
-• 🛍️ Корзина для покупки нескольких товаров
-• 💳 Оплата через Ozon (СБП/Карта)
-• ✅ Подтверждение заказов администраторами
-
-Теперь вы можете покупать товары!"""
-        
-        await callback.message.edit_text(
-            text=welcome_text,
-            reply_markup=main_menu_kb(user_id)
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при принудительном запуске: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_list_categories')
-async def handle_admin_list_categories(callback: CallbackQuery):
-    """Список категорий"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        categories = db.get_categories()
-        
-        if not categories:
-            text = "📭 Категории пока отсутствуют"
-        else:
-            text = "📁 Список категорий:\n\n"
-            
-            for i, category in enumerate(categories, 1):
-                products_count = len(db.get_products_by_category(category['id']))
-                text += f"{i}. {category['name']}\n"
-                text += f"   🆔 ID: {category['id']}\n"
-                text += f"   📦 Товаров: {products_count}\n\n"
-        
-        await callback.message.edit_text(
-            text=text,
-            reply_markup=admin_list_categories_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при показе списка категорий: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_delete_product')
-async def handle_admin_delete_product(callback: CallbackQuery, state: FSMContext):
-    """Удаление товара"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        products = db.get_all_products()
-        
-        if not products:
-            await callback.message.edit_text(
-                text="📭 Нет товаров для удаления",
-                reply_markup=admin_products_kb()
-            )
-            return
-        
-        # Создаем клавиатуру с товарами
-        builder = InlineKeyboardBuilder()
-        
-        for product in products:
-            product_name = product['name']
-            if len(product_name) > 25:
-                product_name = product_name[:22] + "..."
-            
-            builder.row(
-                InlineKeyboardButton(
-                    text=f"🗑️ {product_name} - {product['price']}₽",
-                    callback_data=f"admin_delete_product_confirm_{product['id']}"
-                )
-            )
-        
-        builder.row(
-            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_products')
-        )
-        
-        await callback.message.edit_text(
-            text="🗑️ Выберите товар для удаления:",
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при удалении товара: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('no_username_'))
-async def handle_no_username_warning(callback: CallbackQuery):
-    """Обработка предупреждения о отсутствии username"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        # Извлекаем ID заказа
-        order_id = callback.data.replace('no_username_', '')
-        
-        # Получаем данные заказа
-        order_data = db.get_pending_order(order_id)
-        if not order_data:
-            await callback.answer("Заказ не найден", show_alert=True)
-            return
-        
-        user_id = order_data.get('user_id')
-        
-        warning_text = f"""⚠️ ВНИМАНИЕ! У покупателя НЕТ USERNAME!
-
-🆔 ID заказа: {order_id}
-🆔 ID покупателя: {user_id}
-
-Действия:
-1. Отклонить заказ и попросить установить username
-2. Связаться с покупателем через личные сообщения по ID
-3. Попросить покупателя написать вам напрямую
-
-Риски:
-• Невозможно отправить товар
-• Невозможно уточнить детали
-• Покупатель может не получить уведомления"""
-        
-        await callback.answer(warning_text, show_alert=True)
-        
-    except Exception as e:
-        print(f"Ошибка при показе предупреждения: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-
-@dp.callback_query(F.data.startswith('admin_delete_product_confirm_'))
-async def handle_admin_delete_product_confirm(callback: CallbackQuery):
-    """Подтверждение удаления товара"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        # Извлекаем ID товара
-        product_id = int(callback.data.replace('admin_delete_product_confirm_', ''))
-        
-        # Получаем информацию о товаре
-        product = db.get_product(product_id)
-        if not product:
-            await callback.answer("Товар не найден", show_alert=True)
-            return
-        
-        # Создаем клавиатуру подтверждения
-        builder = InlineKeyboardBuilder()
-        builder.row(
-            InlineKeyboardButton(
-                text='✅ Да, удалить',
-                callback_data=f'admin_delete_product_final_{product_id}'
-            ),
-            InlineKeyboardButton(
-                text='❌ Нет, отмена',
-                callback_data='admin_products'
-            )
-        )
-        
-        await callback.message.edit_text(
-            text=f"⚠️ Вы уверены, что хотите удалить товар?\n\n"
-                 f"📦 {product['name']}\n"
-                 f"💰 Цена: {product['price']}₽\n\n"
-                 f"Это действие нельзя отменить!",
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при подтверждении удаления товара: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data.startswith('admin_delete_product_final_'))
-async def handle_admin_delete_product_final(callback: CallbackQuery):
-    """Финальное удаление товара"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        # Извлекаем ID товара
-        product_id = int(callback.data.replace('admin_delete_product_final_', ''))
-        
-        # Получаем информацию о товаре перед удалением
-        product = db.get_product(product_id)
-        
-        # Удаляем товар
-        if db.delete_product(product_id):
-            await callback.message.edit_text(
-                text=f"✅ Товар успешно удален!\n\n"
-                     f"📦 Название: {product['name']}\n"
-                     f"💰 Цена: {product['price']}₽\n"
-                     f"🆔 ID: {product_id}",
-                reply_markup=admin_products_kb()
-            )
-            print(f"🗑️ Удален товар: {product['name']} (ID: {product_id})")
-        else:
-            await callback.message.edit_text(
-                text="❌ Не удалось удалить товар. Возможно, товар не существует.",
-                reply_markup=admin_products_kb()
-            )
-        
-    except Exception as e:
-        print(f"Ошибка при удалении товара: {e}")
-        await callback.message.edit_text(
-            text="❌ Ошибка при удалении товара",
-            reply_markup=admin_products_kb()
-        )
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_add_category')
-async def handle_admin_add_category(callback: CallbackQuery):
-    """Добавление категории через меню"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        await callback.message.edit_text(
-            text="📁 Добавление новой категории\n\n"
-                 "Введите название новой категории:\n"
-                 "(например: 💻 Цифровые услуги)\n\n"
-                 "Или нажмите '🔙 Назад' для отмены",
-            reply_markup=InlineKeyboardBuilder()
-                .add(InlineKeyboardButton(text='🔙 Назад', callback_data='admin_categories'))
-                .as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при добавлении категории: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-    
-    await callback.answer()
-
-@dp.callback_query(F.data == 'admin_add_product')
-async def handle_admin_add_product(callback: CallbackQuery, state: FSMContext):
-    """Добавление товара через меню"""
-    try:
-        # Проверяем права администратора
-        if callback.from_user.id not in config.ADMIN_IDS:
-            await callback.answer("⛔ Нет доступа", show_alert=True)
-            return
-        
-        categories = db.get_categories()
-        if not categories:
-            await callback.message.edit_text(
-                text="❌ Нет доступных категорий.\n"
-                     "Сначала создайте категорию.",
-                reply_markup=admin_products_kb()
-            )
-            return
-        
-        await state.set_state(AddProductStates.waiting_for_category)
-        
-        # Создаем клавиатуру с категориями
-        builder = InlineKeyboardBuilder()
-        for category in categories:
-            builder.row(
-                InlineKeyboardButton(
-                    text=category["name"],
-                    callback_data=f"admin_add_product_cat_{category['id']}"
-                )
-            )
-        builder.row(InlineKeyboardButton(text='🔙 Назад', callback_data='admin_products'))
-        
-        await callback.message.edit_text(
-            text="➕ Добавление нового товара\n\n"
-                 "Выберите категорию для товара:",
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при запуске добавления товара: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-        await state.clear()
-    
-    await callback.answer()
-
-# ==================== ДОПОЛНИТЕЛЬНЫЕ ОБРАБОТЧИКИ ====================
-
-@dp.callback_query(F.data == 'cancel')
-async def handle_cancel(callback: CallbackQuery, state: FSMContext):
-    """Отменить текущую операцию"""
-    try:
-        # Очищаем состояние FSM
-        await state.clear()
-        
-        # Возвращаем в главное меню
-        await callback.message.edit_text(
-            text="❌ Операция отменена",
-            reply_markup=main_menu_kb(callback.from_user.id)
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при отмене операции: {e}")
-        await callback.answer("Ошибка при отмене", show_alert=True)
-    
-    await callback.answer()
-
-@dp.message(F.text & ~F.command)
-async def handle_unknown_text(message: Message, state: FSMContext):
-    """Обработать неизвестные текстовые сообщения"""
-    current_state = await state.get_state()
-    
-    if not current_state:
-        # Проверяем, не является ли сообщение добавлением категории через меню
-        if message.reply_to_message and "Добавление новой категории" in message.reply_to_message.text:
-            try:
-                # Проверяем права администратора
-                if message.from_user.id not in config.ADMIN_IDS:
-                    await message.answer("⛔ У вас нет прав администратора")
-                    return
-                
-                category_name = message.text.strip()
-                
-                # Валидация названия
-                if len(category_name) < 2:
-                    await message.answer("❌ Название категории слишком короткое")
-                    return
-                
-                if len(category_name) > 50:
-                    await message.answer("❌ Название категории слишком длинное")
-                    return
-                
-                # Проверяем, не существует ли уже категория с таким названием
-                existing_categories = db.get_categories()
-                for cat in existing_categories:
-                    if cat['name'].lower() == category_name.lower():
-                        await message.answer(
-                            f"❌ Категория с названием '{category_name}' уже существует",
-                            reply_markup=admin_categories_kb()
-                        )
-                        return
-                
-                # Добавляем категорию
-                category_id = db.add_category(category_name)
-                
-                await message.answer(
-                    text=f"✅ Категория добавлена!\n\n"
-                         f"📁 Название: {category_name}\n"
-                         f"🆔 ID: {category_id}",
-                    reply_markup=admin_categories_kb()
-                )
-                
-                print(f"✅ Добавлена новая категория: {category_name} (ID: {category_id})")
-                
-            except Exception as e:
-                print(f"Ошибка при добавлении категории: {e}")
-                await message.answer("❌ Ошибка при добавлении категории")
-        else:
-            await message.answer(
-                text="👋 Для навигации используйте кнопки меню:",
-                reply_markup=main_menu_kb(message.from_user.id)
-            )
-
-# ==================== АДМИН КОМАНДЫ ====================
-
-@dp.message(Command("addproduct"))
-async def handle_add_product_command(message: Message, state: FSMContext):
-    """Команда добавления товара"""
-    try:
-        # Проверяем права администратора
-        if message.from_user.id not in config.ADMIN_IDS:
-            await message.answer("⛔ У вас нет прав администратора")
-            return
-        
-        categories = db.get_categories()
-        if not categories:
-            await message.answer(
-                "❌ Нет доступных категорий.\n"
-                "Сначала создайте категорию командой /addcategory"
-            )
-            return
-        
-        await state.set_state(AddProductStates.waiting_for_category)
-        
-        # Создаем клавиатуру с категориями
-        builder = InlineKeyboardBuilder()
-        for category in categories:
-            builder.row(
-                InlineKeyboardButton(
-                    text=category["name"],
-                    callback_data=f"admin_add_product_cat_{category['id']}"
-                )
-            )
-        builder.row(InlineKeyboardButton(text='❌ Отмена', callback_data='cancel'))
-        
-        await message.answer(
-            text="➕ Добавление нового товара\n\n"
-                 "Выберите категорию для товара:",
-            reply_markup=builder.as_markup()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при запуске добавления товара: {e}")
-        await message.answer("❌ Произошла ошибка")
-        await state.clear()
-
-@dp.callback_query(F.data.startswith('admin_add_product_cat_'))
-async def handle_admin_product_category(callback: CallbackQuery, state: FSMContext):
-    """Обработка выбора категории для товара"""
-    try:
-        # Извлекаем ID категории
-        category_id = int(callback.data.replace('admin_add_product_cat_', ''))
-        
-        # Сохраняем ID категории и переходим к вводу названия
-        await state.update_data(category_id=category_id)
-        await state.set_state(AddProductStates.waiting_for_name)
-        
-        await callback.message.edit_text(
-            text="📝 Введите название товара:",
-            reply_markup=cancel_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при выборе категории товара: {e}")
-        await callback.answer("Ошибка", show_alert=True)
-        await state.clear()
-    
-    await callback.answer()
-
-@dp.message(AddProductStates.waiting_for_name)
-async def handle_product_name(message: Message, state: FSMContext):
-    """Обработка ввода названия товара"""
-    try:
-        product_name = message.text.strip()
-        
-        if len(product_name) < 2:
-            await message.answer(
-                text="❌ Название слишком короткое. Введите название товара:",
-                reply_markup=cancel_kb()
-            )
-            return
-        
-        await state.update_data(product_name=product_name)
-        await state.set_state(AddProductStates.waiting_for_price)
-        
-        await message.answer(
-            text="💰 Введите цену товара (в рублях):\n\nПример: 1000 или 1500.50",
-            reply_markup=cancel_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при вводе названия товара: {e}")
-        await message.answer("❌ Ошибка", reply_markup=cancel_kb())
-        await state.clear()
-
-@dp.message(AddProductStates.waiting_for_price)
-async def handle_product_price(message: Message, state: FSMContext):
-    """Обработка ввода цены товара"""
-    try:
-        price_text = message.text.strip().replace(',', '.')
-        
-        try:
-            price = float(price_text)
-        except ValueError:
-            await message.answer(
-                text="❌ Неверный формат цены!\n\n"
-                     "Введите число. Пример: 1000 или 1500.50",
-                reply_markup=cancel_kb()
-            )
-            return
-        
-        if price <= 0:
-            await message.answer(
-                text="❌ Цена должна быть больше 0!\n\n"
-                     "Введите цену товара:",
-                reply_markup=cancel_kb()
-            )
-            return
-        
-        await state.update_data(product_price=price)
-        await state.set_state(AddProductStates.waiting_for_description)
-        
-        await message.answer(
-            text="📝 Введите описание товара (или 'нет' для пропуска):",
-            reply_markup=cancel_kb()
-        )
-        
-    except Exception as e:
-        print(f"Ошибка при вводе цены товара: {e}")
-        await message.answer("❌ Ошибка", reply_markup=cancel_kb())
-        await state.clear()
-
-@dp.message(AddProductStates.waiting_for_description)
-async def handle_product_description(message: Message, state: FSMContext):
-    """Обработка ввода описания товара"""
-    try:
-        description = message.text.strip()
-        if description.lower() == 'нет':
-            description = ""
-        
-        # Получаем все данные
-        data = await state.get_data()
-        category_id = data.get('category_id')
-        product_name = data.get('product_name')
-        price = data.get('product_price')
-        
-        # Добавляем товар в базу
-        product_id = db.add_product(
-            category_id=category_id,
-            name=product_name,
-            price=price,
-            description=description
-        )
-        
-        # Очищаем состояние
-        await state.clear()
-        
-        # Получаем информацию о категории
-        category = db.get_category(category_id)
-        
-        await message.answer(
-            text=f"✅ Товар успешно добавлен!\n\n"
-                 f"📦 Название: {product_name}\n"
-                 f"💰 Цена: {price:.2f}₽\n"
-                 f"📝 Описание: {description or 'Нет описания'}\n"
-                 f"📁 Категория: {category.get('name', 'Неизвестно') if category else 'Неизвестно'}\n"
-                 f"🆔 ID товара: {product_id}",
-            reply_markup=main_menu_kb(message.from_user.id)
-        )
-        
-        print(f"✅ Добавлен новый товар: {product_name} (ID: {product_id}) в категорию {category_id}")
-        
-    except Exception as e:
-        print(f"Ошибка при добавлении товара: {e}")
-        await message.answer(
-            text="❌ Ошибка при добавлении товара",
-            reply_markup=main_menu_kb(message.from_user.id)
-        )
-        await state.clear()
-
-@dp.message(Command("addcategory"))
-async def handle_add_category_command(message: Message):
-    """Команда добавления категории"""
-    try:
-        # Проверяем права администратора
-        if message.from_user.id not in config.ADMIN_IDS:
-            await message.answer("⛔ У вас нет прав администратора")
-            return
-        
-        # Извлекаем название категории из команды
-        command_parts = message.text.split(maxsplit=1)
-        if len(command_parts) < 2:
-            await message.answer(
-                "❌ Не указано название категории.\n\n"
-                "Использование:\n"
-                "/addcategory <название категории>\n\n"
-                "Пример:\n"
-                "/addcategory 💻 Цифровые услуги"
-            )
-            return
-        
-        category_name = command_parts[1].strip()
-        
-        # Валидация названия
-        if len(category_name) < 2:
-            await message.answer("❌ Название категории слишком короткое")
-            return
-        
-        if len(category_name) > 50:
-            await message.answer("❌ Название категории слишком длинное")
-            return
-        
-        # Проверяем, не существует ли уже категория с таким названием
-        existing_categories = db.get_categories()
-        for cat in existing_categories:
-            if cat['name'].lower() == category_name.lower():
-                await message.answer(
-                    f"❌ Категория с названием '{category_name}' уже существует"
-                )
-                return
-        
-        # Добавляем категорию
-        category_id = db.add_category(category_name)
-        
-        await message.answer(
-            text=f"✅ Категория добавлена!\n\n"
-                 f"📁 Название: {category_name}\n"
-                 f"🆔 ID: {category_id}",
-            reply_markup=main_menu_kb(message.from_user.id)
-        )
-        
-        print(f"✅ Добавлена новая категория: {category_name} (ID: {category_id})")
-        
-    except Exception as e:
-        print(f"Ошибка при добавлении категории: {e}")
-        await message.answer("❌ Ошибка при добавлении категории")
-
-@dp.message(Command("stats"))
-async def handle_stats_command(message: Message):
-    """Команда показа статистики"""
-    try:
-        # Проверяем права администратора
-        if message.from_user.id not in config.ADMIN_IDS:
-            await message.answer("⛔ У вас нет прав администратора")
-            return
-        
-        # Собираем статистику
-        categories_count = len(db.get_categories())
-        products_count = len(db.products)
-        users_count = len(db.users)
-        pending_orders = len(db.pending_orders)
-        
-        # Статистика по транзакциям
-        purchases = [t for t in db.transactions if t['type'] == 'purchase']
-        total_purchases = sum(abs(t['amount']) for t in purchases)
-        
-        # Статистика по корзинам
-        active_carts = len(cart_manager.carts)
-        total_cart_items = sum(len(cart) for cart in cart_manager.carts.values())
-        
-        stats_text = f"""📊 СТАТИСТИКА БОТА (команда /stats)
-
-📈 Общая статистика:
-• 📁 Категорий: {categories_count}
-• 📦 Товаров: {products_count}
-• 👥 Пользователей: {users_count}
-• ⏳ Ожидающих заказов: {pending_orders}
-• 🛍️ Активных корзин: {active_carts}
-• 🛒 Товаров в корзинах: {total_cart_items}
-
-💰 Финансовая статистика:
-• 🛒 Всего покупок: {len(purchases)}
-• 💸 Общая сумма: {total_purchases:.2f}₽
-
-💳 Способ оплаты:
-• 🏦 Только Ozon (СБП/Карта)
-"""
-        
-        await message.answer(stats_text)
-        
-    except Exception as e:
-        print(f"Ошибка при показе статистики: {e}")
-        await message.answer("❌ Ошибка при загрузке статистики")
-
-@dp.callback_query(F.data == 'no_action')
-async def handle_no_action(callback: CallbackQuery):
-    """Обработка неактивных кнопок (номер страницы)"""
-    await callback.answer()  # Просто отвечаем, но ничего не делаем
-
-# ==================== ЗАПУСК БОТА ====================
-
-async def main():
-    """
-    Основная функция запуска бота
-    """
-    # Выводим информацию о запуске
-    startup_info = f"""
-{'=' * 50}
-🤖 БОТ ЗАПУЩЕН
-{'=' * 50}
-
-📊 Загруженные данные:
-• 📁 Категорий: {len(db.categories)}
-• 📦 Товаров: {len(db.products)}
-• 👥 Пользователей: {len(db.users)}
-• 💳 Транзакций: {len(db.transactions)}
-• ⏳ Ожидающих заказов: {len(db.pending_orders)}
-• 🛍️ Активных корзин: {len(cart_manager.carts)}
-
-⚙️ Конфигурация:
-• 👨‍💼 Администраторы: {config.ADMIN_IDS}
-• 💳 Оплата: Только Ozon (СБП/Карта)
-• 📊 Каналы: Заказы - {config.ORDER_CHANNEL_ID}
-
-🎉 НОВАЯ ФУНКЦИЯ:
-• 🛍️ Корзина для покупки нескольких товаров
-
-{'=' * 50}
-✅ Бот готов к работе!
-✅ Оплата только через Ozon (СБП/Карта)
-✅ Корзина активирована!
-{'=' * 50}
-"""
-    print(startup_info)
-    
-    try:
-        # Запускаем polling
-        await dp.start_polling(
-            bot,
-            skip_updates=True
-        )
-        
-    except KeyboardInterrupt:
-        print("\n\n🛑 Бот остановлен пользователем")
-    except Exception as e:
-        print(f"❌ Критическая ошибка при запуске бота: {e}")
-    finally:
-        # Сохраняем данные корзины перед выходом
-        cart_manager.save_carts()
-        print("✅ Данные корзины сохранены")
-        
-        # Закрываем сессию бота
-        await bot.session.close()
-        print("✅ Сессия бота закрыта")
-
-if __name__ == "__main__":
-    # Запускаем бота
-    asyncio.run(main())
-
+import abc
+import asyncio
+import base64
+import bisect
+import contextlib
+import heapq
+import inspect
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Any, Awaitable, Callable, Iterator
+
+import aiofiles
+import aiofiles.os
+from aiohttp import web
+from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+from aiogram.types import (Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InlineQuery,
+                           InlineQueryResultArticle, InputTextMessageContent)
+from aiogram.filters import Command, CommandObject, CommandStart
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from dotenv import load_dotenv
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+# Загружаем переменные окружения
+load_dotenv()
+
+# ==================== КОНФИГУРАЦИЯ ====================
+class Config:
+    # Администраторы
+    ADMIN_IDS = [1824049351, 5568154436]
+    ADMIN_USERNAME = "@koliin98"
+    
+    # ID каналов для заявок
+    PAYMENT_CHANNEL_ID = -1001862240317
+    ORDER_CHANNEL_ID = -1002893927706
+    # Сколько секунд доверять последней проверке канала заказов (успешной / неуспешной)
+    ORDER_CHANNEL_CHECK_TTL = int(os.getenv('ORDER_CHANNEL_CHECK_TTL', '600'))
+    ORDER_CHANNEL_RETRY_TTL = int(os.getenv('ORDER_CHANNEL_RETRY_TTL', '30'))
+    # Ограничения исходящих сообщений: всего в секунду, в личный чат в секунду, в группу/канал в минуту
+    SEND_RATE_GLOBAL = float(os.getenv('SEND_RATE_GLOBAL', '30'))
+    SEND_RATE_PRIVATE = float(os.getenv('SEND_RATE_PRIVATE', '1'))
+    SEND_RATE_GROUP_PER_MINUTE = float(os.getenv('SEND_RATE_GROUP_PER_MINUTE', '20'))
+    SEND_WORKERS = int(os.getenv('SEND_WORKERS', '8'))
+    # Рассылка: файл с прогрессом и сколько получателей обрабатывать за раз
+    BROADCAST_FILE = "broadcast_state.json"
+    BROADCAST_BATCH = int(os.getenv('BROADCAST_BATCH', '100'))
+    # Фильтры каталога: названия filter_ids из products_data.json и диапазоны цен [от, до)
+    PRODUCT_FILTERS = {
+        1: "🌎 Сев. Америка",
+        2: "🌍 Европа",
+        3: "🌏 Азия",
+        4: "🌎 Лат. Америка",
+    }
+    PRICE_BANDS = [(0, 100), (100, 200), (200, 400), (400, None)]
+    
+    # Inline-режим: сколько секунд Telegram кэширует ответ и сколько запросов держать в LRU бота
+    INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+    INLINE_CACHE_SIZE = int(os.getenv('INLINE_CACHE_SIZE', '500'))
+    # Сколько секунд товар остается зарезервированным за неподтвержденным заказом
+    RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', '86400'))
+    
+    # Реквизиты для оплаты (только Ozon)
+    PAYMENT_DETAILS = {
+        "ozon": {
+            "name": "Ozon Банк (СБП/Карта)",
+            "card_number": "2200 2488 7412 7581",  # Замените на реальный номер
+            "phone_number": "+79225739192",  # Замените на реальный номер
+            "owner": "Иван Г."
+        }
+    }
+
+    # Файлы данных
+    DATA_FILE = "products_dat.json"
+    USERS_FILE = "users_dat.json"
+
+    CARTS_FILE = "carts_data.json"
+    # Отложенная запись корзин: секунды между сохранениями (0 - писать сразу)
+    CARTS_FLUSH_INTERVAL = float(os.getenv('CARTS_FLUSH_INTERVAL', '2'))
+    # Хранение корзин: "file" (один файл), "dir" (файл на пользователя) или "sqlite"
+    CARTS_STORAGE = os.getenv('CARTS_STORAGE', 'file')
+    CARTS_DIR = os.getenv('CARTS_DIR', 'carts')
+    # Через сколько секунд без обращений корзина выгружается из памяти ("dir" и "sqlite")
+    CARTS_IDLE_TTL = float(os.getenv('CARTS_IDLE_TTL', '1800'))
+
+    # Режим хранения: "json" (полная перезапись), "journal" (журнал изменений) или "sqlite"
+    STORAGE_MODE = os.getenv('STORAGE_MODE', 'json')
+    SQLITE_FILE = os.getenv('SQLITE_FILE', 'shop.db')
+    USERS_JOURNAL_FILE = "users_dat.journal"
+    # Через сколько записей журнала делать снимок (компакцию)
+    JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000'))
+    # Сколько последних транзакций держать в памяти; более старые уходят в архив по месяцам
+    TRANSACTIONS_HOT_LIMIT = int(os.getenv('TRANSACTIONS_HOT_LIMIT', '1000'))
+    TRANSACTIONS_ARCHIVE_DIR = os.getenv('TRANSACTIONS_ARCHIVE_DIR', 'transactions_archive')
+
+    # Хранилище состояний FSM: "memory", "redis" (нужен пакет redis) или "sqlite"
+    FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    FSM_SQLITE_FILE = os.getenv('FSM_SQLITE_FILE', 'fsm_states.db')
+    # Через сколько секунд забывать брошенные состояния (незавершенные оплаты и т.п.)
+    FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', '86400'))
+
+    # Режим получения обновлений: "polling" или "webhook"
+    RUN_MODE = os.getenv('RUN_MODE', 'polling')
+    # Публичный адрес бота (https://example.com); если пуст, вебхук в Telegram не регистрируется
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    # Свой адрес Bot API (локальный сервер или заглушка из webhook_loadtest.py)
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+
+    # Логирование: уровень (DEBUG/INFO/WARNING/ERROR) и формат ("text" или "json")
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+
+config = Config()
+
+# ==================== ЛОГИРОВАНИЕ ====================
+
+class JsonLogFormatter(logging.Formatter):
+    """Одна JSON-строка на запись лога"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Настроить логирование: обработчики только кладут записи в очередь,
+    вывод в stdout выполняет отдельный поток"""
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if config.LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(config.LOG_LEVEL)
+    # aiogram пишет INFO на каждое обновление - оставляем это только для отладки
+    if root.level > logging.DEBUG:
+        logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+log_listener = setup_logging()
+logger = logging.getLogger("shop")
+
+# ==================== ПЕРЕНОС В SQLITE ====================
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    row_id INTEGER PRIMARY KEY,
+    id INTEGER NOT NULL,
+    category_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    price REAL NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    quantity INTEGER NOT NULL DEFAULT 9999,
+    filter_ids TEXT NOT NULL DEFAULT '[]'
+);
+-- Один и тот же товар может лежать в нескольких категориях под одним id
+CREATE INDEX IF NOT EXISTS idx_products_id ON products(id);
+CREATE INDEX IF NOT EXISTS idx_products_category_id ON products(category_id);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    total_spent REAL NOT NULL DEFAULT 0,
+    total_orders INTEGER NOT NULL DEFAULT 0,
+    registration_date TEXT,
+    last_activity TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_total_orders ON users(total_orders DESC, id);
+CREATE INDEX IF NOT EXISTS idx_users_total_spent ON users(total_spent DESC, id);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT,
+    date TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions(user_id);
+CREATE TABLE IF NOT EXISTS purchase_stats (
+    day TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0,
+    amount REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pending_orders (
+    order_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS carts (
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    added_at TEXT,
+    PRIMARY KEY (user_id, product_id)
+);
+-- Счетчики, общие для всех процессов с этой базой (версия каталога)
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+PURCHASE_STATS_BACKFILL = """
+INSERT OR REPLACE INTO purchase_stats (day, count, amount)
+SELECT substr(COALESCE(date, ''), 1, 10), COUNT(*), SUM(ABS(amount))
+FROM transactions WHERE type = 'purchase' GROUP BY 1
+"""
+
+def migrate_json_to_sqlite(sqlite_path: str):
+    """Однократный перенос данных из JSON-файлов и архива транзакций в SQLite"""
+    conn = sqlite3.connect(sqlite_path)
+    conn.executescript(SQLITE_SCHEMA)
+
+    products_data = {}
+    if os.path.exists(config.DATA_FILE):
+        with open(config.DATA_FILE, 'r', encoding='utf-8') as f:
+            products_data = json.load(f)
+
+    users_data = {}
+    if os.path.exists(config.USERS_FILE):
+        with open(config.USERS_FILE, 'r', encoding='utf-8') as f:
+            users_data = json.load(f)
+
+    carts_data = {}
+    if os.path.exists(config.CARTS_FILE):
+        with open(config.CARTS_FILE, 'r', encoding='utf-8') as f:
+            carts_data = json.load(f)
+
+    # Транзакции, уже ушедшие в архив, тоже переносим; повторы по id схлопнутся
+    transactions = list(users_data.get('transactions', []))
+    if os.path.isdir(config.TRANSACTIONS_ARCHIVE_DIR):
+        for name in sorted(os.listdir(config.TRANSACTIONS_ARCHIVE_DIR)):
+            if not name.endswith('.jsonl'):
+                continue
+            with open(os.path.join(config.TRANSACTIONS_ARCHIVE_DIR, name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        transactions.append(json.loads(line))
+                    except ValueError:
+                        continue  # Строка, оборванная сбоем при архивации
+
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO categories (id, name) VALUES (?, ?)",
+            [(c["id"], c["name"]) for c in products_data.get('categories', [])]
+        )
+        conn.execute("DELETE FROM products")
+        conn.executemany(
+            "INSERT INTO products (id, category_id, name, price, description, quantity, filter_ids) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (p["id"], p["category_id"], p["name"], float(p["price"]), p.get("description", ""),
+                 p.get("quantity", 9999), json.dumps(p.get("filter_ids", [])))
+                for p in products_data.get('products', [])
+            ]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (id, total_spent, total_orders, registration_date, last_activity) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (int(uid), u.get("total_spent", 0.0), u.get("total_orders", 0),
+                 u.get("registration_date"), u.get("last_activity"))
+                for uid, u in users_data.get('users', {}).items()
+            ]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO transactions (id, user_id, type, amount, description, date) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (t["id"], t["user_id"], t["type"], t["amount"], t.get("description"), t.get("date"))
+                for t in transactions
+            ]
+        )
+        # Статистика покупок учитывает и уже архивированные транзакции
+        conn.execute("DELETE FROM purchase_stats")
+        if users_data.get('transaction_stats'):
+            conn.executemany(
+                "INSERT INTO purchase_stats (day, count, amount) VALUES (?, ?, ?)",
+                [
+                    (day, bucket["count"], bucket["amount"])
+                    for day, bucket in users_data['transaction_stats'].get('by_day', {}).items()
+                ]
+            )
+        else:
+            conn.execute(PURCHASE_STATS_BACKFILL)
+        conn.executemany(
+            "INSERT OR REPLACE INTO pending_orders (order_id, data) VALUES (?, ?)",
+            [
+                (order_id, json.dumps(order, ensure_ascii=False))
+                for order_id, order in users_data.get('pending_orders', {}).items()
+            ]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO carts (user_id, product_id, quantity, added_at) VALUES (?, ?, ?, ?)",
+            [
+                (int(uid), item["product_id"], item["quantity"], item.get("added_at"))
+                for uid, cart in carts_data.items()
+                for item in cart
+            ]
+        )
+    conn.close()
+
+    print(f"✅ Данные перенесены в {sqlite_path}: "
+          f"{len(products_data.get('products', []))} товаров, "
+          f"{len(users_data.get('users', {}))} пользователей, "
+          f"{len({t['id'] for t in transactions})} транзакций (с архивом), "
+          f"{len(carts_data)} корзин")
+
+# Перенос не требует токена бота и не загружает JSON-хранилище: выполняем до инициализации
+if __name__ == "__main__" and sys.argv[1:2] == ["migrate-sqlite"]:
+    # python nnd.py migrate-sqlite [путь_к_базе]
+    migrate_json_to_sqlite(sys.argv[2] if len(sys.argv) > 2 else config.SQLITE_FILE)
+    sys.exit(0)
+
+# Инициализация бота
+if config.TELEGRAM_API_URL:
+    bot = Bot(
+        token=os.getenv('BOT_TOKEN'),
+        session=AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
+    )
+else:
+    bot = Bot(token=os.getenv('BOT_TOKEN'))
+
+# ==================== ХРАНИЛИЩЕ FSM ====================
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM в SQLite: переживает перезапуск, доступно нескольким процессам на одной машине"""
+
+    def __init__(self, path: str, ttl: int = 0):
+        self.ttl = ttl
+        self._operations = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm(updated_at)")
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def _read(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT state, data, updated_at FROM fsm WHERE key = ?", (self._key(key),)
+        ).fetchone()
+        if row is None or (self.ttl and row[2] < datetime.now().timestamp() - self.ttl):
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]):
+        with self.conn:
+            if state is None and not data:
+                self.conn.execute("DELETE FROM fsm WHERE key = ?", (self._key(key),))
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                    (self._key(key), state, json.dumps(data, ensure_ascii=False), datetime.now().timestamp())
+                )
+        self._operations += 1
+        if self.ttl and self._operations % 1000 == 0:
+            self.purge_expired()
+
+    def purge_expired(self):
+        """Удалить просроченные состояния"""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM fsm WHERE updated_at < ?", (datetime.now().timestamp() - self.ttl,)
+            )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = self._read(key)
+        self._write(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._read(key)[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = self._read(key)
+        self._write(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._read(key)[1]
+
+    async def close(self) -> None:
+        self.conn.close()
+
+def create_fsm_storage() -> BaseStorage:
+    """Создать хранилище FSM согласно config.FSM_STORAGE"""
+    if config.FSM_STORAGE == 'redis':
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            raise RuntimeError("Для FSM_STORAGE=redis установите пакет redis: pip install redis")
+        return RedisStorage.from_url(
+            config.REDIS_URL,
+            state_ttl=config.FSM_STATE_TTL or None,
+            data_ttl=config.FSM_STATE_TTL or None
+        )
+    if config.FSM_STORAGE == 'sqlite':
+        return SQLiteStorage(config.FSM_SQLITE_FILE, ttl=config.FSM_STATE_TTL)
+    return MemoryStorage()
+
+# Создаем storage и dispatcher
+storage = create_fsm_storage()
+dp = Dispatcher(storage=storage)
+
+# ==================== СОСТОЯНИЯ FSM ====================
+
+class AddProductStates(StatesGroup):
+    waiting_for_category = State()
+    waiting_for_name = State()
+    waiting_for_price = State()
+    waiting_for_description = State()
+
+class PaymentStates(StatesGroup):
+    waiting_for_screenshot = State()
+
+class DeleteProductStates(StatesGroup):
+    waiting_for_product_choice = State()
+
+class CartStates(StatesGroup):
+    waiting_for_quantity = State()  # Для ввода количества
+    managing_cart = State()         # Для управления корзиной
+
+class BroadcastStates(StatesGroup):
+    waiting_for_message = State()
+
+class SearchStates(StatesGroup):
+    waiting_for_query = State()
+
+# ==================== БАЗА ДАННЫХ ====================
+
+def write_json_atomic(path: str, data: Any, indent: Optional[int] = 2):
+    """Записать JSON во временный файл и атомарно заменить им основной"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+async def write_text_atomic_async(path: str, text: str):
+    """Асинхронная атомарная запись: временный файл + переименование"""
+    tmp_path = f"{path}.tmp"
+    async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+        await f.write(text)
+        await f.flush()
+        await asyncio.to_thread(os.fsync, f.fileno())
+    await aiofiles.os.replace(tmp_path, path)
+
+def snapshot_copy(value: Any, depth: int = 4) -> Any:
+    """Копия вложенных dict/list на depth уровней для сериализации в другом потоке
+
+    Копируются только контейнеры (строки и числа неизменяемы), поэтому это
+    дешевле json.dumps. Глубже depth уровней данные хранилищ на месте не меняются.
+    """
+    if depth <= 0:
+        return value
+    if isinstance(value, dict):
+        return {key: snapshot_copy(item, depth - 1) for key, item in value.items()}
+    if isinstance(value, list):
+        return [snapshot_copy(item, depth - 1) for item in value]
+    return value
+
+class AsyncJsonWriter:
+    """Фоновая запись JSON-файлов вне event loop с объединением повторных запросов"""
+
+    def __init__(self):
+        self._pending: Dict[str, Tuple[Callable[[], Any], Optional[int]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._background: set = set()
+
+    def request_save(self, path: str, snapshot: Callable[[], Any], indent: Optional[int] = 2):
+        """Запланировать сохранение; snapshot вызывается непосредственно перед записью
+
+        Если snapshot вернул None, файл удаляется.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            data = snapshot()
+            if data is None:
+                if os.path.exists(path):
+                    os.remove(path)
+            else:
+                write_json_atomic(path, data, indent)
+            return
+
+        self._pending[path] = (snapshot, indent)
+        task = self._tasks.get(path)
+        if task is None or task.done():
+            self._tasks[path] = asyncio.create_task(self._write_loop(path))
+
+    async def _write_loop(self, path: str):
+        while path in self._pending:
+            snapshot, indent = self._pending.pop(path)
+            try:
+                # Снимок берем в потоке event loop, чтобы он был согласованным
+                data = snapshot()
+                if data is None:
+                    if await aiofiles.os.path.exists(path):
+                        await aiofiles.os.remove(path)
+                    continue
+                data = snapshot_copy(data)
+                text = await asyncio.to_thread(json.dumps, data, ensure_ascii=False, indent=indent)
+                await write_text_atomic_async(path, text)
+            except Exception as e:
+                logger.error("Ошибка фоновой записи %s: %s", path, e)
+
+    def spawn(self, coro) -> asyncio.Task:
+        """Запустить произвольную фоновую запись, которую дождется flush()"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def flush(self):
+        """Дождаться завершения всех запланированных записей"""
+        while True:
+            tasks = [task for task in self._tasks.values() if not task.done()]
+            tasks += list(self._background)
+            if not tasks:
+                return
+            await asyncio.gather(*tasks)
+
+persistence = AsyncJsonWriter()
+
+class UsersJournal:
+    """Журнал изменений пользователей: одна компактная JSON-запись на строку"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rotated_path = f"{path}.1"  # Сегмент, который сейчас сворачивается в снимок
+        self.records_count = 0  # Записей с момента последнего снимка
+        self._file = None
+
+    def append(self, record: Dict):
+        """Дописать запись в конец журнала"""
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+        self._file.flush()
+        self.records_count += 1
+
+    def replay(self) -> List[Dict]:
+        """Прочитать все записи журнала (оборванная последняя строка пропускается)"""
+        records = []
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        logger.warning("Повреждённая запись журнала пропущена: %s", line[:80])
+        self.records_count = len(records)
+        return records
+
+    def rotate(self):
+        """Отложить текущий журнал до записи снимка и начать новый"""
+        self.close()
+        if os.path.exists(self.path):
+            if os.path.exists(self.rotated_path):
+                # Предыдущий снимок не дописан: склеиваем сегменты, чтобы ничего не потерять
+                with open(self.rotated_path, 'a', encoding='utf-8') as dst, \
+                        open(self.path, 'r', encoding='utf-8') as src:
+                    dst.write(src.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+        self.records_count = 0
+
+    def discard_rotated(self):
+        """Удалить отложенный сегмент после успешной записи снимка"""
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def new_purchase_stats() -> Dict:
+    """Пустая накопленная статистика покупок"""
+    return {"count": 0, "amount": 0.0, "by_day": {}, "last_id": 0}
+
+def add_to_purchase_stats(stats: Dict, transaction: Dict):
+    """Учесть транзакцию в накопленной статистике"""
+    stats["last_id"] = max(stats["last_id"], transaction["id"])
+    if transaction.get("type") != "purchase":
+        return
+    amount = abs(transaction.get("amount", 0))
+    day = (transaction.get("date") or "")[:10]
+    bucket = stats["by_day"].setdefault(day, {"count": 0, "amount": 0.0})
+    bucket["count"] += 1
+    bucket["amount"] += amount
+    stats["count"] += 1
+    stats["amount"] += amount
+
+class ShopMetrics:
+    """Счетчики админской статистики, которые обновляются по событиям.
+
+    Начальные значения считаются один раз при запуске (reset), дальше их
+    двигают регистрация пользователя, покупка, изменение корзины и
+    добавление или удаление ожидающего заказа.
+    """
+
+    def __init__(self):
+        self.users = 0
+        self.orders = 0
+        self.spent = 0.0
+        self.pending_orders = 0
+        self.carts = 0  # Непустые корзины
+        self.cart_items = 0  # Позиции во всех корзинах
+
+    def reset(self, database):
+        self.users, self.orders, self.spent = database.get_user_totals()
+        self.pending_orders = len(database.pending_orders)
+
+    async def reset_carts(self, carts):
+        # Корзины в шардированном хранилище считаются обходом файлов - уже в цикле событий
+        self.carts, self.cart_items = await carts.get_stats()
+
+    def on_user_registered(self):
+        self.users += 1
+
+    def on_purchase(self, amount: float):
+        self.orders += 1
+        self.spent += amount
+
+    def on_pending_order(self, delta: int):
+        self.pending_orders += delta
+
+    def on_cart_changed(self, old_items: int, new_items: int):
+        self.cart_items += new_items - old_items
+        self.carts += (new_items > 0) - (old_items > 0)
+
+metrics = ShopMetrics()
+
+class UserLeaderboard:
+    """Рейтинг пользователей по числу заказов и по сумме покупок.
+
+    Для каждого рейтинга хранится отсортированный список ключей
+    (-значение, user_id): покупка переставляет одного пользователя,
+    а страница рейтинга берется срезом.
+    """
+
+    FIELDS = {'orders': 'total_orders', 'spent': 'total_spent'}
+
+    def __init__(self):
+        self._ranks: Dict[str, List[Tuple[float, int]]] = {kind: [] for kind in self.FIELDS}
+        self._keys: Dict[int, Dict[str, Tuple[float, int]]] = {}
+
+    def reset(self, users: Dict[int, Dict]):
+        self._keys = {}
+        for kind, field in self.FIELDS.items():
+            ranks = [(-user.get(field, 0), user_id) for user_id, user in users.items()]
+            ranks.sort()
+            self._ranks[kind] = ranks
+        for user_id, user in users.items():
+            self._keys[user_id] = {kind: (-user.get(field, 0), user_id) for kind, field in self.FIELDS.items()}
+
+    def update(self, user_id: int, user: Dict):
+        """Переставить пользователя после изменения его статистики"""
+        old_keys = self._keys.get(user_id, {})
+        new_keys = {}
+        for kind, field in self.FIELDS.items():
+            ranks = self._ranks[kind]
+            old_key = old_keys.get(kind)
+            if old_key is not None:
+                index = bisect.bisect_left(ranks, old_key)
+                if index < len(ranks) and ranks[index] == old_key:
+                    del ranks[index]
+            new_keys[kind] = (-user.get(field, 0), user_id)
+            bisect.insort(ranks, new_keys[kind])
+        self._keys[user_id] = new_keys
+
+    def page(self, kind: str, offset: int, limit: int) -> List[int]:
+        """ID пользователей на позициях offset..offset+limit"""
+        return [user_id for _, user_id in self._ranks[kind][offset:offset + limit]]
+
+class SearchIndex:
+    """Инвертированный индекс каталога для поиска по названию и описанию"""
+
+    TOKEN_RE = re.compile(r"\+\d+|\d+|[^\W\d_]+")
+    ENDINGS = "аеиоуыэюяйь"
+
+    def __init__(self):
+        self._postings: Dict[str, set] = {}
+        self._vocabulary: List[str] = []
+        self._tokens: Dict[int, set] = {}
+        self._name_tokens: Dict[int, set] = {}
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        tokens = []
+        for token in cls.TOKEN_RE.findall(text.casefold().replace('ё', 'е')):
+            if token[0] == '+':
+                tokens.append(token)
+                token = token[1:]
+            elif not token.isdigit():
+                stem = token.rstrip(cls.ENDINGS)
+                if len(stem) >= 4:
+                    token = stem
+            tokens.append(token)
+        return tokens
+
+    def rebuild(self, products: List[Dict]):
+        self.__init__()
+        for product in products:
+            self._add(product)
+        # Словарь сортируется один раз, а не вставкой на каждое новое слово
+        self._vocabulary = sorted(self._postings)
+
+    def add(self, product: Dict):
+        for token in self._add(product):
+            bisect.insort(self._vocabulary, token)
+
+    def _add(self, product: Dict) -> List[str]:
+        """Проиндексировать товар; возвращает слова, которых еще не было в словаре"""
+        product_id = product['id']
+        if product_id in self._tokens:
+            return []
+        new_tokens = []
+        name_tokens = set(self.tokenize(product.get('name', '')))
+        tokens = name_tokens | set(self.tokenize(product.get('description', '')))
+        self._tokens[product_id] = tokens
+        self._name_tokens[product_id] = name_tokens
+        for token in tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = set()
+                new_tokens.append(token)
+            posting.add(product_id)
+        return new_tokens
+
+    def remove(self, product_id: int):
+        self._name_tokens.pop(product_id, None)
+        for token in self._tokens.pop(product_id, ()):
+            posting = self._postings[token]
+            posting.discard(product_id)
+            if not posting:
+                del self._postings[token]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+
+    def _matches(self, token: str) -> set:
+        if token[0] == '+' or token.isdigit():
+            return self._postings.get(token, set())
+        found = set()
+        index = bisect.bisect_left(self._vocabulary, token)
+        while index < len(self._vocabulary) and self._vocabulary[index].startswith(token):
+            found |= self._postings[self._vocabulary[index]]
+            index += 1
+        return found
+
+    def search(self, query: str) -> List[int]:
+        """ID товаров, содержащих все слова запроса; совпадения в названии выше"""
+        tokens = set(self.tokenize(query))
+        if not tokens:
+            return []
+        found = None
+        for token in sorted(tokens, key=len, reverse=True):
+            matches = self._matches(token)
+            found = matches if found is None else found & matches
+            if not found:
+                return []
+        
+        def rank(product_id: int) -> Tuple[int, int]:
+            name_tokens = self._name_tokens[product_id]
+            in_name = sum(1 for token in tokens
+                          if any(name_token.startswith(token) for name_token in name_tokens))
+            return -in_name, product_id
+        
+        return sorted(found, key=rank)
+
+search_index = SearchIndex()
+
+class FacetIndex:
+    """Индекс фильтров каталога: товары по filter_id и список (цена, ID)"""
+
+    def __init__(self):
+        self._by_filter: Dict[int, set] = {}
+        self._prices: List[Tuple[float, int]] = []
+        self._entries: Dict[int, Tuple[float, Tuple[int, ...]]] = {}
+
+    def rebuild(self, products: List[Dict]):
+        self.__init__()
+        for product in products:
+            self._add(product)
+        self._prices = sorted((price, product_id) for product_id, (price, _) in self._entries.items())
+
+    def add(self, product: Dict):
+        if self._add(product):
+            bisect.insort(self._prices, (self._entries[product['id']][0], product['id']))
+
+    def _add(self, product: Dict) -> bool:
+        """Запомнить цену и фильтры товара (без списка цен); False - товар уже в индексе"""
+        product_id = product['id']
+        if product_id in self._entries:
+            return False
+        price = float(product.get('price', 0))
+        filter_ids = tuple(product.get('filter_ids') or ())
+        self._entries[product_id] = (price, filter_ids)
+        for filter_id in filter_ids:
+            self._by_filter.setdefault(filter_id, set()).add(product_id)
+        return True
+
+    def remove(self, product_id: int):
+        entry = self._entries.pop(product_id, None)
+        if entry is None:
+            return
+        price, filter_ids = entry
+        del self._prices[bisect.bisect_left(self._prices, (price, product_id))]
+        for filter_id in filter_ids:
+            products = self._by_filter[filter_id]
+            products.discard(product_id)
+            if not products:
+                del self._by_filter[filter_id]
+
+    def query(self, filter_ids: List[int] = (), price_min: Optional[float] = None,
+              price_max: Optional[float] = None) -> List[int]:
+        """ID товаров с любым из filter_ids и ценой в [price_min, price_max), по возрастанию цены"""
+        low = 0 if price_min is None else bisect.bisect_left(self._prices, (price_min,))
+        high = len(self._prices) if price_max is None else bisect.bisect_left(self._prices, (price_max,))
+        if not filter_ids:
+            return [product_id for _, product_id in self._prices[low:high]]
+        
+        selected = set().union(*(self._by_filter.get(filter_id, ()) for filter_id in filter_ids))
+        if high - low <= len(selected):
+            return [product_id for _, product_id in self._prices[low:high] if product_id in selected]
+        
+        found = []
+        for product_id in selected:
+            price = self._entries[product_id][0]
+            if (price_min is None or price >= price_min) and (price_max is None or price < price_max):
+                found.append((price, product_id))
+        found.sort()
+        return [product_id for _, product_id in found]
+
+facet_index = FacetIndex()
+
+class Database:
+    def __init__(self):
+        self.products: List[Dict] = []
+        self.categories: List[Dict] = []
+        self.users: Dict[int, Dict] = {}
+        self.transactions: List[Dict] = []  # Последние транзакции, старые - в архиве
+        # Счетчики покупок за все время (включая архив), обновляются при каждой покупке
+        self.purchase_stats: Dict = new_purchase_stats()
+        self.pending_orders: Dict[str, Dict] = {}  # Ожидающие подтверждения заказы
+        self.leaderboard = UserLeaderboard()
+        # ID пользователей по возрастанию для рассылки (строится при первом обращении)
+        self._sorted_user_ids: Optional[List[int]] = None
+        # Индексы каталога: id -> товар/категория, id категории -> товары
+        self.products_by_id: Dict[int, Dict] = {}
+        self.categories_by_id: Dict[int, Dict] = {}
+        self.products_by_category: Dict[int, List[Dict]] = {}
+        # Растет при каждом изменении каталога - по нему сбрасываются кэши клавиатур и карточек
+        self.catalog_version = 0
+        # Растет при изменении остатков - от них зависят только тексты с количеством
+        self.stock_version = 0
+        self.journal: Optional[UsersJournal] = None
+        self._compaction_task: Optional[asyncio.Task] = None
+        if config.STORAGE_MODE == 'journal':
+            self.journal = UsersJournal(config.USERS_JOURNAL_FILE)
+        self.load_data()
+    
+    def load_data(self):
+        """Загружаем данные из файлов"""
+        self._sorted_user_ids = None
+        try:
+            # Загружаем товары и категории
+            if os.path.exists(config.DATA_FILE):
+                with open(config.DATA_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    self.products = data.get('products', [])
+                    self.categories = data.get('categories', [])
+            else:
+                self.categories = [
+                    {"id": 1, "name": "💻 Цифровые услуги"},
+                    {"id": 2, "name": "🎨 Дизайн"},
+                    {"id": 3, "name": "📝 Контент"}
+                ]
+                self.save_products_data()
+            
+            # Загружаем пользователей
+            if os.path.exists(config.USERS_FILE):
+                with open(config.USERS_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    users_data = data.get('users', {})
+                    self.users = {int(k): v for k, v in users_data.items()}
+                    self.transactions = data.get('transactions', [])
+                    self.pending_orders = data.get('pending_orders', {})
+                    self.purchase_stats = data.get('transaction_stats') or new_purchase_stats()
+                    if 'transaction_stats' not in data:
+                        # Файл старого формата: все транзакции еще на месте
+                        for transaction in self.transactions:
+                            add_to_purchase_stats(self.purchase_stats, transaction)
+
+            # Досматываем журнал поверх снимка
+            if self.journal:
+                records = self.journal.replay()
+                for record in records:
+                    self._apply_journal_record(record)
+                if records:
+                    self.compact_journal()
+
+            if self.archive_transactions():
+                if self.journal:
+                    self.compact_journal()
+                else:
+                    self.save_users_data()
+        except Exception as e:
+            logger.error("Ошибка загрузки данных: %s", e)
+            self.products = []
+            self.categories = []
+            self.users = {}
+            self.transactions = []
+            self.purchase_stats = new_purchase_stats()
+            self.pending_orders = {}
+        self.rebuild_catalog_indexes()
+        self.leaderboard.reset(self.users)
+
+    def rebuild_catalog_indexes(self):
+        """Перестроить индексы товаров и категорий"""
+        self.categories_by_id = {category["id"]: category for category in self.categories}
+        self.products_by_id = {}
+        self.products_by_category = {}
+        for product in self.products:
+            self._index_product(product)
+
+    def _index_product(self, product: Dict):
+        # При повторе id (товар в нескольких категориях) get_product отдает первое вхождение
+        self.products_by_id.setdefault(product["id"], product)
+        self.products_by_category.setdefault(product["category_id"], []).append(product)
+
+    def _apply_journal_record(self, record: Dict):
+        """Применить одну запись журнала к данным в памяти"""
+        op = record.get('op')
+        if op == 'user':
+            self.users[int(record['id'])] = record['data']
+        elif op == 'txn':
+            # Запись могла уже попасть в снимок, если сбой случился до удаления сегмента
+            if record['data']['id'] > self.purchase_stats['last_id']:
+                self._add_transaction(record['data'])
+        elif op == 'order_add':
+            self.pending_orders[record['id']] = record['data']
+        elif op == 'order_remove':
+            self.pending_orders.pop(record['id'], None)
+
+    def _log_users_change(self, record: Dict):
+        """Сохранить изменение: запись в журнал или полная перезапись файла"""
+        if not self.journal:
+            self.save_users_data()
+            return
+        try:
+            self.journal.append(record)
+            if self.journal.records_count >= config.JOURNAL_COMPACT_EVERY:
+                self.compact_journal()
+        except Exception as e:
+            logger.error("Ошибка записи журнала: %s", e)
+
+    def compact_journal(self):
+        """Записать снимок пользователей и очистить журнал"""
+        if self._compaction_task and not self._compaction_task.done():
+            return
+        try:
+            data = {
+                "users": self.users,
+                "transactions": self.transactions,
+                "transaction_stats": self.purchase_stats,
+                "pending_orders": self.pending_orders
+            }
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                write_json_atomic(config.USERS_FILE, data, indent=None)
+                self.journal.rotate()
+                self.journal.discard_rotated()
+                return
+
+            data = snapshot_copy(data)
+            self.journal.rotate()
+            self._compaction_task = persistence.spawn(self._finish_compaction(data))
+        except Exception as e:
+            logger.error("Ошибка компакции журнала: %s", e)
+
+    async def _finish_compaction(self, data: Dict):
+        try:
+            text = await asyncio.to_thread(json.dumps, data, ensure_ascii=False)
+            await write_text_atomic_async(config.USERS_FILE, text)
+            self.journal.discard_rotated()
+        except Exception as e:
+            logger.error("Ошибка компакции журнала: %s", e)
+
+    def save_products_data(self):
+        """Сохраняем товары и категории"""
+        try:
+            persistence.request_save(config.DATA_FILE, lambda: {
+                "products": self.products,
+                "categories": self.categories
+            })
+        except Exception as e:
+            logger.error("Ошибка сохранения товаров: %s", e)
+    
+    def save_users_data(self):
+        """Сохраняем пользователей"""
+        try:
+            persistence.request_save(config.USERS_FILE, lambda: {
+                "users": self.users,
+                "transactions": self.transactions,
+                "transaction_stats": self.purchase_stats,
+                "pending_orders": self.pending_orders
+            })
+        except Exception as e:
+            logger.error("Ошибка сохранения пользователей: %s", e)
+    
+    # Работа с пользователями
+    def get_user(self, user_id: int) -> Dict:
+        """Пользователь (создается при первом обращении); изменения в словаре сохраняет вызывающий"""
+        if user_id not in self.users:
+            self.users[user_id] = {
+                "total_spent": 0.0,
+                "total_orders": 0,
+                "registration_date": datetime.now().isoformat(),
+                "last_activity": datetime.now().isoformat()
+            }
+            metrics.on_user_registered()
+            self.leaderboard.update(user_id, self.users[user_id])
+            if self._sorted_user_ids is not None:
+                bisect.insort(self._sorted_user_ids, user_id)
+            self._log_users_change({'op': 'user', 'id': user_id, 'data': self.users[user_id]})
+        return self.users[user_id]
+
+    def get_user_totals(self) -> Tuple[int, int, float]:
+        """Число пользователей, их заказов и потраченная сумма (полный проход)"""
+        total_orders = sum(user.get('total_orders', 0) for user in self.users.values())
+        total_spent = sum(user.get('total_spent', 0) for user in self.users.values())
+        return len(self.users), total_orders, total_spent
+
+    def iter_user_ids(self, after_id: Optional[int], batch_size: int) -> Iterator[List[int]]:
+        """ID пользователей по возрастанию, пачками, начиная после after_id"""
+        if self._sorted_user_ids is None:
+            self._sorted_user_ids = sorted(self.users)
+        user_ids = self._sorted_user_ids
+        while True:
+            # Позицию ищем заново: между пачками могли зарегистрироваться новые пользователи
+            start = bisect.bisect_right(user_ids, after_id) if after_id is not None else 0
+            batch = user_ids[start:start + batch_size]
+            if not batch:
+                return
+            yield batch
+            after_id = batch[-1]
+
+    def get_top_users(self, kind: str, offset: int, limit: int) -> List[Tuple[int, Dict]]:
+        """Страница рейтинга пользователей: kind - 'orders' или 'spent'"""
+        return [(user_id, self.users[user_id]) for user_id in self.leaderboard.page(kind, offset, limit)]
+    
+    def update_user_stats(self, user_id: int, amount: float):
+        """Обновить статистику пользователя после покупки"""
+        try:
+            user = self.get_user(user_id)
+            user["total_spent"] = user.get("total_spent", 0.0) + amount
+            user["total_orders"] = user.get("total_orders", 0) + 1
+            user["last_activity"] = datetime.now().isoformat()
+            metrics.on_purchase(amount)
+            self.leaderboard.update(user_id, user)
+            
+            transaction = {
+                "id": self.purchase_stats["last_id"] + 1,
+                "user_id": user_id,
+                "type": "purchase",
+                "amount": amount,
+                "description": "Оплата товара",
+                "date": datetime.now().isoformat()
+            }
+            self._add_transaction(transaction)
+            archived = self.archive_transactions()
+            
+            if self.journal:
+                self._log_users_change({'op': 'user', 'id': user_id, 'data': user})
+                self._log_users_change({'op': 'txn', 'data': transaction})
+                if archived:
+                    self.compact_journal()
+            else:
+                self.save_users_data()
+        except Exception as e:
+            logger.error("Ошибка обновления статистики: %s", e)
+
+    def _add_transaction(self, transaction: Dict):
+        self.transactions.append(transaction)
+        add_to_purchase_stats(self.purchase_stats, transaction)
+
+    def get_purchase_stats(self) -> Dict:
+        """Число и сумма покупок за все время, плюс разбивка по дням"""
+        return self.purchase_stats
+
+    def archive_transactions(self) -> bool:
+        """Перенести старые транзакции в архивные сегменты (файл на месяц)
+
+        Срабатывает, когда в памяти накопилось вдвое больше TRANSACTIONS_HOT_LIMIT,
+        и оставляет последние TRANSACTIONS_HOT_LIMIT. Накопленная статистика
+        не меняется. Если сбой случится до сохранения снимка, при следующей
+        архивации уже записанные транзакции пропускаются по id.
+        """
+        limit = config.TRANSACTIONS_HOT_LIMIT
+        if len(self.transactions) < max(1, limit * 2):
+            return False
+        cold = self.transactions[:-limit] if limit else self.transactions
+        try:
+            self._append_archive_segments(cold)
+        except OSError as e:
+            logger.error("Ошибка архивации транзакций: %s", e)
+            return False
+        self.transactions = self.transactions[len(cold):]
+        logger.info("🗄️ В архив перенесено транзакций: %d", len(cold))
+        return True
+
+    def _append_archive_segments(self, transactions: List[Dict]):
+        segments: Dict[str, List[Dict]] = {}
+        for transaction in transactions:
+            month = (transaction.get("date") or "unknown")[:7]
+            segments.setdefault(month, []).append(transaction)
+        os.makedirs(config.TRANSACTIONS_ARCHIVE_DIR, exist_ok=True)
+        for month, month_transactions in segments.items():
+            path = os.path.join(config.TRANSACTIONS_ARCHIVE_DIR, f"transactions_{month}.jsonl")
+            # id растут, поэтому все, что не новее последней записи сегмента, уже в архиве
+            last_id = self._archive_tail_id(path)
+            lines = [json.dumps(transaction, ensure_ascii=False)
+                     for transaction in month_transactions if transaction["id"] > last_id]
+            if not lines:
+                continue
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _archive_tail_id(path: str) -> int:
+        """id последней целой записи архивного сегмента (0 - сегмента еще нет)
+
+        Строку, оборванную сбоем посреди записи, обрезает: транзакция из нее
+        будет записана заново.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            start = max(0, size - 65536)
+            f.seek(start)
+            tail = f.read()
+            end = tail.rfind(b'\n') + 1
+            if end < len(tail):
+                f.truncate(start + end)
+        for line in reversed(tail[:end].splitlines()):
+            try:
+                return json.loads(line)["id"]
+            except (ValueError, KeyError, TypeError):
+                continue
+        return 0
+    
+    # Работа с ожидающими заказами
+    def add_pending_order(self, order_id: str, order_data: Dict):
+        """Добавить ожидающий заказ"""
+        if order_id not in self.pending_orders:
+            metrics.on_pending_order(1)
+        self.pending_orders[order_id] = order_data
+        self._log_users_change({'op': 'order_add', 'id': order_id, 'data': order_data})
+    
+    def get_pending_order(self, order_id: str) -> Optional[Dict]:
+        """Получить ожидающий заказ"""
+        return self.pending_orders.get(order_id)
+    
+    def remove_pending_order(self, order_id: str):
+        """Удалить ожидающий заказ"""
+        if order_id in self.pending_orders:
+            del self.pending_orders[order_id]
+            metrics.on_pending_order(-1)
+            self._log_users_change({'op': 'order_remove', 'id': order_id})
+    
+    # Работа с категориями и товарами
+    def get_categories(self) -> List[Dict]:
+        return self.categories
+    
+    def get_category(self, category_id: int) -> Optional[Dict]:
+        return self.categories_by_id.get(category_id)
+    
+    def add_category(self, name: str) -> int:
+        new_id = max(self.categories_by_id, default=0) + 1
+        category = {"id": new_id, "name": name}
+        self.categories.append(category)
+        self.categories_by_id[new_id] = category
+        self.catalog_version += 1
+        self.save_products_data()
+        return new_id
+    
+    def get_products_by_category(self, category_id: int) -> List[Dict]:
+        return self.products_by_category.get(category_id, [])
+    
+    def get_all_products(self) -> List[Dict]:
+        """Получить все товары"""
+        return self.products
+    
+    def get_product(self, product_id: int) -> Optional[Dict]:
+        return self.products_by_id.get(product_id)
+    
+    def add_product(self, category_id: int, name: str, price: float, description: str = "", quantity: int = 9999) -> int:
+        new_id = max(self.products_by_id, default=0) + 1
+        product = {
+            "id": new_id,
+            "category_id": category_id,
+            "name": name,
+            "price": price,
+            "description": description,
+            "quantity": quantity
+        }
+        self.products.append(product)
+        self._index_product(product)
+        search_index.add(product)
+        facet_index.add(product)
+        self.catalog_version += 1
+        self.save_products_data()
+        return new_id
+    
+    def delete_product(self, product_id: int) -> bool:
+        if product_id not in self.products_by_id:
+            return False
+        self.products = [prod for prod in self.products if prod["id"] != product_id]
+        del self.products_by_id[product_id]
+        for category_id, products in list(self.products_by_category.items()):
+            remaining = [prod for prod in products if prod["id"] != product_id]
+            if remaining:
+                self.products_by_category[category_id] = remaining
+            else:
+                del self.products_by_category[category_id]
+        search_index.remove(product_id)
+        facet_index.remove(product_id)
+        self.catalog_version += 1
+        self.save_products_data()
+        return True
+
+    def adjust_stock(self, product_id: int, delta: int) -> Optional[int]:
+        """Изменить остаток товара во всех категориях, где он выставлен"""
+        remaining = None
+        for product in self.products:
+            if product["id"] == product_id:
+                product["quantity"] = max(0, product.get("quantity", 9999) + delta)
+                remaining = product["quantity"]
+        if remaining is not None:
+            self.stock_version += 1
+            self.save_products_data()
+        return remaining
+
+    def foreign_catalog_change(self, since: Optional[int], version: int) -> bool:
+        """Менял ли каталог кто-то кроме этого процесса (JSON-хранилище у процесса одно)"""
+        return since is None
+
+# ==================== ХРАНИЛИЩЕ SQLITE ====================
+
+def _product_from_row(row: sqlite3.Row) -> Dict:
+    return {
+        "id": row["id"],
+        "category_id": row["category_id"],
+        "name": row["name"],
+        "price": row["price"],
+        "description": row["description"],
+        "quantity": row["quantity"],
+        "filter_ids": json.loads(row["filter_ids"] or "[]")
+    }
+
+def _user_from_row(row: sqlite3.Row) -> Dict:
+    return {
+        "total_spent": row["total_spent"],
+        "total_orders": row["total_orders"],
+        "registration_date": row["registration_date"],
+        "last_activity": row["last_activity"]
+    }
+
+class SQLiteRowsView:
+    """Ленивое представление таблицы как списка: len() и итерация без загрузки в память"""
+
+    def __init__(self, conn: sqlite3.Connection, table: str, decode: Callable[[sqlite3.Row], Dict], order_by: str = "id"):
+        self._conn = conn
+        self._table = table
+        self._decode = decode
+        self._order_by = order_by
+
+    def __len__(self) -> int:
+        return self._conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in self._conn.execute(f"SELECT * FROM {self._table} ORDER BY {self._order_by}"):
+            yield self._decode(row)
+
+class SQLiteMappingView(Mapping):
+    """Ленивое представление таблицы как словаря по ключевой колонке"""
+
+    def __init__(self, conn: sqlite3.Connection, table: str, key: str, decode: Callable[[sqlite3.Row], Dict]):
+        self._conn = conn
+        self._table = table
+        self._key = key
+        self._decode = decode
+
+    def __getitem__(self, key):
+        row = self._conn.execute(f"SELECT * FROM {self._table} WHERE {self._key} = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._decode(row)
+
+    def __iter__(self):
+        for row in self._conn.execute(f"SELECT {self._key} FROM {self._table}"):
+            yield row[0]
+
+    def __len__(self) -> int:
+        return self._conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+
+    def items(self):
+        for row in self._conn.execute(f"SELECT * FROM {self._table}"):
+            yield row[self._key], self._decode(row)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+class SQLiteDatabase:
+    """Хранилище на SQLite с тем же интерфейсом, что и Database"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.journal = None
+
+        # Представления для кода, который обращается к атрибутам напрямую
+        self.products = SQLiteRowsView(self.conn, "products", _product_from_row, order_by="row_id")
+        self.categories = SQLiteRowsView(self.conn, "categories", dict)
+        self.users = SQLiteMappingView(self.conn, "users", "id", _user_from_row)
+        self.transactions = SQLiteRowsView(self.conn, "transactions", dict)
+        self.pending_orders = SQLiteMappingView(self.conn, "pending_orders", "order_id",
+                                                lambda row: json.loads(row["data"]))
+
+        if len(self.categories) == 0 and len(self.products) == 0:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO categories (id, name) VALUES (?, ?)",
+                    [(1, "💻 Цифровые услуги"), (2, "🎨 Дизайн"), (3, "📝 Контент")]
+                )
+
+        # Версия каталога раньше хранилась в PRAGMA user_version - продолжаем с нее
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', ?)",
+                (self.conn.execute("PRAGMA user_version").fetchone()[0],)
+            )
+            self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('stock_version', 0)")
+        # Версии каталога, которые создал этот процесс: его изменения индексы уже знают
+        self._own_versions: set = set()
+
+        # База, созданная до появления purchase_stats: считаем статистику один раз
+        if not self.conn.execute("SELECT 1 FROM purchase_stats LIMIT 1").fetchone():
+            with self.conn:
+                self.conn.execute(PURCHASE_STATS_BACKFILL)
+
+    @property
+    def catalog_version(self) -> int:
+        """Версия каталога из таблицы meta - общая для всех процессов с этой базой"""
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()[0]
+
+    @property
+    def stock_version(self) -> int:
+        """Версия остатков: меняется при списании товара, каталог при этом не перестраивается"""
+        return self.conn.execute("SELECT value FROM meta WHERE key = 'stock_version'").fetchone()[0]
+
+    def _bump_catalog_version(self):
+        """Увеличить версию каталога; вызывать внутри транзакции изменения"""
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'catalog_version'")
+        self._own_versions.add(self.catalog_version)
+
+    def foreign_catalog_change(self, since: Optional[int], version: int) -> bool:
+        """Есть ли между версиями since и version изменения каталога из других процессов"""
+        if since is None:
+            return True
+        own = self._own_versions
+        foreign = any(step not in own for step in range(since + 1, version + 1))
+        self._own_versions = {step for step in own if step > version}
+        return foreign
+
+    def load_data(self):
+        """Данные читаются из SQLite по запросу, загружать нечего"""
+
+    def save_products_data(self):
+        """Изменения фиксируются сразу в каждой операции"""
+
+    def save_users_data(self):
+        """Изменения фиксируются сразу в каждой операции"""
+
+    # Работа с пользователями
+    def get_user(self, user_id: int) -> Dict:
+        """Пользователь (создается при первом обращении).
+
+        В отличие от Database возвращается копия строки: присваивания в ней не
+        попадут в базу, менять пользователя можно только методами хранилища
+        (update_user_stats).
+        """
+        row = self.conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        if row is not None:
+            return _user_from_row(row)
+        now = datetime.now().isoformat()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO users (id, total_spent, total_orders, registration_date, last_activity) "
+                "VALUES (?, 0.0, 0, ?, ?)",
+                (user_id, now, now)
+            )
+        metrics.on_user_registered()
+        return {"total_spent": 0.0, "total_orders": 0, "registration_date": now, "last_activity": now}
+
+    def get_user_totals(self) -> Tuple[int, int, float]:
+        """Число пользователей, их заказов и потраченная сумма"""
+        row = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(total_orders), 0), COALESCE(SUM(total_spent), 0) FROM users"
+        ).fetchone()
+        return row[0], row[1], row[2]
+
+    def iter_user_ids(self, after_id: Optional[int], batch_size: int) -> Iterator[List[int]]:
+        """ID пользователей по возрастанию, пачками, начиная после after_id"""
+        last_id = after_id if after_id is not None else -2 ** 63
+        while True:
+            rows = self.conn.execute(
+                "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            batch = [row[0] for row in rows]
+            yield batch
+            last_id = batch[-1]
+
+    def get_top_users(self, kind: str, offset: int, limit: int) -> List[Tuple[int, Dict]]:
+        """Страница рейтинга пользователей по индексу: kind - 'orders' или 'spent'"""
+        column = UserLeaderboard.FIELDS[kind]
+        rows = self.conn.execute(
+            f"SELECT * FROM users ORDER BY {column} DESC, id LIMIT ? OFFSET ?", (limit, offset)
+        )
+        return [(row["id"], _user_from_row(row)) for row in rows]
+
+    def update_user_stats(self, user_id: int, amount: float):
+        """Обновить статистику пользователя после покупки"""
+        try:
+            self.get_user(user_id)
+            now = datetime.now().isoformat()
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE users SET total_spent = total_spent + ?, total_orders = total_orders + 1, "
+                    "last_activity = ? WHERE id = ?",
+                    (amount, now, user_id)
+                )
+                self.conn.execute(
+                    "INSERT INTO transactions (user_id, type, amount, description, date) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, "purchase", amount, "Оплата товара", now)
+                )
+                self.conn.execute(
+                    "INSERT INTO purchase_stats (day, count, amount) VALUES (?, 1, ?) "
+                    "ON CONFLICT(day) DO UPDATE SET count = count + 1, amount = amount + excluded.amount",
+                    (now[:10], abs(amount))
+                )
+            metrics.on_purchase(amount)
+        except Exception as e:
+            logger.error("Ошибка обновления статистики: %s", e)
+
+    def get_purchase_stats(self) -> Dict:
+        """Число и сумма покупок за все время, плюс разбивка по дням"""
+        stats = new_purchase_stats()
+        for row in self.conn.execute("SELECT day, count, amount FROM purchase_stats"):
+            stats["by_day"][row["day"]] = {"count": row["count"], "amount": row["amount"]}
+            stats["count"] += row["count"]
+            stats["amount"] += row["amount"]
+        return stats
+
+    # Работа с ожидающими заказами
+    def add_pending_order(self, order_id: str, order_data: Dict):
+        """Добавить ожидающий заказ"""
+        if order_id not in self.pending_orders:
+            metrics.on_pending_order(1)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pending_orders (order_id, data) VALUES (?, ?)",
+                (order_id, json.dumps(order_data, ensure_ascii=False))
+            )
+
+    def get_pending_order(self, order_id: str) -> Optional[Dict]:
+        """Получить ожидающий заказ"""
+        return self.pending_orders.get(order_id)
+
+    def remove_pending_order(self, order_id: str):
+        """Удалить ожидающий заказ"""
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM pending_orders WHERE order_id = ?", (order_id,))
+        if cursor.rowcount:
+            metrics.on_pending_order(-1)
+
+    # Работа с категориями и товарами
+    def get_categories(self) -> List[Dict]:
+        return list(self.categories)
+
+    def get_category(self, category_id: int) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM categories WHERE id = ?", (category_id,)).fetchone()
+        return dict(row) if row else None
+
+    def add_category(self, name: str) -> int:
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO categories (name) VALUES (?)", (name,))
+            self._bump_catalog_version()
+        return cursor.lastrowid
+
+    def get_products_by_category(self, category_id: int) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT * FROM products WHERE category_id = ? ORDER BY row_id", (category_id,)
+        )
+        return [_product_from_row(row) for row in rows]
+
+    def get_all_products(self) -> List[Dict]:
+        """Получить все товары"""
+        return list(self.products)
+
+    def get_product(self, product_id: int) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT * FROM products WHERE id = ? ORDER BY row_id LIMIT 1", (product_id,)
+        ).fetchone()
+        return _product_from_row(row) if row else None
+
+    def add_product(self, category_id: int, name: str, price: float, description: str = "", quantity: int = 9999) -> int:
+        new_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM products").fetchone()[0]
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO products (id, category_id, name, price, description, quantity) VALUES (?, ?, ?, ?, ?, ?)",
+                (new_id, category_id, name, price, description, quantity)
+            )
+            self._bump_catalog_version()
+        search_index.add({"id": new_id, "name": name, "description": description})
+        facet_index.add({"id": new_id, "price": price})
+        return new_id
+
+    def delete_product(self, product_id: int) -> bool:
+        with self.conn:
+            cursor = self.conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            if cursor.rowcount > 0:
+                self._bump_catalog_version()
+        if cursor.rowcount > 0:
+            search_index.remove(product_id)
+            facet_index.remove(product_id)
+        return cursor.rowcount > 0
+
+    def adjust_stock(self, product_id: int, delta: int) -> Optional[int]:
+        """Изменить остаток товара во всех категориях, где он выставлен"""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE products SET quantity = MAX(0, quantity + ?) WHERE id = ?", (delta, product_id)
+            )
+            if cursor.rowcount:
+                self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'stock_version'")
+        if cursor.rowcount == 0:
+            return None
+        product = self.get_product(product_id)
+        return product["quantity"] if product else None
+
+def create_database():
+    """Создать хранилище согласно config.STORAGE_MODE"""
+    if config.STORAGE_MODE == 'sqlite':
+        return SQLiteDatabase(config.SQLITE_FILE)
+    return Database()
+
+db = create_database()
+
+# ==================== СКЛАД ====================
+
+def order_items(order_data: Dict) -> List[Tuple[int, int]]:
+    """Товары заказа в виде пар (ID товара, количество)"""
+    if order_data.get('is_cart_order'):
+        return [(item['product_id'], item['quantity']) for item in order_data.get('cart_items', [])]
+    if order_data.get('product_id') is not None:
+        return [(order_data['product_id'], 1)]
+    return []
+
+class Inventory:
+    """Резервирование остатков на время проверки оплаты.
+
+    Товар резервируется при отправке скриншота, списывается со склада при
+    подтверждении заказа и возвращается в продажу при отклонении или по
+    истечении RESERVATION_TTL. В методах нет await, поэтому проверка остатка
+    и резерв не перемежаются с другими обработчиками в цикле событий.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.reservations: Dict[str, Dict] = {}  # order_id -> {'items': [...], 'expires_at': ...}
+        self.reserved: Dict[int, int] = {}  # product_id -> зарезервировано шт.
+        self._expiry: List[Tuple[float, str]] = []
+
+    def restore(self):
+        """Восстановить резервы по ожидающим заказам после перезапуска"""
+        now = time.time()
+        for order_id, order_data in db.pending_orders.items():
+            try:
+                expires_at = datetime.fromisoformat(order_data.get('date', '')).timestamp() + self.ttl
+            except ValueError:
+                expires_at = now + self.ttl
+            if expires_at > now:
+                self._add(order_id, order_items(order_data), expires_at)
+        if self.reservations:
+            logger.info("📦 Восстановлено резервов товаров: %d", len(self.reservations))
+
+    def _add(self, order_id: str, items: List[Tuple[int, int]], expires_at: float):
+        self.reservations[order_id] = {'items': items, 'expires_at': expires_at}
+        for product_id, quantity in items:
+            self.reserved[product_id] = self.reserved.get(product_id, 0) + quantity
+        heapq.heappush(self._expiry, (expires_at, order_id))
+
+    def _drop(self, order_id: str) -> Optional[Dict]:
+        reservation = self.reservations.pop(order_id, None)
+        if reservation:
+            for product_id, quantity in reservation['items']:
+                left = self.reserved.get(product_id, 0) - quantity
+                if left > 0:
+                    self.reserved[product_id] = left
+                else:
+                    self.reserved.pop(product_id, None)
+        return reservation
+
+    def _expire(self):
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, order_id = heapq.heappop(self._expiry)
+            reservation = self.reservations.get(order_id)
+            if reservation and reservation['expires_at'] == expires_at:
+                self._drop(order_id)
+                logger.warning("⏰ Резерв по заказу %s истек, товар возвращен в продажу", order_id)
+
+    def available(self, product_id: int) -> int:
+        """Сколько штук товара можно продать с учетом резервов"""
+        product = db.get_product(product_id)
+        if not product:
+            return 0
+        self._expire()
+        return product.get('quantity', 9999) - self.reserved.get(product_id, 0)
+
+    def reserve(self, order_id: str, items: List[Tuple[int, int]]) -> bool:
+        """Зарезервировать товары заказа целиком; False, если чего-то не хватает"""
+        self._expire()
+        if order_id in self.reservations:
+            return True
+        needed: Dict[int, int] = {}
+        for product_id, quantity in items:
+            needed[product_id] = needed.get(product_id, 0) + quantity
+        for product_id, quantity in needed.items():
+            if quantity > self.available(product_id):
+                return False
+        self._add(order_id, list(needed.items()), time.time() + self.ttl)
+        return True
+
+    def release(self, order_id: str) -> bool:
+        """Снять резерв (заказ отклонен или не отправлен)"""
+        return self._drop(order_id) is not None
+
+    def commit(self, order_id: str, items: List[Tuple[int, int]]):
+        """Списать товары подтвержденного заказа со склада"""
+        reservation = self._drop(order_id)
+        if reservation:
+            items = reservation['items']
+        for product_id, quantity in items:
+            product = db.get_product(product_id)
+            if not product:
+                continue
+            if quantity > product.get('quantity', 9999):
+                logger.warning("⚠️ Заказ %s: товара %s на складе меньше, чем заказано", order_id, product_id)
+            db.adjust_stock(product_id, -quantity)
+
+inventory = Inventory(config.RESERVATION_TTL)
+inventory.restore()
+
+# ==================== МЕНЕДЖЕР КОРЗИНЫ ====================
+
+class JsonFileCartStore:
+    """Все корзины в одном JSON-файле (загружаются целиком при старте)"""
+
+    sharded = False
+
+    def load_all(self) -> Dict[int, List[Dict]]:
+        if not os.path.exists(config.CARTS_FILE):
+            return {}
+        with open(config.CARTS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # Конвертируем ключи строк в int
+        return {int(k): v for k, v in data.items()}
+
+    def load(self, user_id: int) -> List[Dict]:
+        return []
+
+    def save_all(self, carts: Dict[int, List[Dict]]):
+        persistence.request_save(config.CARTS_FILE, lambda: carts)
+
+class DirCartStore:
+    """Корзина каждого пользователя в отдельном файле CARTS_DIR/<user_id>.json"""
+
+    sharded = True
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            self._split_legacy_file()
+
+    def _path(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"{user_id}.json")
+
+    def _split_legacy_file(self):
+        # Разовый перенос из общего carts_data.json
+        if not os.path.exists(config.CARTS_FILE):
+            return
+        for user_id, items in JsonFileCartStore().load_all().items():
+            if items:
+                write_json_atomic(self._path(user_id), items, indent=None)
+
+    def load_all(self) -> Dict[int, List[Dict]]:
+        return {}
+
+    def load(self, user_id: int) -> List[Dict]:
+        path = self._path(user_id)
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, user_id: int, items: List[Dict]):
+        items = list(items)
+        persistence.request_save(self._path(user_id), lambda: items or None, indent=None)
+
+    def _scan(self) -> Tuple[int, int]:
+        carts_count = 0
+        items_count = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    items_count += len(json.load(f))
+                carts_count += 1
+        return carts_count, items_count
+
+    async def stats(self) -> Tuple[int, int]:
+        # Обход каталога читает файл каждой корзины - не держим этим цикл событий
+        return await asyncio.to_thread(self._scan)
+
+class SQLiteCartStore:
+    """Корзины строками таблицы carts в SQLite"""
+
+    sharded = True
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def load_all(self) -> Dict[int, List[Dict]]:
+        return {}
+
+    def load(self, user_id: int) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT product_id, quantity, added_at FROM carts WHERE user_id = ? ORDER BY added_at",
+            (user_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def save(self, user_id: int, items: List[Dict]):
+        with self.conn:
+            self.conn.execute("DELETE FROM carts WHERE user_id = ?", (user_id,))
+            self.conn.executemany(
+                "INSERT INTO carts (user_id, product_id, quantity, added_at) VALUES (?, ?, ?, ?)",
+                [(user_id, item['product_id'], item['quantity'], item.get('added_at')) for item in items]
+            )
+
+    async def stats(self) -> Tuple[int, int]:
+        row = self.conn.execute("SELECT COUNT(DISTINCT user_id), COUNT(*) FROM carts").fetchone()
+        return row[0], row[1]
+
+def create_cart_store():
+    """Создать хранилище корзин согласно config.CARTS_STORAGE"""
+    if config.CARTS_STORAGE == 'dir':
+        return DirCartStore(config.CARTS_DIR)
+    if config.CARTS_STORAGE == 'sqlite':
+        return SQLiteCartStore(config.SQLITE_FILE)
+    return JsonFileCartStore()
+
+class CartManager:
+    """Менеджер корзины пользователя"""
+    
+    def __init__(self):
+        self.store = create_cart_store()
+        # user_id -> список товаров в корзине (в шардированном режиме - только загруженные)
+        self.carts: Dict[int, List[Dict]] = {}
+        self._dirty = False  # Есть несохраненные изменения
+        self._dirty_users: set = set()
+        # Пользователи, чья корзина уже подгружалась, -> время последнего обращения
+        # (от давних к недавним): их актуальное состояние в памяти, а на диске может
+        # ждать очереди отложенная запись
+        self._loaded_users: OrderedDict = OrderedDict()
+        # Сколько позиций корзины пользователя уже учтено в metrics
+        self._counted_sizes: Dict[int, int] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.load_carts()
+    
+    def load_carts(self):
+        """Загрузить корзины из файла (в шардированном режиме - по требованию)"""
+        try:
+            self.carts = self.store.load_all()
+        except Exception as e:
+            logger.error("Ошибка загрузки корзин: %s", e)
+            self.carts = {}
+        self._counted_sizes = {user_id: len(items) for user_id, items in self.carts.items()}
+
+    def _load_user_cart(self, user_id: int):
+        """Подгрузить сохраненную корзину пользователя при первом обращении"""
+        if user_id in self._loaded_users or not self.store.sharded:
+            return
+        self._loaded_users[user_id] = time.monotonic()
+        try:
+            items = self.store.load(user_id)
+        except Exception as e:
+            logger.error("Ошибка загрузки корзины %s: %s", user_id, e)
+            return
+        if items:
+            self.carts[user_id] = items
+            self._counted_sizes[user_id] = len(items)
+    
+    def save_carts(self, user_id: Optional[int] = None):
+        """Сохранить корзины (отложенно, если задан CARTS_FLUSH_INTERVAL)"""
+        self._dirty = True
+        if user_id is not None:
+            self._dirty_users.add(user_id)
+            size = len(self.carts.get(user_id, []))
+            metrics.on_cart_changed(self._counted_sizes.get(user_id, 0), size)
+            if size:
+                self._counted_sizes[user_id] = size
+            else:
+                self._counted_sizes.pop(user_id, None)
+        if config.CARTS_FLUSH_INTERVAL <= 0:
+            self.flush()
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        # Все изменения за интервал попадут в одну запись
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(config.CARTS_FLUSH_INTERVAL)
+        self.flush()
+
+    def flush(self):
+        """Немедленно записать корзины, если есть несохраненные изменения"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        dirty_users, self._dirty_users = self._dirty_users, set()
+        try:
+            if self.store.sharded:
+                # Пишем только корзины изменившихся пользователей
+                for user_id in dirty_users:
+                    self.store.save(user_id, self.carts.get(user_id, []))
+            else:
+                self.store.save_all(self.carts)
+        except Exception as e:
+            logger.error("Ошибка сохранения корзин: %s", e)
+
+    def _touch(self, user_id: int):
+        """Отметить обращение к корзине и выгрузить давно не используемые"""
+        now = time.monotonic()
+        self._loaded_users[user_id] = now
+        self._loaded_users.move_to_end(user_id)
+        deadline = now - config.CARTS_IDLE_TTL
+        idle = []
+        for other_id, last_access in self._loaded_users.items():
+            if last_access > deadline or other_id == user_id:
+                break
+            idle.append(other_id)
+        if not idle:
+            return
+        # Несохраненные изменения сначала уходят в хранилище, потом корзина забывается
+        if not self._dirty_users.isdisjoint(idle):
+            self.flush()
+        for other_id in idle:
+            del self._loaded_users[other_id]
+            self.carts.pop(other_id, None)
+            self._counted_sizes.pop(other_id, None)
+
+    async def get_stats(self) -> Tuple[int, int]:
+        """Количество корзин и позиций в них"""
+        if self.store.sharded:
+            # Вызывается при запуске, когда несохраненных изменений еще нет
+            return await self.store.stats()
+        return (sum(1 for cart in self.carts.values() if cart),
+                sum(len(cart) for cart in self.carts.values()))
+    
+    def get_cart(self, user_id: int) -> List[Dict]:
+        """Получить корзину пользователя"""
+        if user_id not in self.carts:
+            self._load_user_cart(user_id)
+        if self.store.sharded:
+            self._touch(user_id)
+        if user_id not in self.carts:
+            self.carts[user_id] = []
+        return self.carts[user_id]
+    
+    def add_to_cart(self, user_id: int, product_id: int, quantity: int = 1) -> bool:
+        """Добавить товар в корзину"""
+        try:
+            cart = self.get_cart(user_id)
+            product = db.get_product(product_id)
+            
+            if not product:
+                return False
+            
+            # Проверяем наличие товара с учетом того, что уже лежит в корзине
+            in_cart = sum(item['quantity'] for item in cart if item['product_id'] == product_id)
+            if in_cart + quantity > inventory.available(product_id):
+                return False
+            
+            # Проверяем, есть ли уже товар в корзине
+            for item in cart:
+                if item['product_id'] == product_id:
+                    item['quantity'] += quantity
+                    self.save_carts(user_id)
+                    return True
+            
+            # Добавляем новый товар
+            cart.append({
+                'product_id': product_id,
+                'quantity': quantity,
+                'added_at': datetime.now().isoformat()
+            })
+            self.save_carts(user_id)
+            return True
+            
+        except Exception as e:
+            logger.error("Ошибка добавления в корзину: %s", e)
+            return False
+    
+    def remove_from_cart(self, user_id: int, product_id: int) -> bool:
+        """Удалить товар из корзины"""
+        try:
+            cart = self.get_cart(user_id)
+            initial_len = len(cart)
+            self.carts[user_id] = [item for item in cart if item['product_id'] != product_id]
+            
+            if len(self.carts[user_id]) < initial_len:
+                self.save_carts(user_id)
+                return True
+            return False
+            
+        except Exception as e:
+            logger.error("Ошибка удаления из корзины: %s", e)
+            return False
+    
+    def update_quantity(self, user_id: int, product_id: int, quantity: int) -> bool:
+        """Обновить количество товара в корзине"""
+        try:
+            cart = self.get_cart(user_id)
+            product = db.get_product(product_id)
+            
+            if not product:
+                return False
+            
+            # Проверяем наличие товара
+            if quantity > inventory.available(product_id):
+                return False
+            
+            for item in cart:
+                if item['product_id'] == product_id:
+                    item['quantity'] = quantity
+                    self.save_carts(user_id)
+                    return True
+            
+            return False
+            
+        except Exception as e:
+            logger.error("Ошибка обновления количества: %s", e)
+            return False
+    
+    def clear_cart(self, user_id: int) -> bool:
+        """Очистить корзину"""
+        try:
+            self._load_user_cart(user_id)
+            if user_id in self.carts:
+                del self.carts[user_id]
+                self.save_carts(user_id)
+                return True
+            return False
+        except Exception as e:
+            logger.error("Ошибка очистки корзины: %s", e)
+            return False
+    
+    def get_cart_total(self, user_id: int) -> Dict:
+        """Получить итог корзины"""
+        try:
+            cart = self.get_cart(user_id)
+            total_amount = 0.0
+            total_quantity = 0
+            items_details = []
+            
+            for item in cart:
+                product = db.get_product(item['product_id'])
+                if product:
+                    price = float(product['price'])
+                    quantity = item['quantity']
+                    item_total = price * quantity
+                    
+                    total_amount += item_total
+                    total_quantity += quantity
+                    
+                    items_details.append({
+                        'product_id': product['id'],
+                        'name': product['name'],
+                        'price': price,
+                        'quantity': quantity,
+                        'item_total': item_total
+                    })
+            
+            return {
+                'total_amount': total_amount,
+                'total_quantity': total_quantity,
+                'items': items_details,
+                'items_count': len(items_details)
+            }
+            
+        except Exception as e:
+            logger.error("Ошибка расчета итога корзины: %s", e)
+            return {'total_amount': 0, 'total_quantity': 0, 'items': [], 'items_count': 0}
+    
+    def get_cart_items_count(self, user_id: int) -> int:
+        """Получить количество товаров в корзине"""
+        return len(self.get_cart(user_id))
+
+# Создаем экземпляр менеджера корзины
+cart_manager = CartManager()
+metrics.reset(db)
+
+# ==================== УТИЛИТЫ ====================
+
+class ChannelMonitor:
+    """Кэш доступности канала: get_chat вызывается не чаще раза в TTL, а не на каждый заказ"""
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.available: Optional[bool] = None
+        self.title: Optional[str] = None
+        self.error: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        ttl = config.ORDER_CHANNEL_CHECK_TTL if self.available else config.ORDER_CHANNEL_RETRY_TTL
+        return self.available is not None and datetime.now().timestamp() - self._checked_at < ttl
+
+    async def check(self) -> bool:
+        """Принудительно проверить канал через get_chat"""
+        try:
+            chat = await bot.get_chat(self.chat_id)
+            self.available, self.title, self.error = True, chat.title, None
+        except Exception as e:
+            self.available, self.error = False, str(e)
+        self._checked_at = datetime.now().timestamp()
+        return self.available
+
+    async def is_available(self) -> bool:
+        """Доступен ли канал (по кэшу, с повторной проверкой после истечения TTL)"""
+        if self._is_fresh():
+            return self.available
+        async with self._lock:
+            if not self._is_fresh():
+                await self.check()
+            return self.available
+
+    def mark_unavailable(self, error: Exception):
+        """Отметить канал недоступным после ошибки отправки"""
+        self.available, self.error = False, str(error)
+        self._checked_at = datetime.now().timestamp()
+
+order_channel = ChannelMonitor(config.ORDER_CHANNEL_ID)
+
+class LockManager:
+    """Блокировки asyncio по ресурсу: пользователю, заказу и т.п.
+
+    Блокировка создается при первом обращении и удаляется, когда ее
+    больше никто не держит и не ждет.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Tuple, List] = {}  # ключ -> [asyncio.Lock, число владельцев и ожидающих]
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def user(self, user_id: int):
+        return self.hold('user', user_id)
+
+    def order(self, order_id: str):
+        return self.hold('order', order_id)
+
+locks = LockManager()
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, need: float = 1) -> float:
+        """Сколько секунд ждать, пока в ведре наберется need токенов (0 - уже есть)"""
+        self._refill()
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Не выдавать токены ближайшие seconds секунд (после 429 от Telegram)"""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class SendQueue:
+    """Очередь исходящих запросов к Telegram с ограничением скорости и повторами"""
+
+    PRIORITY_NORMAL = 0
+    PRIORITY_BULK = 1
+
+    def __init__(self, workers: int, max_attempts: int = 5):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.global_bucket = TokenBucket(config.SEND_RATE_GLOBAL, config.SEND_RATE_GLOBAL)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self.deferred = 0  # Запросы, ждущие своего времени вне очереди
+        self.in_flight = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        """Сколько запросов ждет отправки"""
+        return (self.queue.qsize() if self.queue else 0) + self.deferred
+
+    def _start(self):
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= 10000:
+                self.chat_buckets = {key: b for key, b in self.chat_buckets.items() if not b.idle}
+            if chat_id < 0:
+                rate = config.SEND_RATE_GROUP_PER_MINUTE / 60
+                bucket = TokenBucket(rate, config.SEND_RATE_GROUP_PER_MINUTE)
+            else:
+                bucket = TokenBucket(config.SEND_RATE_PRIVATE, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _put(self, chat_id: int, request: Callable[[], Awaitable], priority: int) -> asyncio.Future:
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self._sequence), chat_id, request, future, 1))
+        return future
+
+    async def call(self, chat_id: int, request: Callable[[], Awaitable], priority: int = PRIORITY_NORMAL) -> Any:
+        """Поставить запрос в очередь и дождаться его результата"""
+        return await self._put(chat_id, request, priority)
+
+    def post(self, chat_id: int, request: Callable[[], Awaitable], what: str) -> asyncio.Future:
+        """Поставить запрос в очередь, не дожидаясь отправки; ошибка только пишется в лог"""
+        def log_error(future: asyncio.Future):
+            if not future.cancelled() and future.exception():
+                logger.error("Ошибка %s (чат %s): %s", what, chat_id, future.exception())
+
+        future = self._put(chat_id, request, self.PRIORITY_NORMAL)
+        future.add_done_callback(log_error)
+        return future
+
+    def _defer(self, item: Tuple, delay: float):
+        """Вернуть запрос в очередь через delay секунд, не занимая обработчик"""
+        self.deferred += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue, item)
+
+    def _requeue(self, item: Tuple):
+        self.deferred -= 1
+        # Запрос остается незавершенным для queue.join(): новая постановка раньше task_done
+        self.queue.put_nowait(item)
+        self.queue.task_done()
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._process(item)
+            except Exception as e:
+                logger.exception("❌ Ошибка очереди отправки: %s", e)
+                self.queue.task_done()
+
+    def _acquire(self, chat_id: int, priority: int) -> float:
+        """Взять токены для отправки; если их нет - сколько секунд подождать"""
+        bucket = self._chat_bucket(chat_id)
+        need = 1 if priority == self.PRIORITY_NORMAL else 1 + self.global_bucket.capacity * 0.1
+        wait = max(self.global_bucket.delay(need), bucket.delay())
+        if wait <= 0:
+            self.global_bucket.take()
+            bucket.take()
+        return wait
+
+    async def _process(self, item: Tuple):
+        priority, sequence, chat_id, request, future, attempt = item
+        if future.done():
+            # Вызвавший уже не ждет результата (например, рассылку остановили)
+            self.queue.task_done()
+            return
+        wait = self._acquire(chat_id, priority)
+        if wait > 0:
+            self._defer(item, wait)
+            return
+        self.in_flight += 1
+        try:
+            result = await request()
+        except TelegramRetryAfter as e:
+            delay = e.retry_after
+            # 429 означает превышение лимита бота: притормаживаем чат и всю отправку
+            self._chat_bucket(chat_id).pause(delay)
+            self.global_bucket.pause(delay)
+            error = e
+        except (TelegramNetworkError, TelegramServerError) as e:
+            delay = min(30, 2 ** attempt)
+            error = e
+        except Exception as e:
+            self.failed += 1
+            if not future.done():
+                future.set_exception(e)
+            self.queue.task_done()
+            return
+        else:
+            self.sent += 1
+            if not future.done():
+                future.set_result(result)
+            self.queue.task_done()
+            return
+        finally:
+            self.in_flight -= 1
+        if attempt >= self.max_attempts:
+            self.failed += 1
+            if not future.done():
+                future.set_exception(error)
+            self.queue.task_done()
+            return
+        self.retried += 1
+        logger.warning("⏳ Повтор отправки в чат %s через %s с: %s", chat_id, delay, error)
+        self._defer((priority, sequence, chat_id, request, future, attempt + 1), delay)
+
+    async def close(self, timeout: float = 10):
+        """Дождаться отправки очереди (не дольше timeout) и остановить обработчики"""
+        if self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("⚠️ Не отправлено запросов при остановке: %d", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+outbox = SendQueue(config.SEND_WORKERS)
+
+# Решения по недавно обработанным заказам: повторное нажатие кнопки получает этот ответ
+order_decisions: "OrderedDict[str, str]" = OrderedDict()
+
+def remember_order_decision(order_id: str, decision: str):
+    order_decisions[order_id] = decision
+    while len(order_decisions) > 1000:
+        order_decisions.popitem(last=False)
+
+# Ошибки Telegram, после которых писать в канал бессмысленно до повторной проверки
+CHAT_ERROR_MARKERS = ('chat not found', 'not enough rights', 'have no rights', 'administrator rights',
+                      'chat_write_forbidden', 'chat_admin_required', 'not a member', 'was kicked')
+
+def is_chat_error(error: Exception) -> bool:
+    """Ошибка относится к самому чату (нет доступа или прав), а не к отправляемому сообщению"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and any(marker in str(error).lower()
+                                                         for marker in CHAT_ERROR_MARKERS)
+
+async def post_order_message(text: str, keyboard: InlineKeyboardMarkup, screenshot_file_id: str = None) -> Message:
+    """Отправить заказ в канал; если Telegram не принял фото или подпись, заказ уходит текстом"""
+    if screenshot_file_id:
+        try:
+            return await outbox.call(config.ORDER_CHANNEL_ID, lambda: bot.send_photo(
+                chat_id=config.ORDER_CHANNEL_ID,
+                photo=screenshot_file_id,
+                caption=trim_text(text, TELEGRAM_CAPTION_LIMIT),
+                reply_markup=keyboard
+            ))
+        except TelegramBadRequest as e:
+            if is_chat_error(e):
+                raise
+            logger.warning("⚠️ Канал не принял скриншот (%s), отправляю заказ текстом", e)
+            text = text.replace("\n📸 Прикреплен скриншот оплаты",
+                                "\n⚠️ Скриншот оплаты не удалось приложить - запросите его у покупателя")
+    return await outbox.call(config.ORDER_CHANNEL_ID, lambda: bot.send_message(
+        chat_id=config.ORDER_CHANNEL_ID,
+        text=trim_text(text, TELEGRAM_TEXT_LIMIT),
+        reply_markup=keyboard
+    ))
+
+async def send_to_order_channel(order_data: Dict, screenshot_file_id: str = None) -> Optional[int]:
+    """
+    Отправить заявку на покупку в канал заказов с кнопками подтверждения
+    """
+    try:
+        logger.debug("Начинаем отправку в канал заказов...")
+        logger.debug("Канал ID: %s", config.ORDER_CHANNEL_ID)
+        logger.debug("Есть скриншот: %s", screenshot_file_id is not None)
+        
+        # Проверяем, доступен ли канал (результат кэшируется)
+        if not await order_channel.is_available():
+            logger.error("Не могу получить доступ к каналу %s: %s", config.ORDER_CHANNEL_ID, order_channel.error)
+            return None
+        
+        # Формируем основную информацию
+        user_info = order_data.get('username', 'без username')
+        user_id = order_data.get('user_id')
+        order_id = order_data.get('order_id', 'N/A')
+        total_amount = order_data.get('total', 0)
+        product_name = order_data.get('product_name', 'Неизвестный товар')
+        product_price = order_data.get('product_price', 0)
+        
+        # Проверяем наличие username
+        if user_info == 'без username':
+            username_warning = "⚠️ ВНИМАНИЕ: У покупателя НЕТ USERNAME!"
+        else:
+            username_warning = ""
+        
+        message_text = f"""🛒 НОВЫЙ ЗАКАЗ
+
+👤 Покупатель: @{user_info}
+🆔 ID: {user_id}
+📦 Товар: {product_name}
+💰 Цена: {product_price:.2f}₽
+💳 Способ оплаты: Ozon (СБП/Карта)
+📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}
+🆔 ID заказа: {order_id}
+"""
+        
+        if username_warning:
+            message_text += f"\n{username_warning}"
+        
+        if screenshot_file_id:
+            message_text += "\n📸 Прикреплен скриншот оплаты"
+        
+        # Сохраняем данные заказа
+        db.add_pending_order(order_id, {
+            'user_id': user_id,
+            'username': user_info,
+            'order_id': order_id,
+            'total': total_amount,
+            'product_id': order_data.get('product_id'),
+            'product_name': product_name,
+            'product_price': product_price,
+            'payment_method': 'Ozon (СБП/Карта)',
+            'date': datetime.now().isoformat(),
+            'has_username': user_info != 'без username'  # Флаг наличия username
+        })
+        
+        # Создаем клавиатуру с кнопками подтверждения
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(
+                text='✅ Подтвердить заказ',
+                callback_data=callbacks.pack('confirm_order', order_id)
+            )
+        )
+        builder.row(
+            InlineKeyboardButton(
+                text='❌ Отклонить',
+                callback_data=callbacks.pack('reject_order', order_id)
+            )
+        )
+        
+        # Если у пользователя нет username, добавляем предупреждение
+        if user_info == 'без username':
+            builder.row(
+                InlineKeyboardButton(
+                    text='⚠️ НЕТ USERNAME!',
+                    callback_data=callbacks.pack('no_username', order_id)
+                )
+            )
+        
+        keyboard = builder.as_markup()
+        
+        # Отправляем сообщение в канал
+        try:
+            logger.debug("Отправляю заказ, скриншот: %s", screenshot_file_id)
+            message = await post_order_message(message_text, keyboard, screenshot_file_id)
+            
+            logger.info("✅ Заказ успешно отправлен в канал. Message ID: %s", message.message_id)
+            return message.message_id
+            
+        except Exception as e:
+            if is_chat_error(e):
+                order_channel.mark_unavailable(e)
+            logger.exception("❌ Ошибка отправки в канал (%s): %s", type(e).__name__, e)
+            return None
+        
+    except Exception as e:
+        logger.exception("❌ Критическая ошибка в send_to_order_channel: %s", e)
+        return None
+
+async def send_cart_to_order_channel(order_data: Dict, screenshot_file_id: str = None) -> Optional[int]:
+    """
+    Отправить заказ из корзины в канал заказов
+    """
+    try:
+        user_info = order_data.get('username', 'без username')
+        user_id = order_data.get('user_id')
+        order_id = order_data.get('order_id', 'N/A')
+        cart_total = order_data.get('cart_total', {})
+        
+        if cart_total['items_count'] == 0:
+            logger.error("❌ Пустая корзина при отправке в канал")
+            return None
+
+        if not await order_channel.is_available():
+            logger.error("❌ Канал заказов %s недоступен: %s", config.ORDER_CHANNEL_ID, order_channel.error)
+            return None
+        
+        # Формируем текст с товарами
+        items_text = "📦 Состав заказа:\n"
+        for item in cart_total['items']:
+            items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
+        
+        message_text = f"""🛒 НОВЫЙ ЗАКАЗ ИЗ КОРЗИНЫ
+
+👤 Покупатель: @{user_info}
+🆔 ID: {user_id}
+{items_text}
+📦 Всего товаров: {cart_total['total_quantity']} шт.
+💰 Общая сумма: {cart_total['total_amount']:.2f}₽
+💳 Способ оплаты: Ozon (СБП/Карта)
+📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}
+🆔 ID заказа: {order_id}
+"""
+        
+        if user_info == 'без username':
+            message_text += "\n⚠️ ВНИМАНИЕ: У покупателя НЕТ USERNAME!"
+        
+        if screenshot_file_id:
+            message_text += "\n📸 Прикреплен скриншот оплаты"
+        
+        # Сохраняем данные заказа
+        db.add_pending_order(order_id, {
+            'user_id': user_id,
+            'username': user_info,
+            'order_id': order_id,
+            'total': cart_total['total_amount'],
+            'is_cart_order': True,
+            'cart_items': cart_total['items'],
+            'total_quantity': cart_total['total_quantity'],
+            'payment_method': 'Ozon (СБП/Карта)',
+            'date': datetime.now().isoformat(),
+            'has_username': user_info != 'без username'
+        })
+        
+        # Создаем клавиатуру
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(
+                text='✅ Подтвердить заказ',
+                callback_data=callbacks.pack('confirm_order', order_id)
+            )
+        )
+        builder.row(
+            InlineKeyboardButton(
+                text='❌ Отклонить',
+                callback_data=callbacks.pack('reject_order', order_id)
+            )
+        )
+        
+        if user_info == 'без username':
+            builder.row(
+                InlineKeyboardButton(
+                    text='⚠️ НЕТ USERNAME!',
+                    callback_data=callbacks.pack('no_username', order_id)
+                )
+            )
+        
+        keyboard = builder.as_markup()
+        
+        # Отправляем сообщение в канал
+        message = await post_order_message(message_text, keyboard, screenshot_file_id)
+        
+        logger.info("✅ Заказ из корзины отправлен в канал. Message ID: %s", message.message_id)
+        return message.message_id
+        
+    except Exception as e:
+        if is_chat_error(e):
+            order_channel.mark_unavailable(e)
+        logger.exception("❌ Ошибка отправки заказа из корзины: %s", e)
+        return None
+
+# ==================== РАССЫЛКА ====================
+
+class Broadcaster:
+    """Возобновляемая рассылка сообщения администратора всем пользователям"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error("Ошибка загрузки состояния рассылки: %s", e)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _save(self):
+        state = dict(self.state)
+        persistence.request_save(self.path, lambda: state)
+
+    def start(self, admin_id: int, from_chat_id: int, message_id: int) -> bool:
+        """Запустить новую рассылку; False, если предыдущая еще идет"""
+        if self.running:
+            return False
+        self.state = {
+            'admin_id': admin_id,
+            'from_chat_id': from_chat_id,
+            'message_id': message_id,
+            'cursor': None,
+            'total': metrics.users,
+            'delivered': 0,
+            'failed': 0,
+            'blocked': 0,
+            'status': 'running',
+            'started_at': datetime.now().isoformat()
+        }
+        self._save()
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    def resume(self):
+        """Продолжить рассылку, прерванную остановкой бота"""
+        if self.state and self.state.get('status') == 'running' and not self.running:
+            logger.info("📣 Продолжаю рассылку: доставлено %d из %d",
+                        self.state['delivered'], self.state['total'])
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Остановить рассылку по команде администратора"""
+        if self.state and self.state.get('status') == 'running':
+            self.state['status'] = 'stopped'
+            self._save()
+        if self.running:
+            self._task.cancel()
+
+    async def close(self):
+        """Прервать рассылку при остановке бота (статус остается running)"""
+        if self.running:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+    async def _run(self):
+        state = self.state
+        try:
+            for batch in db.iter_user_ids(state['cursor'], config.BROADCAST_BATCH):
+                results = await asyncio.gather(*(self._send(user_id) for user_id in batch),
+                                               return_exceptions=True)
+                for user_id, result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        # Неожиданная ошибка одного получателя не прерывает рассылку
+                        logger.error("Рассылка: ошибка для %s: %s", user_id, result)
+                        result = 'failed'
+                    state[result] += 1
+                state['cursor'] = batch[-1]
+                self._save()
+            state['status'] = 'done'
+            state['finished_at'] = datetime.now().isoformat()
+            self._save()
+            logger.info("📣 Рассылка завершена: %s", self.progress_text())
+            await outbox.call(state['admin_id'], lambda: bot.send_message(
+                chat_id=state['admin_id'],
+                text=f"📣 Рассылка завершена\n\n{self.progress_text()}"
+            ))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("❌ Ошибка рассылки: %s", e)
+            state['status'] = 'failed'
+            self._save()
+
+    async def _send(self, user_id: int) -> str:
+        state = self.state
+        try:
+            await outbox.call(user_id, lambda: bot.copy_message(
+                chat_id=user_id,
+                from_chat_id=state['from_chat_id'],
+                message_id=state['message_id']
+            ), priority=SendQueue.PRIORITY_BULK)
+            return 'delivered'
+        except TelegramForbiddenError:
+            return 'blocked'
+        except (TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError) as e:
+            logger.debug("Рассылка: не доставлено %s: %s", user_id, e)
+            return 'failed'
+
+    def progress_text(self) -> str:
+        if not self.state:
+            return "Рассылок еще не было"
+        state = self.state
+        statuses = {'running': '⏳ идет', 'done': '✅ завершена', 'stopped': '⏹ остановлена', 'failed': '❌ прервана ошибкой'}
+        processed = state['delivered'] + state['failed'] + state['blocked']
+        return (f"Статус: {statuses.get(state['status'], state['status'])}\n"
+                f"Обработано: {processed} из {state['total']}\n"
+                f"✅ Доставлено: {state['delivered']}\n"
+                f"🚫 Заблокировали бота: {state['blocked']}\n"
+                f"❌ Ошибок: {state['failed']}")
+
+broadcaster = Broadcaster(config.BROADCAST_FILE)
+
+# ==================== МАРШРУТИЗАЦИЯ CALLBACK ====================
+
+class CallbackField(abc.ABC):
+    """Тип поля в callback_data: упаковка в байты и разбор старого текстового формата"""
+
+    @abc.abstractmethod
+    def pack(self, value: Any, out: bytearray):
+        """Дописать значение в out"""
+
+    @abc.abstractmethod
+    def unpack(self, data: bytes, pos: int) -> Tuple[Any, int]:
+        """Значение из data начиная с pos и позиция после него"""
+
+    def parse(self, tokens: List[str], pos: int) -> Tuple[Any, int]:
+        """Значение из токенов формата action_arg1_arg2 (кнопки до появления кодека)"""
+        return tokens[pos], pos + 1
+
+    @staticmethod
+    def _pack_varint(value: int, out: bytearray):
+        while value > 0x7F:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+
+    @staticmethod
+    def _unpack_varint(data: bytes, pos: int) -> Tuple[int, int]:
+        value = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value, pos
+            shift += 7
+            if shift > 63:
+                raise ValueError("слишком длинное число")
+
+class IntField(CallbackField):
+    """Целое со знаком: zigzag + varint, 1 байт для чисел до 63"""
+
+    def pack(self, value: int, out: bytearray):
+        value = int(value)
+        self._pack_varint(value << 1 if value >= 0 else (-value << 1) - 1, out)
+
+    def unpack(self, data: bytes, pos: int) -> Tuple[int, int]:
+        value, pos = self._unpack_varint(data, pos)
+        return (value >> 1) ^ -(value & 1), pos
+
+    def parse(self, tokens: List[str], pos: int) -> Tuple[int, int]:
+        return int(tokens[pos]), pos + 1
+
+class StrField(CallbackField):
+    """Короткая строка: длина + UTF-8"""
+
+    def pack(self, value: str, out: bytearray):
+        encoded = value.encode('utf-8')
+        self._pack_varint(len(encoded), out)
+        out += encoded
+
+    def unpack(self, data: bytes, pos: int) -> Tuple[str, int]:
+        length, pos = self._unpack_varint(data, pos)
+        if pos + length > len(data):
+            raise ValueError("строка обрезана")
+        return data[pos:pos + length].decode('utf-8'), pos + length
+
+class OrderIdField(CallbackField):
+    """ID заказа вида CART_<user_id>_<timestamp> / ORD_<user_id>_<timestamp>
+
+    Упаковывается как номер префикса и два varint (около 11 байт вместо 25+),
+    ID другого вида - как строка с нулевым номером префикса.
+    """
+
+    PREFIXES = ('CART', 'ORD')
+
+    def pack(self, value: str, out: bytearray):
+        prefix, _, rest = value.partition('_')
+        user_id, _, timestamp = rest.partition('_')
+        if prefix in self.PREFIXES and user_id.isdigit() and timestamp.isdigit():
+            out.append(self.PREFIXES.index(prefix) + 1)
+            self._pack_varint(int(user_id), out)
+            self._pack_varint(int(timestamp), out)
+        else:
+            out.append(0)
+            StrField().pack(value, out)
+
+    def unpack(self, data: bytes, pos: int) -> Tuple[str, int]:
+        kind = data[pos]
+        if kind == 0:
+            return StrField().unpack(data, pos + 1)
+        if kind > len(self.PREFIXES):
+            raise ValueError("неизвестный вид заказа")
+        user_id, pos = self._unpack_varint(data, pos + 1)
+        timestamp, pos = self._unpack_varint(data, pos)
+        return f"{self.PREFIXES[kind - 1]}_{user_id}_{timestamp}", pos
+
+    def parse(self, tokens: List[str], pos: int) -> Tuple[str, int]:
+        # В старом формате ID заказа занимает все оставшиеся токены
+        if pos >= len(tokens):
+            raise IndexError("нет ID заказа")
+        return '_'.join(tokens[pos:]), len(tokens)
+
+CB_INT = IntField()
+CB_STR = StrField()
+CB_ORDER_ID = OrderIdField()
+
+class CallbackRouter:
+    """Маршрутизация нажатий inline-кнопок и кодек callback_data"""
+
+    VERSION = 1
+    MARK = '~'
+    MAX_LENGTH = 64  # Ограничение Telegram на callback_data в байтах
+
+    class _Node:
+        __slots__ = ('children', 'action', 'fields', 'routes')
+
+        def __init__(self):
+            self.children: Dict[str, 'CallbackRouter._Node'] = {}
+            self.action: Optional[str] = None
+            self.fields: Tuple[CallbackField, ...] = ()
+            self.routes: List[Tuple] = []
+
+    def __init__(self):
+        self._exact: Dict[str, List[Tuple]] = {}
+        self._root = self._Node()
+        self._actions: Dict[str, 'CallbackRouter._Node'] = {}
+        self._codes: Dict[int, 'CallbackRouter._Node'] = {}
+        # Состояние FSM -> обработчики, на экране которых оно живет
+        self._screen_states: Dict[str, set] = {}
+        # (действие, поля, состояние) - для отладки и бенчмарка
+        self.registered: List[Tuple[str, Optional[Tuple[CallbackField, ...]], Optional[State]]] = []
+
+    @staticmethod
+    def _code(action: str) -> int:
+        return zlib.crc32(action.encode('utf-8')) & 0xFFFF
+
+    def route(self, action: str, fields: Optional[Tuple[CallbackField, ...]] = None,
+              state: Optional[State] = None):
+        """Декоратор: обработчик для callback_data == action или pack(action, *поля)
+
+        Обработчик получает state и args, только если объявляет такие параметры.
+        """
+        def decorator(handler: Callable[..., Awaitable]):
+            if fields is not None:
+                node = self._actions.get(action)
+                if node is None:
+                    node = self._root
+                    for token in action.split('_'):
+                        node = node.children.setdefault(token, self._Node())
+                    code = self._code(action)
+                    if code in self._codes:
+                        raise ValueError(f"Код callback {action} совпадает с {self._codes[code].action}")
+                    node.action, node.fields = action, tuple(fields)
+                    self._actions[action] = self._codes[code] = node
+                elif node.fields != tuple(fields):
+                    raise ValueError(f"Разные поля у маршрутов {action}")
+                routes = node.routes
+            else:
+                routes = self._exact.setdefault(action, [])
+            
+            params = inspect.signature(handler).parameters
+            entry = (state.state if state else None, handler, 'state' in params, 'args' in params)
+            if state:
+                routes.insert(0, entry)
+            else:
+                routes.append(entry)
+            self.registered.append((action, fields, state))
+            return handler
+        return decorator
+
+    def pack(self, action: str, *values: Any) -> str:
+        """callback_data для маршрута с полями"""
+        node = self._actions[action]
+        if len(values) != len(node.fields):
+            raise ValueError(f"{action}: ожидалось полей {len(node.fields)}, передано {len(values)}")
+        out = bytearray((self.VERSION,))
+        out += self._code(action).to_bytes(2, 'big')
+        for field, value in zip(node.fields, values):
+            field.pack(value, out)
+        data = self.MARK + base64.urlsafe_b64encode(bytes(out)).rstrip(b'=').decode('ascii')
+        if len(data) > self.MAX_LENGTH:
+            raise ValueError(f"callback_data {action} длиннее {self.MAX_LENGTH} байт")
+        return data
+
+    def _decode(self, data: str) -> Tuple['CallbackRouter._Node', Tuple]:
+        raw = base64.urlsafe_b64decode(data[1:] + '=' * (-len(data[1:]) % 4))
+        if len(raw) < 3 or raw[0] != self.VERSION:
+            raise ValueError("неизвестная версия callback_data")
+        node = self._codes.get(int.from_bytes(raw[1:3], 'big'))
+        if node is None:
+            raise ValueError("неизвестное действие")
+        values, pos = [], 3
+        for field in node.fields:
+            value, pos = field.unpack(raw, pos)
+            values.append(value)
+        if pos != len(raw):
+            raise ValueError("лишние байты")
+        return node, tuple(values)
+
+    def _parse_legacy(self, data: str) -> Tuple[Optional['CallbackRouter._Node'], Tuple]:
+        tokens = data.split('_')
+        node, found, start = self._root, None, 0
+        for index, token in enumerate(tokens):
+            node = node.children.get(token)
+            if node is None:
+                break
+            if node.routes:
+                found, start = node, index + 1
+        if found is None:
+            return None, ()
+        values, pos = [], start
+        for field in found.fields:
+            value, pos = field.parse(tokens, pos)
+            values.append(value)
+        if pos != len(tokens):
+            raise ValueError("лишние токены")
+        return found, tuple(values)
+
+    def resolve(self, data: str) -> Tuple[List[Tuple], Tuple]:
+        """Подходящие маршруты и разобранные поля; ValueError - кнопка устарела"""
+        routes = self._exact.get(data)
+        if routes:
+            return routes, ()
+        try:
+            if data.startswith(self.MARK):
+                node, args = self._decode(data)
+            else:
+                node, args = self._parse_legacy(data)
+        except (ValueError, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"Ошибка разбора callback_data {data!r}: {e}") from e
+        return (node.routes, args) if node else ([], ())
+
+    def screen_state(self, state: State, *handlers: Callable[..., Awaitable]):
+        """Состояние живет только на экране handlers: кнопка любого другого обработчика его сбрасывает"""
+        self._screen_states[state.state] = set(handlers)
+
+    async def dispatch(self, callback: CallbackQuery, state: FSMContext):
+        try:
+            routes, args = self.resolve(callback.data or '')
+        except ValueError as e:
+            logger.debug("%s", e)
+            await callback.answer("⚠️ Кнопка устарела, откройте меню заново", show_alert=True)
+            return
+        
+        current = None
+        if routes and (self._screen_states or routes[0][0] is not None):
+            current = await state.get_state()
+        if routes and routes[0][0] is not None:
+            # Есть маршруты, привязанные к состоянию - выбираем по текущему
+            routes = [route for route in routes if route[0] is None or route[0] == current]
+        
+        if not routes:
+            logger.debug("Нет обработчика для callback_data: %s", callback.data)
+            await callback.answer()
+            return
+        
+        _, handler, wants_state, wants_args = routes[0]
+        if current in self._screen_states and handler not in self._screen_states[current]:
+            # Пользователь ушел с экрана, где ждали ввода
+            await state.clear()
+        kwargs = {}
+        if wants_state:
+            kwargs['state'] = state
+        if wants_args:
+            kwargs['args'] = args
+        await handler(callback, **kwargs)
+
+callbacks = CallbackRouter()
+
+@dp.callback_query()
+async def route_callback(callback: CallbackQuery, state: FSMContext):
+    """Единственный обработчик нажатий кнопок - дальше решает CallbackRouter"""
+    await callbacks.dispatch(callback, state)
+
+# ==================== КЛАВИАТУРЫ ====================
+
+class CatalogCache:
+    """Кэш готовых клавиатур и текстов каталога.
+
+    Записи действительны, пока не изменилась db.catalog_version: при добавлении
+    или удалении товаров и категорий весь кэш сбрасывается при следующем обращении.
+    Если каталог изменил другой процесс (SQLite), перестраиваются и индексы поиска.
+    """
+
+    def __init__(self, max_items: int = 2000):
+        self.max_items = max_items
+        self._version = None
+        self._items: Dict[Tuple, Any] = {}
+
+    def sync(self):
+        """Сбросить кэш при смене версии каталога; индексы - только после чужих изменений"""
+        version = db.catalog_version
+        if version == self._version:
+            return
+        self._items.clear()
+        # Свои изменения индексы уже получили через add_product / delete_product
+        if db.foreign_catalog_change(self._version, version):
+            products = db.get_all_products()
+            search_index.rebuild(products)
+            facet_index.rebuild(products)
+        self._version = version
+
+    def get_or_build(self, key: Tuple, build):
+        self.sync()
+        value = self._items.get(key)
+        if value is None:
+            value = build()
+            # Номер страницы приходит из callback_data, поэтому размер кэша ограничен
+            if len(self._items) >= self.max_items:
+                self._items.clear()
+            self._items[key] = value
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self._version = None
+
+
+catalog_cache = CatalogCache()
+
+TELEGRAM_TEXT_LIMIT = 4096
+TELEGRAM_CAPTION_LIMIT = 1024
+
+def telegram_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram (в единицах UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def trim_text(text: str, limit: int) -> str:
+    """Обрезать текст до limit единиц UTF-16, обозначив обрезку многоточием"""
+    if telegram_length(text) <= limit:
+        return text
+    units = text.encode('utf-16-le')[:(limit - 1) * 2]
+    return units.decode('utf-16-le', errors='ignore') + '…'
+
+def split_pages(blocks: List[str], reserved: int = 0, max_items: int = 0,
+                limit: int = TELEGRAM_TEXT_LIMIT) -> List[Tuple[int, int]]:
+    """Границы страниц (start, end) для списка готовых блоков текста.
+
+    Каждая страница вместе с reserved символами заголовка укладывается в limit
+    и содержит не больше max_items блоков (0 - без ограничения).
+    """
+    pages = []
+    start, size = 0, reserved
+    for index, block in enumerate(blocks):
+        block_length = telegram_length(block)
+        too_long = size + block_length > limit
+        too_many = max_items and index - start >= max_items
+        if index > start and (too_long or too_many):
+            pages.append((start, index))
+            start, size = index, reserved
+        size += block_length
+    if start < len(blocks) or not pages:
+        pages.append((start, len(blocks)))
+    return pages
+
+def add_page_nav(builder: InlineKeyboardBuilder, page: int, total_pages: int, action: str, *fields: Any):
+    """Кнопки навигации по страницам: callback_data = callbacks.pack(action, *fields, номер страницы)"""
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=callbacks.pack(action, *fields, page - 1)))
+    if total_pages > 1:
+        nav_buttons.append(InlineKeyboardButton(text=f"{page + 1}/{total_pages}", callback_data="no_action"))
+    if page < total_pages - 1:
+        nav_buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=callbacks.pack(action, *fields, page + 1)))
+    if nav_buttons:
+        builder.row(*nav_buttons)
+
+def main_menu_kb(user_id: int = None) -> InlineKeyboardMarkup:
+    """Главное меню с учетом прав администратора"""
+    builder = InlineKeyboardBuilder()
+    
+    # Добавляем кнопку корзины с количеством товаров
+    cart_count = cart_manager.get_cart_items_count(user_id) if user_id else 0
+    cart_text = f'🛒 Корзина ({cart_count})' if cart_count > 0 else '🛒 Корзина'
+    
+    builder.row(
+        InlineKeyboardButton(text='🛒 Посмотреть услуги', callback_data='view_categories'),
+        InlineKeyboardButton(text='🔍 Поиск', callback_data='search'),
+    )
+    builder.row(
+        InlineKeyboardButton(text=cart_text, callback_data='view_cart'),
+        InlineKeyboardButton(text='🆘 Поддержка', callback_data='support'),
+    )
+    
+    # Добавляем кнопку админ-панели для администраторов
+    if user_id in config.ADMIN_IDS:
+        builder.row(
+            InlineKeyboardButton(text='👨‍💼 Админ-панель', callback_data='admin_panel'),
+        )
+    
+    return builder.as_markup()
+
+def categories_kb() -> InlineKeyboardMarkup:
+    """Категории товаров (из кэша каталога)"""
+    return catalog_cache.get_or_build(('categories',), _build_categories_kb)
+
+def _build_categories_kb() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    categories = db.get_categories()
+    
+    for category in categories:
+        builder.row(
+            InlineKeyboardButton(
+                text=category["name"], 
+                callback_data=callbacks.pack('category', category['id'])
+            )
+        )
+    
+    builder.row(
+        InlineKeyboardButton(text='🔍 Поиск по каталогу', callback_data='search'),
+        InlineKeyboardButton(text='🎛 Фильтры', callback_data=callbacks.pack('facets', 0, -1, 0, 0))
+    )
+    
+    # Клавиатура общая для всех пользователей, поэтому без счетчика корзины
+    builder.row(
+        InlineKeyboardButton(text='🛒 Корзина', callback_data='view_cart'),
+        InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu'),
+    )
+    return builder.as_markup()
+
+def products_kb(category_id: int, page: int = 0, items_per_page: int = 5) -> InlineKeyboardMarkup:
+    """Товары в категории с пагинацией (из кэша каталога)"""
+    return catalog_cache.get_or_build(
+        ('products', category_id, page, items_per_page),
+        lambda: _build_products_kb(category_id, page, items_per_page)
+    )
+
+def _build_products_kb(category_id: int, page: int, items_per_page: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    products = db.get_products_by_category(category_id)
+    add_products_page(builder, products, page, items_per_page,
+                      lambda target: callbacks.pack('page', category_id, target),
+                      "📭 Нет товаров в этой категории")
+    
+    # Кнопка корзины
+    builder.row(
+        InlineKeyboardButton(text='🛒 Корзина', callback_data='view_cart'),
+    )
+    builder.row(
+        InlineKeyboardButton(text='🔙 Назад к категориям', callback_data='view_categories'),
+        InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu')
+    )
+    
+    return builder.as_markup()
+
+def add_products_page(builder: InlineKeyboardBuilder, products: List[Dict], page: int, items_per_page: int,
+                      page_callback: Callable[[int], str], empty_text: str):
+    """Кнопки товаров одной страницы и навигация; page_callback(номер страницы) -> callback_data"""
+    if not products:
+        builder.row(
+            InlineKeyboardButton(
+                text=empty_text,
+                callback_data="no_action"
+            )
+        )
+    else:
+        # Разбиваем на страницы
+        total_pages = max(1, (len(products) + items_per_page - 1) // items_per_page)
+        start_idx = page * items_per_page
+        end_idx = min(start_idx + items_per_page, len(products))
+        
+        # Показываем товары текущей страницы
+        for product in products[start_idx:end_idx]:
+            # Сокращаем название если слишком длинное
+            product_name = product['name']
+            if len(product_name) > 25:
+                product_name = product_name[:22] + "..."
+            
+            builder.row(
+                InlineKeyboardButton(
+                    text=f"📦 {product_name} - {product['price']}₽",
+                    callback_data=callbacks.pack('product', product['id'])
+                )
+            )
+        
+        # Кнопки навигации
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(
+                InlineKeyboardButton(
+                    text="⬅️ Назад",
+                    callback_data=page_callback(page - 1)
+                )
+            )
+        
+        # Кнопка "информация о странице" в центре
+        if total_pages > 1:
+            nav_buttons.append(
+                InlineKeyboardButton(
+                    text=f"{page+1}/{total_pages}",
+                    callback_data="no_action"
+                )
+            )
+        
+        if page < total_pages - 1:
+            nav_buttons.append(
+                InlineKeyboardButton(
+                    text="Вперед ➡️",
+                    callback_data=page_callback(page + 1)
+                )
+            )
+        
+        if nav_buttons:
+            builder.row(*nav_buttons)
+
+def facet_products(filter_mask: int, band: int, in_stock: bool) -> List[int]:
+    """ID товаров под выбранными фильтрами (маска filter_id, номер диапазона цен, наличие)"""
+    filter_ids = [filter_id for filter_id in config.PRODUCT_FILTERS if filter_mask >> filter_id & 1]
+    price_min, price_max = config.PRICE_BANDS[band] if 0 <= band < len(config.PRICE_BANDS) else (None, None)
+    catalog_cache.sync()
+    product_ids = facet_index.query(filter_ids, price_min, price_max)
+    if in_stock:
+        product_ids = [product_id for product_id in product_ids if inventory.available(product_id) > 0]
+    return product_ids
+
+def facets_kb(filter_mask: int, band: int, in_stock: bool, page: int,
+              products: List[Dict], items_per_page: int = 5) -> InlineKeyboardMarkup:
+    """Переключатели фильтров и найденные товары с пагинацией как в products_kb"""
+    builder = InlineKeyboardBuilder()
+    stock_flag = int(in_stock)
+    
+    # Регионы: можно выбрать несколько, нажатие включает/выключает
+    region_buttons = []
+    for filter_id, name in config.PRODUCT_FILTERS.items():
+        selected = filter_mask >> filter_id & 1
+        region_buttons.append(InlineKeyboardButton(
+            text=f"✅ {name}" if selected else name,
+            callback_data=callbacks.pack('facets', filter_mask ^ (1 << filter_id), band, stock_flag, 0)
+        ))
+    for start in range(0, len(region_buttons), 2):
+        builder.row(*region_buttons[start:start + 2])
+    
+    # Цена: один диапазон, повторное нажатие снимает выбор
+    price_buttons = []
+    for index, (price_min, price_max) in enumerate(config.PRICE_BANDS):
+        label = f"{price_min}-{price_max}₽" if price_max is not None else f"от {price_min}₽"
+        price_buttons.append(InlineKeyboardButton(
+            text=f"✅ {label}" if index == band else label,
+            callback_data=callbacks.pack('facets', filter_mask, -1 if index == band else index, stock_flag, 0)
+        ))
+    builder.row(*price_buttons)
+    
+    builder.row(InlineKeyboardButton(
+        text='✅ Только в наличии' if in_stock else '📦 Только в наличии',
+        callback_data=callbacks.pack('facets', filter_mask, band, 1 - stock_flag, 0)
+    ))
+    
+    add_products_page(builder, products, page, items_per_page,
+                      lambda target: callbacks.pack('facets', filter_mask, band, stock_flag, target),
+                      "📭 Нет товаров с такими фильтрами")
+    
+    builder.row(
+        InlineKeyboardButton(text='🛒 Корзина', callback_data='view_cart'),
+        InlineKeyboardButton(text='🔙 Назад к категориям', callback_data='view_categories')
+    )
+    return builder.as_markup()
+
+def product_detail_kb(product_id: int, category_id: int) -> InlineKeyboardMarkup:
+    """Кнопки карточки товара: корзина, покупка и навигация (из кэша каталога)"""
+    return catalog_cache.get_or_build(
+        ('product_kb', product_id, category_id),
+        lambda: _build_product_detail_kb(product_id, category_id)
+    )
+
+def _build_product_detail_kb(product_id: int, category_id: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text='🛒 Добавить в корзину', callback_data=callbacks.pack('add_to_cart', product_id)),
+        InlineKeyboardButton(text='💳 Купить сейчас', callback_data=callbacks.pack('buy_product', product_id))
+    )
+    
+    # Кнопка корзины (количество товаров выводится в тексте карточки)
+    builder.row(
+        InlineKeyboardButton(text='🛒 Моя корзина', callback_data='view_cart'),
+    )
+    builder.row(
+        InlineKeyboardButton(text='🔙 Назад', callback_data=callbacks.pack('category', category_id)),
+        InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu')
+    )
+    return builder.as_markup()
+
+def product_card(product_id: int) -> Optional[Dict]:
+    """Карточка товара: заголовок, описание и клавиатура.
+
+    Неизменная часть берется из кэша каталога, а остаток с учетом резервов
+    подставляется при каждом вызове: резервы меняются без смены версии
+    каталога. Количество товаров в корзине пользователя добавляет обработчик.
+    """
+    def build() -> Optional[Dict]:
+        product = db.get_product(product_id)
+        if not product:
+            return None
+        category = db.get_category(product["category_id"])
+        return {
+            'title': f"📦 {product['name']}",
+            'head': f"💰 Цена: {product['price']:.2f}₽\n"
+                    f"📝 Описание: {product.get('description', 'Нет описания')}\n",
+            'tail': f"📁 Категория: {category.get('name', 'Не указана') if category else 'Не указана'}\n",
+            'markup': product_detail_kb(product_id, product["category_id"])
+        }
+
+    card = catalog_cache.get_or_build(('product_card', product_id), build)
+    if not card:
+        return None
+    stock = f"📊 В наличии: {inventory.available(product_id)} шт.\n"
+    return {
+        'title': card['title'],
+        'body': card['head'] + stock + card['tail'],
+        'markup': card['markup']
+    }
+
+SEARCH_RESULTS_LIMIT = 10
+
+def search_results(query: str) -> Dict:
+    """Текст и клавиатура с результатами поиска по каталогу"""
+    catalog_cache.sync()
+    product_ids = search_index.search(query)
+    builder = InlineKeyboardBuilder()
+    
+    for product_id in product_ids[:SEARCH_RESULTS_LIMIT]:
+        product = db.get_product(product_id)
+        if not product:
+            continue
+        product_name = product['name']
+        if len(product_name) > 25:
+            product_name = product_name[:22] + "..."
+        builder.row(
+            InlineKeyboardButton(
+                text=f"📦 {product_name} - {product['price']}₽",
+                callback_data=callbacks.pack('product', product_id)
+            )
+        )
+    
+    if not product_ids:
+        text = f"🔍 По запросу «{query}» ничего не найдено\n\nПопробуйте другое слово или код страны, например +95"
+    elif len(product_ids) > SEARCH_RESULTS_LIMIT:
+        text = (f"🔍 По запросу «{query}» найдено товаров: {len(product_ids)}\n"
+                f"Показаны первые {SEARCH_RESULTS_LIMIT} - уточните запрос")
+    else:
+        text = f"🔍 По запросу «{query}» найдено товаров: {len(product_ids)}"
+    
+    builder.row(
+        InlineKeyboardButton(text='🔍 Новый поиск', callback_data='search'),
+        InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu')
+    )
+    return {'text': text, 'markup': builder.as_markup()}
+
+def cart_kb(cart_items: List[Dict], show_checkout: bool = True) -> InlineKeyboardMarkup:
+    """Клавиатура для управления корзиной"""
+    builder = InlineKeyboardBuilder()
+    
+    # Кнопки для каждого товара в корзине
+    for item in cart_items:
+        product = db.get_product(item['product_id'])
+        if product:
+            product_name = product['name']
+            if len(product_name) > 20:
+                product_name = product_name[:17] + "..."
+            
+            builder.row(
+                InlineKeyboardButton(
+                    text=f"➖ {product_name} x{item['quantity']}",
+                    callback_data=callbacks.pack('cart_remove', item['product_id'])
+                )
+            )
+    
+    # Кнопки управления
+    if cart_items:
+        if show_checkout:
+            builder.row(
+                InlineKeyboardButton(text='✅ Оформить заказ', callback_data='cart_checkout'),
+                InlineKeyboardButton(text='🗑️ Очистить корзину', callback_data='cart_clear')
+            )
+        
+        builder.row(
+            InlineKeyboardButton(text='➕ Добавить еще товары', callback_data='view_categories'),
+            InlineKeyboardButton(text='✏️ Изменить количество', callback_data='cart_edit_quantity')
+        )
+    
+    builder.row(
+        InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu')
+    )
+    
+    return builder.as_markup()
+
+def cart_checkout_kb() -> InlineKeyboardMarkup:
+    """Клавиатура для оформления заказа из корзины"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text='✅ Подтвердить заказ', callback_data='cart_confirm_payment'),
+        InlineKeyboardButton(text='✏️ Изменить корзину', callback_data='view_cart')
+    )
+    builder.row(
+        InlineKeyboardButton(text='❌ Отменить', callback_data='main_menu')
+    )
+    return builder.as_markup()
+
+def cancel_kb() -> InlineKeyboardMarkup:
+    """Клавиатура отмены"""
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(text='❌ Отмена', callback_data='main_menu'))
+    return builder.as_markup()
+
+def admin_panel_kb() -> InlineKeyboardMarkup:
+    """Клавиатура админ-панели"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text='📦 Управление товарами', callback_data='admin_products'),
+        InlineKeyboardButton(text='📁 Управление категориями', callback_data='admin_categories')
+    )
+    builder.row(
+        InlineKeyboardButton(text='👥 Пользователи', callback_data='admin_users'),
+        InlineKeyboardButton(text='📊 Статистика', callback_data='admin_stats')
+    )
+    builder.row(
+        InlineKeyboardButton(text='⏳ Ожидающие заявки', callback_data='admin_pending'),
+        InlineKeyboardButton(text='📣 Рассылка', callback_data='admin_broadcast'),
+    )
+    builder.row(
+        InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu')
+    )
+    return builder.as_markup()
+
+def admin_products_kb() -> InlineKeyboardMarkup:
+    """Клавиатура управления товарами"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text='➕ Добавить товар', callback_data='admin_add_product'),
+        InlineKeyboardButton(text='🗑️ Удалить товар', callback_data='admin_delete_product')
+    )
+    builder.row(
+        InlineKeyboardButton(text='📋 Список товаров', callback_data='admin_list_products')
+    )
+    builder.row(
+        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
+    )
+    return builder.as_markup()
+
+def admin_categories_kb() -> InlineKeyboardMarkup:
+    """Клавиатура управления категориями"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text='➕ Добавить категорию', callback_data='admin_add_category'),
+        InlineKeyboardButton(text='📋 Список категорий', callback_data='admin_list_categories')
+    )
+    builder.row(
+        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
+    )
+    return builder.as_markup()
+
+def admin_list_products_kb(page: int = 0, total_pages: int = 1) -> InlineKeyboardMarkup:
+    """Клавиатура списка товаров"""
+    builder = InlineKeyboardBuilder()
+    add_page_nav(builder, page, total_pages, 'admin_list_products')
+    builder.row(
+        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_products')
+    )
+    return builder.as_markup()
+
+def admin_list_categories_kb() -> InlineKeyboardMarkup:
+    """Клавиатура списка категорий"""
+    builder = InlineKeyboardBuilder()
+    builder.row(
+        InlineKeyboardButton(text='🔙 Назад', callback_data='admin_categories')
+    )
+    return builder.as_markup()
+
+# ==================== ОБРАБОТЧИКИ КОМАНД ====================
+
+@dp.message(CommandStart())
+async def handle_start(message: Message, command: CommandObject):
+    """Обработка команды /start (в том числе ссылки на товар /start product_<id>)"""
+    try:
+        user_id = message.from_user.id
+        username = message.from_user.username
+        
+        # Проверяем наличие юзернейма
+        if not username:
+            warning_text = """⚠️ ВНИМАНИЕ!
+
+У вас не установлен username в Telegram.
+
+Это может привести к проблемам:
+1. Я не смогу связаться с вами для отправки товара
+2. Администраторы не смогут уточнить детали заказа
+
+📌 Как установить username:
+1. Откройте Настройки Telegram
+2. Выберите "Имя пользователя" (Username)
+3. Установите уникальное имя (например, @ivan_ivanov)
+4. Сохраните изменения
+
+После установки username нажмите /start снова."""
+            
+            await message.answer(
+                text=warning_text,
+                reply_markup=main_menu_kb(user_id)
+            )
+            return
+        
+        # Регистрируем пользователя
+        db.get_user(user_id)
+        
+        # Переход по ссылке на товар из inline-режима
+        product_id = (command.args or '').replace('product_', '', 1)
+        if command.args and command.args.startswith('product_') and product_id.isdigit():
+            card = product_card(int(product_id))
+            if card:
+                await message.answer(
+                    text=f"{card['title']}\n\n{card['body']}",
+                    reply_markup=card['markup']
+                )
+                return
+        
+        # Показываем количество товаров в корзине
+        cart_count = cart_manager.get_cart_items_count(user_id)
+        cart_info = f"\n🛒 Товаров в корзине: {cart_count}" if cart_count > 0 else ""
+        
+        welcome_text = f"""👋 Добро пожаловать, @{username}!{cart_info}
+
+✨ Возможности:
+• 🛒 Просмотр и покупка услуг
+• 🛍️ Корзина для покупки нескольких товаров
+• 💳 Оплата через Ozon (СБП/Карта)
+• ✅ Подтверждение заказов администраторами
+
+Используйте кнопки ниже для навигации:
+"""
+        
+        await message.answer(
+            text=welcome_text,
+            reply_markup=main_menu_kb(user_id)
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при обработке /start: %s", e)
+        await message.answer("❌ Произошла ошибка при запуске")
+
+@dp.message(Command("support"))
+async def handle_support_command(message: Message):
+    """Обработка команды /support"""
+    try:
+        user_id = message.from_user.id
+        username = message.from_user.username or message.from_user.first_name
+        
+        support_text = f"""🆘 Поддержка
+
+По всем вопросам обращайтесь:
+👨‍💼 Администратор: {config.ADMIN_USERNAME}
+
+📞 Контакты:
+• Telegram: {config.ADMIN_USERNAME}
+• Наш бот: @{message.bot.username}
+
+🕐 Режим работы: 24/7
+⏱️ Среднее время ответа: 5-15 минут
+
+💬 Мы поможем с:
+• Выбором и оформлением заказа
+• Оплатой товара
+• Получением товара
+• Возвратом средств
+• Техническими проблемами
+
+Ваш ID для связи: {user_id}
+"""
+        
+        # Создаем клавиатуру
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(
+                text='💬 Написать администратору',
+                url=f'https://t.me/{config.ADMIN_USERNAME.replace("@", "")}'
+            )
+        )
+        builder.row(
+            InlineKeyboardButton(
+                text='🛒 Посмотреть товары',
+                callback_data='view_categories'
+            ),
+            InlineKeyboardButton(
+                text='🏠 Главное меню',
+                callback_data='main_menu'
+            )
+        )
+        
+        await message.answer(
+            text=support_text,
+            reply_markup=builder.as_markup(),
+            disable_web_page_preview=True
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при обработке команды /support: %s", e)
+        await message.answer("❌ Произошла ошибка при загрузке информации о поддержке")
+
+@dp.message(Command("search"))
+async def handle_search_command(message: Message, command: CommandObject, state: FSMContext):
+    """Обработка команды /search <текст>"""
+    try:
+        if not command.args:
+            await state.set_state(SearchStates.waiting_for_query)
+            await message.answer("🔍 Введите название, страну или код, например: Мьянма или +95")
+            return
+        
+        results = search_results(command.args.strip())
+        await message.answer(text=results['text'], reply_markup=results['markup'])
+        
+    except Exception as e:
+        logger.error("Ошибка при обработке команды /search: %s", e)
+        await message.answer("❌ Произошла ошибка при поиске")
+
+@dp.message(SearchStates.waiting_for_query, F.text & ~F.command)
+async def handle_search_query(message: Message, state: FSMContext):
+    """Получен текст запроса после кнопки поиска"""
+    try:
+        await state.clear()
+        results = search_results(message.text.strip())
+        await message.answer(text=results['text'], reply_markup=results['markup'])
+        
+    except Exception as e:
+        logger.error("Ошибка при поиске: %s", e)
+        await message.answer("❌ Произошла ошибка при поиске")
+
+@dp.message(Command("admin"))
+async def handle_admin_command(message: Message):
+    """Обработка команды /admin"""
+    try:
+        user_id = message.from_user.id
+        
+        if user_id not in config.ADMIN_IDS:
+            await message.answer("⛔ У вас нет прав администратора")
+            return
+        
+        admin_text = """👨‍💼 Админ-панель
+
+Доступные команды:
+• /addproduct - Добавить новый товар
+• /addcategory <название> - Добавить категорию
+• /stats - Показать статистику
+
+Или используйте кнопки ниже:
+"""
+        
+        await message.answer(
+            text=admin_text,
+            reply_markup=admin_panel_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при обработке /admin: %s", e)
+        await message.answer("❌ Ошибка при загрузке админ-панели")
+
+# ==================== ОСНОВНЫЕ ОБРАБОТЧИКИ ====================
+
+@callbacks.route('main_menu')
+async def handle_main_menu(callback: CallbackQuery, state: FSMContext):
+    """Обработка перехода в главное меню"""
+    try:
+        await state.clear()
+        
+        await callback.message.edit_text(
+            text="🏠 Главное меню\n\nВыберите действие:",
+            reply_markup=main_menu_kb(callback.from_user.id)
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при переходе в главное меню: %s", e)
+        await callback.answer("Произошла ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('view_categories')
+async def handle_view_categories(callback: CallbackQuery):
+    """Показать список категорий"""
+    try:
+        categories = db.get_categories()
+        
+        if not categories:
+            text = "📭 Категории пока отсутствуют"
+        else:
+            text = "📁 Выберите категорию:"
+        
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=categories_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при загрузке категорий: %s", e)
+        await callback.answer("Ошибка загрузки категорий", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('search')
+async def handle_search(callback: CallbackQuery, state: FSMContext):
+    """Кнопка поиска: ждем текст запроса"""
+    try:
+        await state.set_state(SearchStates.waiting_for_query)
+        
+        builder = InlineKeyboardBuilder()
+        builder.row(InlineKeyboardButton(text='❌ Отмена', callback_data='cancel'))
+        await callback.message.edit_text(
+            text="🔍 Поиск по каталогу\n\nВведите название, страну или код, например: Мьянма или +95",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при открытии поиска: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+callbacks.screen_state(SearchStates.waiting_for_query, handle_search)
+
+@callbacks.route('category', fields=(CB_INT,))
+async def handle_category_products(callback: CallbackQuery, args: Tuple):
+    """Показать товары в выбранной категории"""
+    try:
+        # Извлекаем ID категории
+        category_id = args[0]
+        
+        # Получаем категорию и товары
+        category = db.get_category(category_id)
+        products = db.get_products_by_category(category_id)
+        
+        if not products:
+            category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
+            text = f"📭 В категории '{category_name}' пока нет товаров"
+        else:
+            category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
+            items_per_page = 5
+            total_pages = max(1, (len(products) + items_per_page - 1) // items_per_page)
+            
+            text = f"🛒 Товары в категории '{category_name}':\n"
+            text += f"📄 Показано 1-{min(items_per_page, len(products))} из {len(products)} товаров\n\n"
+            text += "Выберите товар:"
+        
+        # Всегда показываем первую страницу при первом входе
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=products_kb(category_id, page=0)
+        )
+        
+    except ValueError:
+        await callback.answer("Неверный ID категории", show_alert=True)
+    except Exception as e:
+        logger.error("Ошибка при загрузке товаров категории: %s", e)
+        await callback.answer("Ошибка загрузки товаров", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('product', fields=(CB_INT,))
+async def handle_product_detail(callback: CallbackQuery, args: Tuple):
+    """Показать детали товара"""
+    try:
+        # Извлекаем ID товара
+        product_id = args[0]
+        
+        # Карточка товара из кэша
+        card = product_card(product_id)
+        if not card:
+            await callback.answer("Товар не найден", show_alert=True)
+            return
+        
+        # Показываем количество товаров в корзине
+        cart_count = cart_manager.get_cart_items_count(callback.from_user.id)
+        cart_info = f"\n🛒 Товаров в корзине: {cart_count}" if cart_count > 0 else ""
+        
+        await callback.message.edit_text(
+            text=f"{card['title']}{cart_info}\n\n{card['body']}",
+            reply_markup=card['markup']
+        )
+        
+    except ValueError:
+        await callback.answer("Неверный ID товара", show_alert=True)
+    except Exception as e:
+        logger.error("Ошибка при загрузке товара: %s", e)
+        await callback.answer("Ошибка загрузки товара", show_alert=True)
+    
+    await callback.answer()
+
+# ==================== ОБРАБОТЧИКИ КОРЗИНЫ ====================
+
+@callbacks.route('view_cart')
+async def handle_view_cart(callback: CallbackQuery, state: FSMContext):
+    """Показать корзину пользователя"""
+    try:
+        user_id = callback.from_user.id
+        cart = cart_manager.get_cart(user_id)
+        cart_total = cart_manager.get_cart_total(user_id)
+        
+        if not cart:
+            await callback.message.edit_text(
+                text="🛒 Ваша корзина пуста\n\n"
+                     "Добавьте товары из категорий!",
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🛍️ Посмотреть товары', callback_data='view_categories'))
+                    .add(InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu'))
+                    .adjust(1)
+                    .as_markup()
+            )
+            return
+        
+        # Формируем текст корзины
+        cart_text = "🛒 Ваша корзина:\n\n"
+        
+        for i, item_detail in enumerate(cart_total['items'], 1):
+            cart_text += f"{i}. {item_detail['name']}\n"
+            cart_text += f"   💰 {item_detail['price']:.2f}₽ × {item_detail['quantity']} = {item_detail['item_total']:.2f}₽\n\n"
+        
+        cart_text += f"📦 Всего товаров: {cart_total['total_quantity']} шт.\n"
+        cart_text += f"💸 Общая сумма: {cart_total['total_amount']:.2f}₽\n\n"
+        cart_text += "Выберите действие:"
+        
+        await state.set_state(CartStates.managing_cart)
+        await callback.message.edit_text(
+            text=cart_text,
+            reply_markup=cart_kb(cart)
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при показе корзины: %s", e)
+        await callback.answer("Ошибка при загрузке корзины", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('add_to_cart', fields=(CB_INT,))
+async def handle_add_to_cart(callback: CallbackQuery, state: FSMContext, args: Tuple):
+    """Добавить товар в корзину"""
+    try:
+        # Извлекаем ID товара
+        product_id = args[0]
+        
+        # Получаем информацию о товаре
+        product = db.get_product(product_id)
+        if not product:
+            await callback.answer("Товар не найден", show_alert=True)
+            return
+        
+        # Проверяем наличие товара
+        if inventory.available(product_id) <= 0:
+            await callback.answer("❌ Товар закончился", show_alert=True)
+            return
+        
+        # Добавляем в корзину
+        if cart_manager.add_to_cart(callback.from_user.id, product_id, 1):
+            # Обновляем сообщение товара
+            card = product_card(product_id)
+            if card:
+                # Показываем количество товаров в корзине
+                cart_count = cart_manager.get_cart_items_count(callback.from_user.id)
+                
+                await callback.message.edit_text(
+                    text=f"{card['title']}\n\n{card['body']}\n"
+                         f"✅ Товар добавлен в корзину!\n"
+                         f"🛒 Товаров в корзине: {cart_count}\n",
+                    reply_markup=card['markup']
+                )
+            
+            await callback.answer(f"✅ {product['name']} добавлен в корзину!")
+        else:
+            await callback.answer("❌ Ошибка при добавлении в корзину", show_alert=True)
+        
+    except Exception as e:
+        logger.error("Ошибка при добавлении в корзину: %s", e)
+        await callback.answer("❌ Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('cart_remove', fields=(CB_INT,))
+async def handle_cart_remove(callback: CallbackQuery, state: FSMContext, args: Tuple):
+    """Удалить товар из корзины"""
+    try:
+        # Извлекаем ID товара
+        product_id = args[0]
+        
+        # Удаляем из корзины
+        if cart_manager.remove_from_cart(callback.from_user.id, product_id):
+            # Обновляем сообщение корзины
+            cart = cart_manager.get_cart(callback.from_user.id)
+            cart_total = cart_manager.get_cart_total(callback.from_user.id)
+            
+            if not cart:
+                await callback.message.edit_text(
+                    text="✅ Товар удален из корзины!\n\n"
+                         "🛒 Ваша корзина теперь пуста",
+                    reply_markup=InlineKeyboardBuilder()
+                        .add(InlineKeyboardButton(text='🛍️ Посмотреть товары', callback_data='view_categories'))
+                        .add(InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu'))
+                        .adjust(1)
+                        .as_markup()
+                )
+            else:
+                cart_text = "🛒 Ваша корзина:\n\n"
+                
+                for i, item_detail in enumerate(cart_total['items'], 1):
+                    cart_text += f"{i}. {item_detail['name']}\n"
+                    cart_text += f"   💰 {item_detail['price']:.2f}₽ × {item_detail['quantity']} = {item_detail['item_total']:.2f}₽\n\n"
+                
+                cart_text += f"📦 Всего товаров: {cart_total['total_quantity']} шт.\n"
+                cart_text += f"💸 Общая сумма: {cart_total['total_amount']:.2f}₽\n\n"
+                cart_text += "Выберите действие:"
+                
+                await callback.message.edit_text(
+                    text=cart_text,
+                    reply_markup=cart_kb(cart)
+                )
+            
+            await callback.answer("✅ Товар удален из корзины")
+        else:
+            await callback.answer("❌ Товар не найден в корзине", show_alert=True)
+        
+    except Exception as e:
+        logger.error("Ошибка при удалении из корзины: %s", e)
+        await callback.answer("❌ Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('cart_clear')
+async def handle_cart_clear(callback: CallbackQuery, state: FSMContext):
+    """Очистить корзину"""
+    try:
+        if cart_manager.clear_cart(callback.from_user.id):
+            await callback.message.edit_text(
+                text="✅ Корзина очищена!",
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🛍️ Посмотреть товары', callback_data='view_categories'))
+                    .add(InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu'))
+                    .adjust(1)
+                    .as_markup()
+            )
+            await callback.answer("Корзина очищена")
+        else:
+            await callback.answer("❌ Корзина уже пуста", show_alert=True)
+        
+    except Exception as e:
+        logger.error("Ошибка при очистке корзины: %s", e)
+        await callback.answer("❌ Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('cart_checkout')
+async def handle_cart_checkout(callback: CallbackQuery, state: FSMContext):
+    """Оформление заказа из корзины"""
+    try:
+        user_id = callback.from_user.id
+        username = callback.from_user.username
+        
+        # Проверяем наличие юзернейма
+        if not username:
+            error_text = """⚠️ У вас не установлен username!
+
+Для оформления заказа необходимо:
+1. Установить username в настройках Telegram
+2. Нажать /start в этом боте
+3. Повторить покупку
+
+📌 Как установить username:
+1. Откройте Настройки Telegram
+2. Выберите "Имя пользователя" (Username)
+3. Установите уникальное имя
+4. Сохраните изменения"""
+            
+            await callback.message.edit_text(
+                text=error_text,
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🚀 Начать заново (/start)', callback_data='force_start'))
+                    .as_markup()
+            )
+            await callback.answer("❌ Установите username для покупки", show_alert=True)
+            return
+        
+        # Получаем итог корзины
+        cart_total = cart_manager.get_cart_total(user_id)
+        
+        if cart_total['items_count'] == 0:
+            await callback.answer("❌ Корзина пуста", show_alert=True)
+            return
+        
+        # Сохраняем данные для оплаты
+        await state.set_state(PaymentStates.waiting_for_screenshot)
+        
+        # Генерируем ID заказа
+        order_id = f"CART_{user_id}_{int(datetime.now().timestamp())}"
+        
+        # Получаем информацию о методе оплаты
+        payment_info = config.PAYMENT_DETAILS["ozon"]
+        
+        # Сохраняем данные корзины для отправки в канал
+        await state.update_data(
+            user_id=user_id,
+            username=username,
+            order_id=order_id,
+            payment_method='ozon',
+            payment_name=payment_info['name'],
+            cart_total=cart_total,
+            is_cart_order=True
+        )
+        
+        # Формируем текст с товарами из корзины
+        cart_items_text = ""
+        for item in cart_total['items']:
+            cart_items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
+        
+        payment_text = f"""🏦 Оплата через {payment_info['name']}
+
+🛒 Ваш заказ из корзины:
+{cart_items_text}
+📦 Всего товаров: {cart_total['total_quantity']} шт.
+💰 Общая сумма: {cart_total['total_amount']:.2f}₽
+
+👤 Ваш username: @{username}
+
+💳 Номер карты для перевода:
+{payment_info['card_number']}
+
+📱 Номер телефона для СБП:
+{payment_info['phone_number']}
+
+👤 Получатель:
+{payment_info['owner']}
+
+📝 В комментарии к переводу укажите:
+Заказ {order_id}
+
+📸 После оплаты отправьте скриншот чека в этот чат
+"""
+        
+        await callback.message.edit_text(
+            text=payment_text,
+            reply_markup=cart_checkout_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при оформлении заказа из корзины: %s", e)
+        await callback.answer("❌ Ошибка", show_alert=True)
+        await state.clear()
+    
+    await callback.answer()
+
+@callbacks.route('cart_edit_quantity')
+async def handle_cart_edit_quantity(callback: CallbackQuery, state: FSMContext):
+    """Редактирование количества товаров в корзине"""
+    try:
+        user_id = callback.from_user.id
+        cart = cart_manager.get_cart(user_id)
+        
+        if not cart:
+            await callback.answer("Корзина пуста", show_alert=True)
+            return
+        
+        # Создаем клавиатуру для выбора товара для редактирования
+        builder = InlineKeyboardBuilder()
+        cart_total = cart_manager.get_cart_total(user_id)
+        
+        for item_detail in cart_total['items']:
+            product_name = item_detail['name']
+            if len(product_name) > 20:
+                product_name = product_name[:17] + "..."
+            
+            builder.row(
+                InlineKeyboardButton(
+                    text=f"✏️ {product_name} x{item_detail['quantity']}",
+                    callback_data=callbacks.pack('cart_edit', item_detail['product_id'])
+                )
+            )
+        
+        builder.row(
+            InlineKeyboardButton(text='🔙 Назад', callback_data='view_cart')
+        )
+        
+        await state.set_state(CartStates.waiting_for_quantity)
+        await callback.message.edit_text(
+            text="✏️ Редактирование количества\n\n"
+                 "Выберите товар, количество которого хотите изменить:",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при редактировании количества: %s", e)
+        await callback.answer("❌ Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('cart_edit', fields=(CB_INT,))
+async def handle_cart_edit_item(callback: CallbackQuery, state: FSMContext, args: Tuple):
+    """Выбор товара для редактирования количества"""
+    try:
+        product_id = args[0]
+        
+        # Сохраняем ID товара для редактирования
+        await state.update_data(edit_product_id=product_id)
+        
+        product = db.get_product(product_id)
+        if product:
+            product_name = product['name']
+        else:
+            product_name = "Товар"
+        
+        await callback.message.edit_text(
+            text=f"✏️ Введите новое количество для товара:\n"
+                 f"📦 {product_name}\n\n"
+                 f"Текущее количество: {cart_manager.get_cart(callback.from_user.id)[0]['quantity'] if cart_manager.get_cart(callback.from_user.id) else 1}\n\n"
+                 f"Введите число:",
+            reply_markup=InlineKeyboardBuilder()
+                .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
+                .as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при выборе товара для редактирования: %s", e)
+        await callback.answer("❌ Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@dp.message(CartStates.waiting_for_quantity)
+async def handle_quantity_input(message: Message, state: FSMContext):
+    """Обработка ввода нового количества"""
+    try:
+        # Получаем ID товара из состояния
+        data = await state.get_data()
+        product_id = data.get('edit_product_id')
+        
+        if not product_id:
+            await message.answer("❌ Ошибка: товар не выбран", reply_markup=cancel_kb())
+            await state.clear()
+            return
+        
+        # Проверяем ввод
+        try:
+            quantity = int(message.text.strip())
+        except ValueError:
+            await message.answer(
+                "❌ Неверный формат!\n\n"
+                "Введите целое число (например: 1, 2, 3):",
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
+                    .as_markup()
+            )
+            return
+        
+        if quantity <= 0:
+            await message.answer(
+                "❌ Количество должно быть больше 0!\n\n"
+                "Введите новое количество:",
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
+                    .as_markup()
+            )
+            return
+        
+        # Проверяем наличие товара
+        product = db.get_product(product_id)
+        available = inventory.available(product_id)
+        if product and quantity > available:
+            await message.answer(
+                f"❌ Доступно только {max(0, available)} шт.!\n\n"
+                "Введите другое количество:",
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🔙 Назад', callback_data='cart_edit_quantity'))
+                    .as_markup()
+            )
+            return
+        
+        # Обновляем количество
+        if cart_manager.update_quantity(message.from_user.id, product_id, quantity):
+            # Очищаем состояние
+            await state.clear()
+            
+            # Показываем обновленную корзину
+            cart = cart_manager.get_cart(message.from_user.id)
+            cart_total = cart_manager.get_cart_total(message.from_user.id)
+            
+            cart_text = "🛒 Ваша корзина:\n\n"
+            
+            for i, item_detail in enumerate(cart_total['items'], 1):
+                cart_text += f"{i}. {item_detail['name']}\n"
+                cart_text += f"   💰 {item_detail['price']:.2f}₽ × {item_detail['quantity']} = {item_detail['item_total']:.2f}₽\n\n"
+            
+            cart_text += f"📦 Всего товаров: {cart_total['total_quantity']} шт.\n"
+            cart_text += f"💸 Общая сумма: {cart_total['total_amount']:.2f}₽\n\n"
+            cart_text += "✅ Количество обновлено!\n\n"
+            cart_text += "Выберите действие:"
+            
+            await message.answer(
+                text=cart_text,
+                reply_markup=cart_kb(cart)
+            )
+        else:
+            await message.answer(
+                "❌ Ошибка обновления количества",
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🛒 Вернуться в корзину', callback_data='view_cart'))
+                    .as_markup()
+            )
+            await state.clear()
+        
+    except Exception as e:
+        logger.error("Ошибка при вводе количества: %s", e)
+        await message.answer("❌ Ошибка", reply_markup=cancel_kb())
+        await state.clear()
+
+# ==================== ОБРАБОТКА ПОКУПКИ ТОВАРА ====================
+
+@callbacks.route('buy_product', fields=(CB_INT,))
+async def handle_buy_product(callback: CallbackQuery, state: FSMContext, args: Tuple):
+    """Обработать покупку товара"""
+    try:
+        logger.debug("Начало обработки покупки: %s", callback.data)
+        
+        # Проверяем наличие юзернейма у пользователя
+        username = callback.from_user.username
+        user_id = callback.from_user.id
+        
+        if not username:
+            logger.debug("У пользователя %s нет username", user_id)
+            
+            error_text = """⚠️ У вас не установлен username!
+
+Для оформления заказа необходимо:
+1. Установить username в настройках Telegram
+2. Нажать /start в этом боте
+3. Повторить покупку
+
+📌 Как установить username:
+1. Откройте Настройки Telegram
+2. Выберите "Имя пользователя" (Username)
+3. Установите уникальное имя
+4. Сохраните изменения
+
+После установки username нажмите /start и попробуйте снова."""
+            
+            # Создаем клавиатуру с кнопкой /start
+            builder = InlineKeyboardBuilder()
+            builder.row(
+                InlineKeyboardButton(
+                    text='🚀 Начать заново (/start)',
+                    callback_data='force_start'
+                )
+            )
+            
+            await callback.message.edit_text(
+                text=error_text,
+                reply_markup=builder.as_markup()
+            )
+            
+            await callback.answer("❌ Установите username для покупки", show_alert=True)
+            return
+        
+        product_id = args[0]
+        logger.debug("ID товара: %s", product_id)
+        
+        # Получаем информацию о товаре
+        product = db.get_product(product_id)
+        logger.debug("Найден товар: %s", product)
+        
+        if not product:
+            logger.debug("❌ Товар не найден в базе")
+            await callback.answer("Товар не найден", show_alert=True)
+            return
+        
+        # Проверяем наличие товара с учетом резервов
+        quantity = inventory.available(product_id)
+        logger.debug("Количество товара: %s", quantity)
+        
+        if quantity <= 0:
+            logger.debug("❌ Товар закончился")
+            await callback.answer("❌ Товар закончился", show_alert=True)
+            return
+        
+        # Генерируем ID заказа
+        order_id = f"ORD_{user_id}_{int(datetime.now().timestamp())}"
+        logger.debug("Сгенерирован order_id: %s", order_id)
+        
+        # Получаем информацию о методе оплаты
+        payment_info = config.PAYMENT_DETAILS["ozon"]
+        
+        # Получаем цену товара безопасным способом
+        try:
+            if isinstance(product.get('price'), (int, float)):
+                product_price = float(product['price'])
+            elif isinstance(product.get('price'), str):
+                price_str = product['price'].replace('₽', '').replace('руб', '').replace(' ', '').strip()
+                product_price = float(price_str)
+            else:
+                logger.debug("Неизвестный формат цены: %s", product.get('price'))
+                product_price = 0.0
+        except (ValueError, TypeError) as e:
+            logger.debug("Ошибка при обработке цены: %s", e)
+            product_price = 0.0
+            
+        logger.debug("Цена товара: %s", product_price)
+        logger.debug("Username пользователя: @%s", username)
+        
+        # Устанавливаем состояние ожидания скриншота
+        await state.set_state(PaymentStates.waiting_for_screenshot)
+        logger.debug("Установлено состояние ожидания скриншота")
+        
+        # Сохраняем данные платежа
+        await state.update_data(
+            user_id=user_id,
+            username=username,
+            product_id=product_id,
+            product_name=product['name'],
+            product_price=product_price,
+            order_id=order_id,
+            payment_method='ozon',
+            payment_name=payment_info['name']
+        )
+        logger.debug("Данные сохранены в state")
+        
+        # Формируем инструкцию для пользователя
+        payment_text = f"""🏦 Оплата через {payment_info['name']}
+
+📦 Товар: {product['name']}
+💰 Сумма к оплате: {product_price:.2f}₽
+👤 Ваш username: @{username}
+
+💳 Номер карты для перевода:
+{payment_info['card_number']}
+
+📱 Номер телефона для СБП:
+{payment_info['phone_number']}
+
+👤 Получатель:
+{payment_info['owner']}
+
+📝 В комментарии к переводу укажите:
+Заказ {order_id}
+
+📸 После оплаты отправьте скриншот чека в этот чат
+"""
+        
+        await callback.message.edit_text(
+            text=payment_text,
+            reply_markup=cancel_kb()
+        )
+        logger.debug("Сообщение с инструкцией отправлено")
+        
+    except ValueError as e:
+        logger.exception("ValueError при обработке покупки: %s", e)
+        await callback.answer("❌ Ошибка при обработке заказа", show_alert=True)
+        await state.clear()
+    except Exception as e:
+        logger.exception("Общая ошибка при покупке товара: %s", e)
+        await callback.answer("❌ Ошибка при покупке", show_alert=True)
+        await state.clear()
+    
+    await callback.answer()
+
+# ==================== ОБРАБОТКА СКРИНШОТОВ ====================
+
+@dp.message(PaymentStates.waiting_for_screenshot, F.photo)
+async def handle_payment_screenshot(message: Message, state: FSMContext):
+    """Обработать полученный скриншот оплаты (обновленная версия)"""
+    # Несколько фото подряд (альбом) не должны оформить заказ дважды
+    async with locks.user(message.from_user.id):
+        if await state.get_state() != PaymentStates.waiting_for_screenshot.state:
+            return
+        
+        try:
+            # Получаем file_id самого большого размера фото
+            file_id = message.photo[-1].file_id
+            
+            # Получаем данные платежа из состояния
+            data = await state.get_data()
+            
+            # Проверяем, это заказ из корзины или одиночный товар
+            is_cart_order = data.get('is_cart_order', False)
+            
+            # Очищаем состояние
+            await state.clear()
+            
+            if is_cart_order:
+                # Обработка заказа из корзины
+                await _process_cart_purchase_screenshot(message, data, file_id)
+            else:
+                # Обработка одиночного товара (старая логика)
+                await _process_purchase_screenshot(message, data, file_id)
+            
+        except Exception as e:
+            logger.error("Ошибка при обработке скриншота: %s", e)
+            await message.answer(
+                text="❌ Ошибка при обработке скриншота",
+                reply_markup=main_menu_kb(message.from_user.id)
+            )
+            await state.clear()
+
+OUT_OF_STOCK_TEXT = f"""❌ Товар закончился, пока вы оформляли заказ.
+
+Если вы уже оплатили, напишите администратору для возврата средств: {config.ADMIN_USERNAME}
+"""
+
+async def _process_purchase_screenshot(message: Message, data: dict, file_id: str):
+    """Обработать скриншот оплаты заказа"""
+    try:
+        user_id = data.get('user_id')
+        username = data.get('username')
+        payment_name = data.get('payment_name')
+        order_id = data.get('order_id')
+        
+        # Явно преобразуем в float
+        try:
+            product_price = float(data.get('product_price', 0))
+        except (ValueError, TypeError) as e:
+            logger.error("Ошибка преобразования цены: %s", e)
+            product_price = 0.0
+            
+        product_name = data.get('product_name', 'Неизвестный товар')
+        
+        logger.debug("Обработка скриншота для заказа %s", order_id)
+        logger.debug("Пользователь: %s (ID: %s)", username, user_id)
+        logger.debug("Товар: %s, Цена: %s", product_name, product_price)
+        logger.debug("File ID скриншота: %s", file_id)
+        
+        # Формируем данные заказа
+        order_data = {
+            'user_id': user_id,
+            'username': username,
+            'order_id': order_id,
+            'product_id': data.get('product_id'),
+            'total': product_price,
+            'product_name': product_name,
+            'product_price': product_price,
+            'payment_method': payment_name
+        }
+        
+        # Резервируем товар до решения администратора
+        if not inventory.reserve(order_id, order_items(order_data)):
+            await message.answer(
+                text=OUT_OF_STOCK_TEXT,
+                reply_markup=main_menu_kb(user_id)
+            )
+            return
+        
+        # Отправляем в канал
+        logger.debug("Вызываю send_to_order_channel...")
+        result = await send_to_order_channel(order_data, file_id)
+        
+        if result is None:
+            # Админы заказ не увидели: снимаем и резерв, и ожидающий заказ
+            db.remove_pending_order(order_id)
+            inventory.release(order_id)
+            error_text = """❌ Не удалось отправить заявку.
+
+Возможные причины:
+1. Бот не добавлен в канал заказов
+2. У бота нет прав на отправку сообщений в канал
+3. Технические проблемы с Telegram
+
+Пожалуйста, обратитесь к администратору: @koliin98
+"""
+            await message.answer(
+                text=error_text,
+                reply_markup=main_menu_kb(user_id)
+            )
+            return
+        
+        # Обновляем статистику пользователя
+        try:
+            db.update_user_stats(user_id, product_price)
+            logger.debug("Статистика пользователя %s обновлена", user_id)
+        except Exception as e:
+            logger.error("Ошибка обновления статистики: %s", e)
+        
+        # Уведомляем пользователя
+        success_text = f"""✅ Заказ оформлен!
+
+🆔 Номер заказа: {order_id}
+📦 Товар: {product_name}
+💰 Сумма: {product_price:.2f}₽
+💳 Способ оплаты: {payment_name}
+
+📋 Заказ отправлен на обработку.
+Мы свяжемся с вами в ближайшее время.
+"""
+        
+        await message.answer(
+            text=success_text,
+            reply_markup=main_menu_kb(user_id)
+        )
+        logger.debug("Пользователь уведомлен об успешной отправке")
+        
+    except Exception as e:
+        logger.exception("❌ Ошибка при обработке скриншота заказа: %s", e)
+        
+        error_text = f"""❌ Ошибка при обработке заказа
+
+Произошла техническая ошибка.
+Пожалуйста, обратитесь к администратору: @koliin98
+
+Ошибка: {str(e)}
+"""
+        await message.answer(
+            text=error_text,
+            reply_markup=main_menu_kb(message.from_user.id)
+        )
+
+async def _process_cart_purchase_screenshot(message: Message, data: dict, file_id: str):
+    """Обработать скриншот оплаты заказа из корзины"""
+    try:
+        user_id = data.get('user_id')
+        username = data.get('username')
+        payment_name = data.get('payment_name')
+        order_id = data.get('order_id')
+        cart_total = data.get('cart_total', {})
+        
+        logger.debug("Обработка заказа из корзины %s", order_id)
+        logger.debug("Пользователь: %s (ID: %s)", username, user_id)
+        logger.debug("Товаров в корзине: %s", cart_total.get('items_count', 0))
+        logger.debug("Общая сумма: %s", cart_total.get('total_amount', 0))
+        
+        # Формируем данные заказа
+        order_data = {
+            'user_id': user_id,
+            'username': username,
+            'order_id': order_id,
+            'cart_total': cart_total,
+            'total': cart_total.get('total_amount', 0),
+            'payment_method': payment_name,
+            'is_cart_order': True
+        }
+        
+        # Резервируем все товары корзины до решения администратора
+        reserved_items = [(item['product_id'], item['quantity']) for item in cart_total.get('items', [])]
+        if not inventory.reserve(order_id, reserved_items):
+            await message.answer(
+                text=OUT_OF_STOCK_TEXT,
+                reply_markup=main_menu_kb(user_id)
+            )
+            return
+        
+        # Отправляем в канал
+        result = await send_cart_to_order_channel(order_data, file_id)
+        
+        if result is None:
+            # Админы заказ не увидели: снимаем и резерв, и ожидающий заказ
+            db.remove_pending_order(order_id)
+            inventory.release(order_id)
+            error_text = """❌ Не удалось отправить заявку.
+
+Возможные причины:
+1. Бот не добавлен в канал заказов
+2. У бота нет прав на отправку сообщений в канал
+3. Технические проблемы с Telegram
+
+Пожалуйста, обратитесь к администратору: @koliin98
+"""
+            await message.answer(
+                text=error_text,
+                reply_markup=main_menu_kb(user_id)
+            )
+            return
+        
+        # Обновляем статистику пользователя
+        try:
+            db.update_user_stats(user_id, cart_total.get('total_amount', 0))
+            logger.debug("Статистика пользователя %s обновлена", user_id)
+        except Exception as e:
+            logger.error("Ошибка обновления статистики: %s", e)
+        
+        # Очищаем корзину после успешной оплаты
+        cart_manager.clear_cart(user_id)
+        
+        # Формируем текст с товарами для уведомления пользователя
+        items_text = ""
+        for item in cart_total.get('items', []):
+            items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
+        
+        # Уведомляем пользователя
+        success_text = f"""✅ Заказ из корзины оформлен!
+
+🆔 Номер заказа: {order_id}
+🛒 Состав заказа:
+{items_text}
+📦 Всего товаров: {cart_total.get('total_quantity', 0)} шт.
+💰 Общая сумма: {cart_total.get('total_amount', 0):.2f}₽
+💳 Способ оплаты: {payment_name}
+
+📋 Заказ отправлен на обработку.
+Мы свяжемся с вами в ближайшее время.
+"""
+        
+        await message.answer(
+            text=success_text,
+            reply_markup=main_menu_kb(user_id)
+        )
+        logger.debug("Пользователь уведомлен об успешной отправке заказа из корзины")
+        
+    except Exception as e:
+        logger.exception("❌ Ошибка при обработке скриншота заказа из корзины: %s", e)
+        
+        error_text = f"""❌ Ошибка при обработке заказа
+
+Произошла техническая ошибка.
+Пожалуйста, обратитесь к администратору: @koliin98
+
+Ошибка: {str(e)}
+"""
+        await message.answer(
+            text=error_text,
+            reply_markup=main_menu_kb(message.from_user.id)
+        )
+
+@callbacks.route('cancel', state=PaymentStates.waiting_for_screenshot)
+async def handle_cancel_payment(callback: CallbackQuery, state: FSMContext):
+    """Отмена оплаты"""
+    try:
+        await state.clear()
+        await callback.message.edit_text(
+            text="❌ Оплата отменена",
+            reply_markup=main_menu_kb(callback.from_user.id)
+        )
+    except Exception as e:
+        logger.error("Ошибка при отмене оплаты: %s", e)
+        await callback.answer("Ошибка при отмене", show_alert=True)
+    await callback.answer()
+
+@callbacks.route('support')
+async def handle_support(callback: CallbackQuery):
+    """Обработка кнопки поддержки"""
+    try:
+        user_id = callback.from_user.id
+        username = callback.from_user.username or callback.from_user.first_name
+        
+        support_text = f"""🆘 Поддержка
+
+По всем вопросам обращайтесь:
+👨‍💼 Администратор: {config.ADMIN_USERNAME}
+
+🕐 Время ответа: 24/7
+💬 Мы поможем с:
+• Оформлением заказа
+• Оплатой товара
+• Получением товара
+• Техническими проблемами
+
+📝 Вы также можете написать напрямую администратору.
+Ваш ID для связи: {user_id}
+"""
+        
+        # Создаем клавиатуру с ссылкой на администратора
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(
+                text='💬 Написать администратору',
+                url=f'https://t.me/{config.ADMIN_USERNAME.replace("@", "")}'
+            )
+        )
+        builder.row(
+            InlineKeyboardButton(text='🔙 Главное меню', callback_data='main_menu')
+        )
+        
+        await callback.message.edit_text(
+            text=support_text,
+            reply_markup=builder.as_markup(),
+            disable_web_page_preview=True
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при обработке поддержки: %s", e)
+        await callback.answer("Произошла ошибка", show_alert=True)
+    
+    await callback.answer()
+
+# ==================== ОБРАБОТЧИКИ ПОДТВЕРЖДЕНИЯ АДМИНИСТРАТОРОМ ====================
+
+@callbacks.route('confirm_order', fields=(CB_ORDER_ID,))
+async def handle_confirm_order(callback: CallbackQuery, args: Tuple):
+    """Подтвердить заказ администратором"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        # Извлекаем ID заказа
+        order_id = args[0]
+        
+        # Двойное нажатие или два администратора сразу не должны обработать заказ дважды
+        async with locks.order(order_id):
+            # Получаем данные заказа
+            order_data = db.get_pending_order(order_id)
+            if not order_data:
+                await callback.answer(order_decisions.get(order_id, "Заказ не найден"), show_alert=True)
+                return
+            
+            user_id = order_data.get('user_id')
+            total_amount = order_data.get('total', 0)
+            username = callback.from_user.username or callback.from_user.first_name
+            
+            # Проверяем, это заказ из корзины или одиночный
+            is_cart_order = order_data.get('is_cart_order', False)
+            
+            if is_cart_order:
+                product_name = f"Заказ из корзины ({order_data.get('total_quantity', 0)} товаров)"
+            else:
+                product_name = order_data.get('product_name', 'Неизвестный товар')
+            
+            # Удаляем из ожидающих и списываем товар со склада
+            db.remove_pending_order(order_id)
+            inventory.commit(order_id, order_items(order_data))
+            remember_order_decision(order_id, f"Заказ уже подтвержден: @{username}")
+        
+        # Отвечаем сразу, уведомления уходят через очередь отправки без ожидания
+        await callback.answer("✅ Заказ подтвержден")
+        
+        # Обновляем сообщение в канале
+        chat_id = callback.message.chat.id
+        message_id = callback.message.message_id
+        if callback.message.photo:
+            # Для сообщений с фото
+            new_caption = callback.message.caption + f"\n\n✅ ПОДТВЕРЖДЕНО АДМИНИСТРАТОРОМ: @{username}"
+            outbox.post(chat_id, lambda: bot.edit_message_caption(
+                chat_id=chat_id,
+                message_id=message_id,
+                caption=new_caption,
+                reply_markup=None
+            ), "обновления сообщения")
+        else:
+            # Для текстовых сообщений
+            new_text = callback.message.text + f"\n\n✅ ПОДТВЕРЖДЕНО АДМИНИСТРАТОРОМ: @{username}"
+            outbox.post(chat_id, lambda: bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=new_text,
+                reply_markup=None
+            ), "обновления сообщения")
+        
+        # Уведомляем пользователя
+        if is_cart_order:
+            # Формируем текст для заказа из корзины
+            cart_items_text = ""
+            cart_items = order_data.get('cart_items', [])
+            for item in cart_items:
+                cart_items_text += f"• {item['name']} x{item['quantity']} = {item['item_total']:.2f}₽\n"
+            
+            user_message = f"""✅ Ваш заказ из корзины подтвержден администратором!
+
+🆔 Номер заказа: {order_id}
+🛒 Состав заказа:
+{cart_items_text}
+📦 Всего товаров: {order_data.get('total_quantity', 0)} шт.
+💰 Общая сумма: {total_amount:.2f}₽
+
+📦 Товары будут отправлены вам в ближайшее время.
+"""
+        else:
+            # Формируем текст для одиночного заказа
+            user_message = f"""✅ Ваш заказ подтвержден администратором!
+
+🆔 Номер заказа: {order_id}
+📦 Товар: {product_name}
+💰 Сумма: {total_amount:.2f}₽
+
+📦 Товар будет отправлен вам в ближайшее время.
+"""
+        
+        outbox.post(user_id, lambda: bot.send_message(
+            chat_id=user_id,
+            text=user_message
+        ), "уведомления пользователя")
+        logger.info("✅ Заказ %s подтвержден для пользователя %s", order_id, user_id)
+        
+    except Exception as e:
+        logger.error("Ошибка при подтверждении заказа: %s", e)
+        await callback.answer("❌ Ошибка при подтверждении", show_alert=True)
+
+@callbacks.route('page', fields=(CB_INT, CB_INT))
+async def handle_page_change(callback: CallbackQuery, args: Tuple):
+    """Обработка смены страницы"""
+    try:
+        category_id, page = args
+        
+        # Получаем категорию для отображения названия
+        category = db.get_category(category_id)
+        category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
+        
+        products = db.get_products_by_category(category_id)
+        items_per_page = 5
+        total_pages = max(1, (len(products) + items_per_page - 1) // items_per_page)
+        
+        if not products:
+            text = f"📭 В категории '{category_name}' пока нет товаров"
+        else:
+            start_idx = page * items_per_page + 1
+            end_idx = min((page + 1) * items_per_page, len(products))
+            
+            text = f"🛒 Товары в категории '{category_name}':\n"
+            text += f"📄 Показано {start_idx}-{end_idx} из {len(products)} товаров\n\n"
+            text += "Выберите товар:"
+        
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=products_kb(category_id, page)
+        )
+        
+    except ValueError:
+        await callback.answer("Неверный ID категории", show_alert=True)
+    except Exception as e:
+        logger.error("Ошибка при смене страницы: %s", e)
+        await callback.answer("Ошибка загрузки товаров", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('facets', fields=(CB_INT, CB_INT, CB_INT, CB_INT))
+async def handle_facets(callback: CallbackQuery, args: Tuple):
+    """Подбор товаров по фильтрам: регион, цена, наличие"""
+    try:
+        filter_mask, band, in_stock, page = args
+        
+        product_ids = facet_products(filter_mask, band, bool(in_stock))
+        products = [product for product in map(db.get_product, product_ids) if product]
+        items_per_page = 5
+        total_pages = max(1, (len(products) + items_per_page - 1) // items_per_page)
+        page = max(0, min(page, total_pages - 1))
+        
+        text = "🎛 Подбор по фильтрам\n\n"
+        if products:
+            start_idx = page * items_per_page + 1
+            end_idx = min((page + 1) * items_per_page, len(products))
+            text += f"📄 Показано {start_idx}-{end_idx} из {len(products)} товаров\n"
+        else:
+            text += "📭 Ничего не найдено - попробуйте снять часть фильтров\n"
+        if filter_mask:
+            text += "ℹ️ Регион указан не у всех товаров - остальные ищите в категориях и через поиск"
+        
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=facets_kb(filter_mask, band, bool(in_stock), page, products, items_per_page)
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при подборе по фильтрам: %s", e)
+        await callback.answer("Ошибка загрузки товаров", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('reject_order', fields=(CB_ORDER_ID,))
+async def handle_reject_order(callback: CallbackQuery, args: Tuple):
+    """Отклонить заказ администратором"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        # Извлекаем ID заказа
+        order_id = args[0]
+        
+        # Двойное нажатие или два администратора сразу не должны обработать заказ дважды
+        async with locks.order(order_id):
+            # Получаем данные заказа
+            order_data = db.get_pending_order(order_id)
+            if not order_data:
+                await callback.answer(order_decisions.get(order_id, "Заказ не найден"), show_alert=True)
+                return
+            
+            user_id = order_data.get('user_id')
+            total_amount = order_data.get('total', 0)
+            
+            # Проверяем, это заказ из корзины или одиночный
+            is_cart_order = order_data.get('is_cart_order', False)
+            
+            if is_cart_order:
+                product_name = f"Заказ из корзины ({order_data.get('total_quantity', 0)} товаров)"
+            else:
+                product_name = order_data.get('product_name', 'Неизвестный товар')
+            
+            # Удаляем из ожидающих и возвращаем товар в продажу
+            db.remove_pending_order(order_id)
+            inventory.release(order_id)
+            remember_order_decision(order_id, f"Заказ уже отклонен: @{callback.from_user.username}")
+        
+        # Отвечаем сразу, уведомления уходят через очередь отправки без ожидания
+        await callback.answer("❌ Заказ отклонен")
+        
+        # Обновляем сообщение в канале
+        chat_id = callback.message.chat.id
+        message_id = callback.message.message_id
+        mark = f"\n\n❌ ОТКЛОНЕНО АДМИНИСТРАТОРОМ: @{callback.from_user.username}"
+        if callback.message.photo:
+            new_caption = callback.message.caption + mark
+            outbox.post(chat_id, lambda: bot.edit_message_caption(
+                chat_id=chat_id,
+                message_id=message_id,
+                caption=new_caption,
+                reply_markup=None
+            ), "обновления сообщения")
+        else:
+            new_text = callback.message.text + mark
+            outbox.post(chat_id, lambda: bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=message_id,
+                text=new_text,
+                reply_markup=None
+            ), "обновления сообщения")
+        
+        # Уведомляем пользователя
+        message_text = f"""❌ Ваш заказ отклонен администратором!
+
+🆔 Номер заказа: {order_id}
+📦 Товар: {product_name}
+💰 Сумма: {total_amount:.2f}₽
+
+💳 Если есть вопросы, обратитесь в поддержку: {config.ADMIN_USERNAME}
+"""
+        
+        outbox.post(user_id, lambda: bot.send_message(chat_id=user_id, text=message_text), "уведомления пользователя")
+        
+    except Exception as e:
+        logger.error("Ошибка при отклонении заказа: %s", e)
+        await callback.answer("❌ Ошибка при отклонении", show_alert=True)
+
+# ==================== АДМИН-ПАНЕЛЬ ====================
+
+@callbacks.route('admin_panel')
+async def handle_admin_panel(callback: CallbackQuery):
+    """Показать админ-панель"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        # Статистика для админ-панели
+        pending_orders = metrics.pending_orders
+        
+        admin_text = f"""👨‍💼 Админ-панель
+
+📊 Быстрая статистика:
+• 🛒 Ожидающих заказов: {pending_orders}
+• 👥 Пользователей: {metrics.users}
+• 📦 Товаров: {len(db.products)}
+• 🛍️ Активных корзин: {metrics.carts}
+
+Выберите раздел для управления:
+"""
+        
+        await callback.message.edit_text(
+            text=admin_text,
+            reply_markup=admin_panel_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при открытии админ-панели: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_pending')
+@callbacks.route('admin_pending', fields=(CB_INT,))
+async def handle_admin_pending(callback: CallbackQuery, args: Tuple):
+    """Ожидающие заявки по страницам: admin_pending или admin_pending_<страница>"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        page = args[0] if args else 0
+        
+        blocks = []
+        for i, (order_id, order_data) in enumerate(db.pending_orders.items(), 1):
+            block = f"{i}. 🆔 {order_id}\n"
+            block += f"   👤 @{order_data.get('username', 'N/A')} ({order_data.get('user_id')})\n"
+            
+            if order_data.get('is_cart_order'):
+                block += f"   🛍️ Заказ из корзины ({order_data.get('total_quantity', 0)} товаров)\n"
+            else:
+                block += f"   📦 {order_data.get('product_name', 'Неизвестно')}\n"
+            
+            block += f"   💰 {order_data.get('total', 0)}₽\n\n"
+            blocks.append(block)
+        
+        pages = split_pages(blocks, reserved=100, max_items=10)
+        page = max(0, min(page, len(pages) - 1))
+        
+        if not blocks:
+            text = "📭 Нет ожидающих заказов"
+        else:
+            start, end = pages[page]
+            text = f"⏳ Ожидающие заказы ({start + 1}-{end} из {len(blocks)}):\n\n"
+            text += "".join(blocks[start:end])
+        
+        # Создаем клавиатуру
+        builder = InlineKeyboardBuilder()
+        add_page_nav(builder, page, len(pages), 'admin_pending')
+        builder.row(
+            InlineKeyboardButton(text='🔄 Обновить', callback_data=callbacks.pack('admin_pending', page)),
+            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
+        )
+        
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при показе ожидающих заявок: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_users')
+@callbacks.route('admin_users', fields=(CB_STR, CB_INT))
+async def handle_admin_users(callback: CallbackQuery, args: Tuple):
+    """Показать рейтинг пользователей: admin_users или admin_users_<orders|spent>_<страница>"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        kind, page = 'orders', 0
+        if len(args) == 2 and args[0] in UserLeaderboard.FIELDS:
+            kind, page = args[0], max(0, args[1])
+        
+        users_per_page = 10
+        total_pages = max(1, (metrics.users + users_per_page - 1) // users_per_page)
+        page = min(page, total_pages - 1)
+        
+        if not metrics.users:
+            text = "📭 Пользователей пока нет"
+        else:
+            title = "по количеству заказов" if kind == 'orders' else "по сумме покупок"
+            text = f"👥 Пользователи {title}:\n\n"
+            
+            # Страница готового рейтинга
+            top_users = db.get_top_users(kind, page * users_per_page, users_per_page)
+            
+            for i, (user_id, user_data) in enumerate(top_users, page * users_per_page + 1):
+                total_spent = user_data.get('total_spent', 0)
+                total_orders = user_data.get('total_orders', 0)
+                reg_date = datetime.fromisoformat(user_data.get('registration_date', '2000-01-01')).strftime('%d.%m.%Y')
+                
+                text += f"{i}. 🆔 {user_id}\n"
+                text += f"   💸 Всего потрачено: {total_spent:.2f}₽\n"
+                text += f"   📦 Заказов: {total_orders}\n"
+                text += f"   📅 Регистрация: {reg_date}\n\n"
+        
+        # Создаем клавиатуру
+        builder = InlineKeyboardBuilder()
+        add_page_nav(builder, page, total_pages, 'admin_users', kind)
+        other_kind = 'spent' if kind == 'orders' else 'orders'
+        builder.row(
+            InlineKeyboardButton(
+                text='💸 По сумме покупок' if other_kind == 'spent' else '📦 По количеству заказов',
+                callback_data=callbacks.pack('admin_users', other_kind, 0)
+            )
+        )
+        builder.row(
+            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
+        )
+        
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при показе пользователей: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_stats')
+async def handle_admin_stats(callback: CallbackQuery):
+    """Показать статистику"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        # Собираем статистику
+        categories_count = len(db.get_categories())
+        products_count = len(db.products)
+        users_count = metrics.users
+        
+        # Статистика по транзакциям (накопленные счетчики)
+        purchase_stats = db.get_purchase_stats()
+        
+        # Статистика по пользователям
+        total_orders = metrics.orders
+        total_spent = metrics.spent
+        
+        # Статистика по корзинам
+        active_carts, total_cart_items = metrics.carts, metrics.cart_items
+        
+        # Формируем сообщение
+        stats_text = f"""📊 СТАТИСТИКА БОТА
+
+📈 Общая статистика:
+• 📁 Категорий: {categories_count}
+• 📦 Товаров: {products_count}
+• 👥 Пользователей: {users_count}
+• ⏳ Ожидающих заказов: {metrics.pending_orders}
+• 🛍️ Активных корзин: {active_carts}
+• 🛒 Товаров в корзинах: {total_cart_items}
+
+💰 Финансовая статистика:
+• 🛒 Покупок: {purchase_stats['count']} на {purchase_stats['amount']:.2f}₽
+• 💸 Всего потрачено: {total_spent:.2f}₽
+• 📦 Всего заказов: {total_orders}
+
+📤 Очередь отправки:
+• ⏳ В очереди: {outbox.depth}, в работе: {outbox.in_flight}
+• ✅ Отправлено: {outbox.sent}, 🔁 повторов: {outbox.retried}, ❌ ошибок: {outbox.failed}
+
+💳 Способ оплаты:
+• 🏦 Только Ozon (СБП/Карта)
+"""
+        
+        # Создаем клавиатуру
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel')
+        )
+        
+        await callback.message.edit_text(
+            text=stats_text,
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при показе статистики: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_products')
+async def handle_admin_products(callback: CallbackQuery):
+    """Управление товарами"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        await callback.message.edit_text(
+            text="📦 Управление товарами\n\nВыберите действие:",
+            reply_markup=admin_products_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при управлении товарами: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_categories')
+async def handle_admin_categories(callback: CallbackQuery):
+    """Управление категориями"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        await callback.message.edit_text(
+            text="📁 Управление категориями\n\nВыберите действие:",
+            reply_markup=admin_categories_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при управлении категориями: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+def admin_products_listing() -> Dict:
+    """Блоки текста списка товаров и границы страниц (из кэша каталога)"""
+    def build() -> Dict:
+        blocks = []
+        for i, product in enumerate(db.get_all_products(), 1):
+            category = db.get_category(product.get('category_id', 0))
+            category_name = category.get('name', 'Неизвестно') if category else 'Неизвестно'
+            
+            block = f"{i}. 📦 {product['name']}\n"
+            block += f"   🆔 ID: {product['id']}\n"
+            block += f"   💰 Цена: {product['price']:.2f}₽\n"
+            block += f"   📁 Категория: {category_name}\n"
+            block += f"   📊 В наличии: {product.get('quantity', 9999)} шт.\n"
+            
+            if product.get('description'):
+                block += f"   📝 Описание: {product['description'][:50]}...\n"
+            
+            blocks.append(block + "\n")
+        # Запас под заголовок страницы
+        return {'blocks': blocks, 'pages': split_pages(blocks, reserved=100, max_items=15)}
+    
+    # В списке есть остатки, поэтому он зависит и от версии остатков
+    return catalog_cache.get_or_build(('admin_products_listing', db.stock_version), build)
+
+@callbacks.route('admin_list_products')
+@callbacks.route('admin_list_products', fields=(CB_INT,))
+async def handle_admin_list_products(callback: CallbackQuery, args: Tuple):
+    """Список товаров по страницам: admin_list_products или admin_list_products_<страница>"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        page = args[0] if args else 0
+        
+        listing = admin_products_listing()
+        pages = listing['pages']
+        page = max(0, min(page, len(pages) - 1))
+        
+        if not listing['blocks']:
+            text = "📭 Товары пока отсутствуют"
+        else:
+            start, end = pages[page]
+            text = f"📦 Список всех товаров ({start + 1}-{end} из {len(listing['blocks'])}):\n\n"
+            text += "".join(listing['blocks'][start:end])
+        
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=admin_list_products_kb(page, len(pages))
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при показе списка товаров: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('force_start')
+async def handle_force_start(callback: CallbackQuery, state: FSMContext):
+    """Принудительный запуск бота с проверкой username"""
+    try:
+        await state.clear()
+        
+        user_id = callback.from_user.id
+        username = callback.from_user.username
+        
+        if not username:
+            error_text = """❌ Username не найден!
+
+Вы не установили username в Telegram.
+
+📌 Как установить username:
+1. Откройте Настройки Telegram
+2. Выберите "Имя пользователя" (Username)
+3. Установите уникальное имя
+4. Сохраните изменения
+
+После установки username нажмите /start"""
+            
+            await callback.message.edit_text(
+                text=error_text,
+                reply_markup=InlineKeyboardBuilder()
+                    .add(InlineKeyboardButton(text='🔄 Проверить снова', callback_data='force_start'))
+                    .as_markup()
+            )
+            return
+        
+        # Регистрируем пользователя
+        db.get_user(user_id)
+        
+        # Показываем количество товаров в корзине
+        cart_count = cart_manager.get_cart_items_count(user_id)
+        cart_info = f"\n🛒 Товаров в корзине: {cart_count}" if cart_count > 0 else ""
+        
+        welcome_text = f"""✅ Username обнаружен: @{username}{cart_info}
+
+👋 Добро пожаловать в магазин виртуальных услуг!
+
+✨ Возможности:
+• 🛒 Просмотр и покупка услуг
+• 🛍️ Корзина для покупки нескольких товаров
+• 💳 Оплата через Ozon (СБП/Карта)
+• ✅ Подтверждение заказов администраторами
+
+Теперь вы можете покупать товары!"""
+        
+        await callback.message.edit_text(
+            text=welcome_text,
+            reply_markup=main_menu_kb(user_id)
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при принудительном запуске: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_list_categories')
+async def handle_admin_list_categories(callback: CallbackQuery):
+    """Список категорий"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        categories = db.get_categories()
+        
+        if not categories:
+            text = "📭 Категории пока отсутствуют"
+        else:
+            text = "📁 Список категорий:\n\n"
+            
+            for i, category in enumerate(categories, 1):
+                products_count = len(db.get_products_by_category(category['id']))
+                text += f"{i}. {category['name']}\n"
+                text += f"   🆔 ID: {category['id']}\n"
+                text += f"   📦 Товаров: {products_count}\n\n"
+        
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=admin_list_categories_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при показе списка категорий: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+def admin_delete_listing() -> Dict:
+    """Кнопки удаления товаров и границы страниц (из кэша каталога)"""
+    def build() -> Dict:
+        buttons = []
+        seen_ids = set()
+        for product in db.get_all_products():
+            # Товар, выставленный в нескольких категориях, удаляется целиком - одна кнопка
+            if product['id'] in seen_ids:
+                continue
+            seen_ids.add(product['id'])
+            
+            product_name = product['name']
+            if len(product_name) > 25:
+                product_name = product_name[:22] + "..."
+            
+            buttons.append((f"🗑️ {product_name} - {product['price']}₽",
+                            callbacks.pack('admin_delete_product_confirm', product['id'])))
+        labels = [text for text, _ in buttons]
+        return {'buttons': buttons, 'pages': split_pages(labels, max_items=10)}
+    
+    return catalog_cache.get_or_build(('admin_delete_listing',), build)
+
+@callbacks.route('admin_delete_product')
+@callbacks.route('admin_delete_page', fields=(CB_INT,))
+async def handle_admin_delete_product(callback: CallbackQuery, state: FSMContext, args: Tuple):
+    """Удаление товара: выбор по страницам"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        listing = admin_delete_listing()
+        
+        if not listing['buttons']:
+            await callback.message.edit_text(
+                text="📭 Нет товаров для удаления",
+                reply_markup=admin_products_kb()
+            )
+            return
+        
+        page = args[0] if args else 0
+        pages = listing['pages']
+        page = max(0, min(page, len(pages) - 1))
+        start, end = pages[page]
+        
+        # Создаем клавиатуру с товарами текущей страницы
+        builder = InlineKeyboardBuilder()
+        
+        for text, callback_data in listing['buttons'][start:end]:
+            builder.row(InlineKeyboardButton(text=text, callback_data=callback_data))
+        
+        add_page_nav(builder, page, len(pages), 'admin_delete_page')
+        builder.row(
+            InlineKeyboardButton(text='🔙 Назад', callback_data='admin_products')
+        )
+        
+        await callback.message.edit_text(
+            text="🗑️ Выберите товар для удаления:",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при удалении товара: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('no_username', fields=(CB_ORDER_ID,))
+async def handle_no_username_warning(callback: CallbackQuery, args: Tuple):
+    """Обработка предупреждения о отсутствии username"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        # Извлекаем ID заказа
+        order_id = args[0]
+        
+        # Получаем данные заказа
+        order_data = db.get_pending_order(order_id)
+        if not order_data:
+            await callback.answer("Заказ не найден", show_alert=True)
+            return
+        
+        user_id = order_data.get('user_id')
+        
+        warning_text = f"""⚠️ ВНИМАНИЕ! У покупателя НЕТ USERNAME!
+
+🆔 ID заказа: {order_id}
+🆔 ID покупателя: {user_id}
+
+Действия:
+1. Отклонить заказ и попросить установить username
+2. Связаться с покупателем через личные сообщения по ID
+3. Попросить покупателя написать вам напрямую
+
+Риски:
+• Невозможно отправить товар
+• Невозможно уточнить детали
+• Покупатель может не получить уведомления"""
+        
+        await callback.answer(warning_text, show_alert=True)
+        
+    except Exception as e:
+        logger.error("Ошибка при показе предупреждения: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+
+@callbacks.route('admin_delete_product_confirm', fields=(CB_INT,))
+async def handle_admin_delete_product_confirm(callback: CallbackQuery, args: Tuple):
+    """Подтверждение удаления товара"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        # Извлекаем ID товара
+        product_id = args[0]
+        
+        # Получаем информацию о товаре
+        product = db.get_product(product_id)
+        if not product:
+            await callback.answer("Товар не найден", show_alert=True)
+            return
+        
+        # Создаем клавиатуру подтверждения
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(
+                text='✅ Да, удалить',
+                callback_data=callbacks.pack('admin_delete_product_final', product_id)
+            ),
+            InlineKeyboardButton(
+                text='❌ Нет, отмена',
+                callback_data='admin_products'
+            )
+        )
+        
+        await callback.message.edit_text(
+            text=f"⚠️ Вы уверены, что хотите удалить товар?\n\n"
+                 f"📦 {product['name']}\n"
+                 f"💰 Цена: {product['price']}₽\n\n"
+                 f"Это действие нельзя отменить!",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при подтверждении удаления товара: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_delete_product_final', fields=(CB_INT,))
+async def handle_admin_delete_product_final(callback: CallbackQuery, args: Tuple):
+    """Финальное удаление товара"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        # Извлекаем ID товара
+        product_id = args[0]
+        
+        # Получаем информацию о товаре перед удалением
+        product = db.get_product(product_id)
+        
+        # Удаляем товар
+        if db.delete_product(product_id):
+            await callback.message.edit_text(
+                text=f"✅ Товар успешно удален!\n\n"
+                     f"📦 Название: {product['name']}\n"
+                     f"💰 Цена: {product['price']}₽\n"
+                     f"🆔 ID: {product_id}",
+                reply_markup=admin_products_kb()
+            )
+            logger.info("🗑️ Удален товар: %s (ID: %s)", product['name'], product_id)
+        else:
+            await callback.message.edit_text(
+                text="❌ Не удалось удалить товар. Возможно, товар не существует.",
+                reply_markup=admin_products_kb()
+            )
+        
+    except Exception as e:
+        logger.error("Ошибка при удалении товара: %s", e)
+        await callback.message.edit_text(
+            text="❌ Ошибка при удалении товара",
+            reply_markup=admin_products_kb()
+        )
+    
+    await callback.answer()
+
+@callbacks.route('admin_add_category')
+async def handle_admin_add_category(callback: CallbackQuery):
+    """Добавление категории через меню"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        await callback.message.edit_text(
+            text="📁 Добавление новой категории\n\n"
+                 "Введите название новой категории:\n"
+                 "(например: 💻 Цифровые услуги)\n\n"
+                 "Или нажмите '🔙 Назад' для отмены",
+            reply_markup=InlineKeyboardBuilder()
+                .add(InlineKeyboardButton(text='🔙 Назад', callback_data='admin_categories'))
+                .as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при добавлении категории: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_add_product')
+async def handle_admin_add_product(callback: CallbackQuery, state: FSMContext):
+    """Добавление товара через меню"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        categories = db.get_categories()
+        if not categories:
+            await callback.message.edit_text(
+                text="❌ Нет доступных категорий.\n"
+                     "Сначала создайте категорию.",
+                reply_markup=admin_products_kb()
+            )
+            return
+        
+        await state.set_state(AddProductStates.waiting_for_category)
+        
+        # Создаем клавиатуру с категориями
+        builder = InlineKeyboardBuilder()
+        for category in categories:
+            builder.row(
+                InlineKeyboardButton(
+                    text=category["name"],
+                    callback_data=callbacks.pack('admin_add_product_cat', category['id'])
+                )
+            )
+        builder.row(InlineKeyboardButton(text='🔙 Назад', callback_data='admin_products'))
+        
+        await callback.message.edit_text(
+            text="➕ Добавление нового товара\n\n"
+                 "Выберите категорию для товара:",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при запуске добавления товара: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+        await state.clear()
+    
+    await callback.answer()
+
+@callbacks.route('admin_broadcast')
+async def handle_admin_broadcast(callback: CallbackQuery, state: FSMContext):
+    """Рассылка: прогресс текущей или запрос сообщения для новой"""
+    try:
+        # Проверяем права администратора
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        builder = InlineKeyboardBuilder()
+        if broadcaster.running:
+            text = f"📣 Рассылка\n\n{broadcaster.progress_text()}"
+            builder.row(
+                InlineKeyboardButton(text='🔄 Обновить', callback_data='admin_broadcast'),
+                InlineKeyboardButton(text='⏹ Остановить', callback_data='admin_broadcast_stop')
+            )
+        else:
+            await state.set_state(BroadcastStates.waiting_for_message)
+            text = (f"📣 Рассылка\n\n"
+                    f"Последняя рассылка:\n{broadcaster.progress_text()}\n\n"
+                    f"Отправьте сообщение, которое получат все пользователи ({metrics.users}). "
+                    f"Можно с фото, видео или файлом.")
+            builder.row(InlineKeyboardButton(text='❌ Отмена', callback_data='cancel'))
+        builder.row(InlineKeyboardButton(text='🔙 Назад', callback_data='admin_panel'))
+        
+        await callback.message.edit_text(text=text, reply_markup=builder.as_markup())
+        
+    except Exception as e:
+        logger.error("Ошибка при открытии рассылки: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@dp.message(BroadcastStates.waiting_for_message)
+async def handle_broadcast_message(message: Message, state: FSMContext):
+    """Получено сообщение для рассылки - просим подтверждение"""
+    try:
+        if message.from_user.id not in config.ADMIN_IDS:
+            await state.clear()
+            return
+        
+        await state.update_data(from_chat_id=message.chat.id, message_id=message.message_id)
+        
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(text='✅ Начать рассылку', callback_data='admin_broadcast_start'),
+            InlineKeyboardButton(text='❌ Отмена', callback_data='cancel')
+        )
+        await message.answer(
+            text=f"📣 Отправить это сообщение {metrics.users} пользователям?",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при подготовке рассылки: %s", e)
+        await state.clear()
+
+@callbacks.route('admin_broadcast_start', state=BroadcastStates.waiting_for_message)
+async def handle_broadcast_start(callback: CallbackQuery, state: FSMContext):
+    """Запустить рассылку"""
+    try:
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        data = await state.get_data()
+        await state.clear()
+        
+        if 'message_id' not in data:
+            await callback.answer("Сначала отправьте сообщение для рассылки", show_alert=True)
+            return
+        
+        if broadcaster.start(callback.from_user.id, data['from_chat_id'], data['message_id']):
+            text = "📣 Рассылка запущена. Отчет придет по завершении."
+        else:
+            text = "⏳ Предыдущая рассылка еще идет"
+        
+        builder = InlineKeyboardBuilder()
+        builder.row(InlineKeyboardButton(text='📊 Прогресс', callback_data='admin_broadcast'))
+        builder.row(InlineKeyboardButton(text='🔙 Админ-панель', callback_data='admin_panel'))
+        await callback.message.edit_text(text=text, reply_markup=builder.as_markup())
+        
+    except Exception as e:
+        logger.error("Ошибка при запуске рассылки: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+@callbacks.route('admin_broadcast_stop')
+async def handle_broadcast_stop(callback: CallbackQuery):
+    """Остановить рассылку"""
+    try:
+        if callback.from_user.id not in config.ADMIN_IDS:
+            await callback.answer("⛔ Нет доступа", show_alert=True)
+            return
+        
+        broadcaster.stop()
+        
+        builder = InlineKeyboardBuilder()
+        builder.row(InlineKeyboardButton(text='🔙 Админ-панель', callback_data='admin_panel'))
+        await callback.message.edit_text(
+            text=f"⏹ Рассылка остановлена\n\n{broadcaster.progress_text()}",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при остановке рассылки: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+    
+    await callback.answer()
+
+# ==================== INLINE-РЕЖИМ ====================
+
+class LRUCache:
+    """Ограниченный по размеру кэш, вытесняющий давно не использованные записи"""
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: Tuple, build: Callable[[], Any]) -> Any:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self._items[key] = build()
+        if len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        return value
+
+INLINE_RESULTS_LIMIT = 50  # Максимум результатов в одном ответе на inline-запрос
+
+inline_cache = LRUCache(config.INLINE_CACHE_SIZE)
+
+def inline_product_ids(query: str) -> List[int]:
+    """ID товаров для inline-запроса; кэш по нормализованному запросу и версии каталога
+
+    Записи для старых версий каталога просто вытесняются из LRU. В кэше только
+    ID: остаток меняется резервами без смены версии и подставляется в inline_article.
+    """
+    normalized = ' '.join(sorted(set(SearchIndex.tokenize(query))))
+    catalog_cache.sync()
+
+    def build() -> List[int]:
+        if normalized:
+            return search_index.search(normalized)
+        # Пустой запрос - весь каталог, товар из нескольких категорий один раз
+        return list(dict.fromkeys(product['id'] for product in db.get_all_products()))
+
+    return inline_cache.get_or_build((db.catalog_version, normalized), build)
+
+def inline_article(product_id: int, bot_username: str) -> Optional[InlineQueryResultArticle]:
+    """Результат inline-запроса для товара с текущим остатком"""
+    card = product_card(product_id)
+    if not card:
+        return None
+    product = db.get_product(product_id)
+    builder = InlineKeyboardBuilder()
+    builder.row(InlineKeyboardButton(
+        text='🛒 Открыть в боте',
+        url=f"https://t.me/{bot_username}?start=product_{product_id}"
+    ))
+    return InlineQueryResultArticle(
+        id=str(product_id),
+        title=card['title'],
+        description=f"{product['price']:.2f}₽ • в наличии {inventory.available(product_id)} шт.",
+        input_message_content=InputTextMessageContent(message_text=f"{card['title']}\n\n{card['body']}"),
+        reply_markup=builder.as_markup()
+    )
+
+@dp.inline_query()
+async def handle_inline_query(inline_query: InlineQuery):
+    """Поиск товаров через «@бот запрос» в любом чате"""
+    try:
+        me = await inline_query.bot.me()
+        product_ids = inline_product_ids(inline_query.query)
+        
+        offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+        page_ids = product_ids[offset:offset + INLINE_RESULTS_LIMIT]
+        next_offset = str(offset + len(page_ids)) if offset + len(page_ids) < len(product_ids) else ''
+        results = [article for article in (inline_article(product_id, me.username) for product_id in page_ids)
+                   if article]
+        
+        await inline_query.answer(
+            results=results,
+            cache_time=config.INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=next_offset
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при обработке inline-запроса: %s", e)
+        # Без ответа клиент крутит индикатор загрузки до таймаута
+        with contextlib.suppress(Exception):
+            await inline_query.answer(results=[], cache_time=0, is_personal=True)
+
+# ==================== ДОПОЛНИТЕЛЬНЫЕ ОБРАБОТЧИКИ ====================
+
+@callbacks.route('cancel')
+async def handle_cancel(callback: CallbackQuery, state: FSMContext):
+    """Отменить текущую операцию"""
+    try:
+        # Очищаем состояние FSM
+        await state.clear()
+        
+        # Возвращаем в главное меню
+        await callback.message.edit_text(
+            text="❌ Операция отменена",
+            reply_markup=main_menu_kb(callback.from_user.id)
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при отмене операции: %s", e)
+        await callback.answer("Ошибка при отмене", show_alert=True)
+    
+    await callback.answer()
+
+@dp.message(F.text & ~F.command)
+async def handle_unknown_text(message: Message, state: FSMContext):
+    """Обработать неизвестные текстовые сообщения"""
+    current_state = await state.get_state()
+    
+    if not current_state:
+        # Проверяем, не является ли сообщение добавлением категории через меню
+        if message.reply_to_message and "Добавление новой категории" in message.reply_to_message.text:
+            try:
+                # Проверяем права администратора
+                if message.from_user.id not in config.ADMIN_IDS:
+                    await message.answer("⛔ У вас нет прав администратора")
+                    return
+                
+                category_name = message.text.strip()
+                
+                # Валидация названия
+                if len(category_name) < 2:
+                    await message.answer("❌ Название категории слишком короткое")
+                    return
+                
+                if len(category_name) > 50:
+                    await message.answer("❌ Название категории слишком длинное")
+                    return
+                
+                # Проверяем, не существует ли уже категория с таким названием
+                existing_categories = db.get_categories()
+                for cat in existing_categories:
+                    if cat['name'].lower() == category_name.lower():
+                        await message.answer(
+                            f"❌ Категория с названием '{category_name}' уже существует",
+                            reply_markup=admin_categories_kb()
+                        )
+                        return
+                
+                # Добавляем категорию
+                category_id = db.add_category(category_name)
+                
+                await message.answer(
+                    text=f"✅ Категория добавлена!\n\n"
+                         f"📁 Название: {category_name}\n"
+                         f"🆔 ID: {category_id}",
+                    reply_markup=admin_categories_kb()
+                )
+                
+                logger.info("✅ Добавлена новая категория: %s (ID: %s)", category_name, category_id)
+                
+            except Exception as e:
+                logger.error("Ошибка при добавлении категории: %s", e)
+                await message.answer("❌ Ошибка при добавлении категории")
+        else:
+            await message.answer(
+                text="👋 Для навигации используйте кнопки меню:",
+                reply_markup=main_menu_kb(message.from_user.id)
+            )
+
+# ==================== АДМИН КОМАНДЫ ====================
+
+@dp.message(Command("addproduct"))
+async def handle_add_product_command(message: Message, state: FSMContext):
+    """Команда добавления товара"""
+    try:
+        # Проверяем права администратора
+        if message.from_user.id not in config.ADMIN_IDS:
+            await message.answer("⛔ У вас нет прав администратора")
+            return
+        
+        categories = db.get_categories()
+        if not categories:
+            await message.answer(
+                "❌ Нет доступных категорий.\n"
+                "Сначала создайте категорию командой /addcategory"
+            )
+            return
+        
+        await state.set_state(AddProductStates.waiting_for_category)
+        
+        # Создаем клавиатуру с категориями
+        builder = InlineKeyboardBuilder()
+        for category in categories:
+            builder.row(
+                InlineKeyboardButton(
+                    text=category["name"],
+                    callback_data=callbacks.pack('admin_add_product_cat', category['id'])
+                )
+            )
+        builder.row(InlineKeyboardButton(text='❌ Отмена', callback_data='cancel'))
+        
+        await message.answer(
+            text="➕ Добавление нового товара\n\n"
+                 "Выберите категорию для товара:",
+            reply_markup=builder.as_markup()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при запуске добавления товара: %s", e)
+        await message.answer("❌ Произошла ошибка")
+        await state.clear()
+
+@callbacks.route('admin_add_product_cat', fields=(CB_INT,))
+async def handle_admin_product_category(callback: CallbackQuery, state: FSMContext, args: Tuple):
+    """Обработка выбора категории для товара"""
+    try:
+        # Извлекаем ID категории
+        category_id = args[0]
+        
+        # Сохраняем ID категории и переходим к вводу названия
+        await state.update_data(category_id=category_id)
+        await state.set_state(AddProductStates.waiting_for_name)
+        
+        await callback.message.edit_text(
+            text="📝 Введите название товара:",
+            reply_markup=cancel_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при выборе категории товара: %s", e)
+        await callback.answer("Ошибка", show_alert=True)
+        await state.clear()
+    
+    await callback.answer()
+
+@dp.message(AddProductStates.waiting_for_name)
+async def handle_product_name(message: Message, state: FSMContext):
+    """Обработка ввода названия товара"""
+    try:
+        product_name = message.text.strip()
+        
+        if len(product_name) < 2:
+            await message.answer(
+                text="❌ Название слишком короткое. Введите название товара:",
+                reply_markup=cancel_kb()
+            )
+            return
+        
+        await state.update_data(product_name=product_name)
+        await state.set_state(AddProductStates.waiting_for_price)
+        
+        await message.answer(
+            text="💰 Введите цену товара (в рублях):\n\nПример: 1000 или 1500.50",
+            reply_markup=cancel_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при вводе названия товара: %s", e)
+        await message.answer("❌ Ошибка", reply_markup=cancel_kb())
+        await state.clear()
+
+@dp.message(AddProductStates.waiting_for_price)
+async def handle_product_price(message: Message, state: FSMContext):
+    """Обработка ввода цены товара"""
+    try:
+        price_text = message.text.strip().replace(',', '.')
+        
+        try:
+            price = float(price_text)
+        except ValueError:
+            await message.answer(
+                text="❌ Неверный формат цены!\n\n"
+                     "Введите число. Пример: 1000 или 1500.50",
+                reply_markup=cancel_kb()
+            )
+            return
+        
+        if price <= 0:
+            await message.answer(
+                text="❌ Цена должна быть больше 0!\n\n"
+                     "Введите цену товара:",
+                reply_markup=cancel_kb()
+            )
+            return
+        
+        await state.update_data(product_price=price)
+        await state.set_state(AddProductStates.waiting_for_description)
+        
+        await message.answer(
+            text="📝 Введите описание товара (или 'нет' для пропуска):",
+            reply_markup=cancel_kb()
+        )
+        
+    except Exception as e:
+        logger.error("Ошибка при вводе цены товара: %s", e)
+        await message.answer("❌ Ошибка", reply_markup=cancel_kb())
+        await state.clear()
+
+@dp.message(AddProductStates.waiting_for_description)
+async def handle_product_description(message: Message, state: FSMContext):
+    """Обработка ввода описания товара"""
+    try:
+        description = message.text.strip()
+        if description.lower() == 'нет':
+            description = ""
+        
+        # Получаем все данные
+        data = await state.get_data()
+        category_id = data.get('category_id')
+        product_name = data.get('product_name')
+        price = data.get('product_price')
+        
+        # Добавляем товар в базу
+        product_id = db.add_product(
+            category_id=category_id,
+            name=product_name,
+            price=price,
+            description=description
+        )
+        
+        # Очищаем состояние
+        await state.clear()
+        
+        # Получаем информацию о категории
+        category = db.get_category(category_id)
+        
+        await message.answer(
+            text=f"✅ Товар успешно добавлен!\n\n"
+                 f"📦 Название: {product_name}\n"
+                 f"💰 Цена: {price:.2f}₽\n"
+                 f"📝 Описание: {description or 'Нет описания'}\n"
+                 f"📁 Категория: {category.get('name', 'Неизвестно') if category else 'Неизвестно'}\n"
+                 f"🆔 ID товара: {product_id}",
+            reply_markup=main_menu_kb(message.from_user.id)
+        )
+        
+        logger.info("✅ Добавлен новый товар: %s (ID: %s) в категорию %s", product_name, product_id, category_id)
+        
+    except Exception as e:
+        logger.error("Ошибка при добавлении товара: %s", e)
+        await message.answer(
+            text="❌ Ошибка при добавлении товара",
+            reply_markup=main_menu_kb(message.from_user.id)
+        )
+        await state.clear()
+
+@dp.message(Command("addcategory"))
+async def handle_add_category_command(message: Message):
+    """Команда добавления категории"""
+    try:
+        # Проверяем права администратора
+        if message.from_user.id not in config.ADMIN_IDS:
+            await message.answer("⛔ У вас нет прав администратора")
+            return
+        
+        # Извлекаем название категории из команды
+        command_parts = message.text.split(maxsplit=1)
+        if len(command_parts) < 2:
+            await message.answer(
+                "❌ Не указано название категории.\n\n"
+                "Использование:\n"
+                "/addcategory <название категории>\n\n"
+                "Пример:\n"
+                "/addcategory 💻 Цифровые услуги"
+            )
+            return
+        
+        category_name = command_parts[1].strip()
+        
+        # Валидация названия
+        if len(category_name) < 2:
+            await message.answer("❌ Название категории слишком короткое")
+            return
+        
+        if len(category_name) > 50:
+            await message.answer("❌ Название категории слишком длинное")
+            return
+        
+        # Проверяем, не существует ли уже категория с таким названием
+        existing_categories = db.get_categories()
+        for cat in existing_categories:
+            if cat['name'].lower() == category_name.lower():
+                await message.answer(
+                    f"❌ Категория с названием '{category_name}' уже существует"
+                )
+                return
+        
+        # Добавляем категорию
+        category_id = db.add_category(category_name)
+        
+        await message.answer(
+            text=f"✅ Категория добавлена!\n\n"
+                 f"📁 Название: {category_name}\n"
+                 f"🆔 ID: {category_id}",
+            reply_markup=main_menu_kb(message.from_user.id)
+        )
+        
+        logger.info("✅ Добавлена новая категория: %s (ID: %s)", category_name, category_id)
+        
+    except Exception as e:
+        logger.error("Ошибка при добавлении категории: %s", e)
+        await message.answer("❌ Ошибка при добавлении категории")
+
+@dp.message(Command("stats"))
+async def handle_stats_command(message: Message):
+    """Команда показа статистики"""
+    try:
+        # Проверяем права администратора
+        if message.from_user.id not in config.ADMIN_IDS:
+            await message.answer("⛔ У вас нет прав администратора")
+            return
+        
+        # Собираем статистику
+        categories_count = len(db.get_categories())
+        products_count = len(db.products)
+        users_count = metrics.users
+        pending_orders = metrics.pending_orders
+        
+        # Статистика по транзакциям (накопленные счетчики)
+        purchase_stats = db.get_purchase_stats()
+        
+        # Статистика по корзинам
+        active_carts, total_cart_items = metrics.carts, metrics.cart_items
+        
+        stats_text = f"""📊 СТАТИСТИКА БОТА (команда /stats)
+
+📈 Общая статистика:
+• 📁 Категорий: {categories_count}
+• 📦 Товаров: {products_count}
+• 👥 Пользователей: {users_count}
+• ⏳ Ожидающих заказов: {pending_orders}
+• 🛍️ Активных корзин: {active_carts}
+• 🛒 Товаров в корзинах: {total_cart_items}
+
+💰 Финансовая статистика:
+• 🛒 Всего покупок: {purchase_stats['count']}
+• 💸 Общая сумма: {purchase_stats['amount']:.2f}₽
+
+📤 Очередь отправки:
+• ⏳ В очереди: {outbox.depth}, в работе: {outbox.in_flight}
+• ✅ Отправлено: {outbox.sent}, 🔁 повторов: {outbox.retried}, ❌ ошибок: {outbox.failed}
+
+💳 Способ оплаты:
+• 🏦 Только Ozon (СБП/Карта)
+"""
+        
+        await message.answer(stats_text)
+        
+    except Exception as e:
+        logger.error("Ошибка при показе статистики: %s", e)
+        await message.answer("❌ Ошибка при загрузке статистики")
+
+@callbacks.route('no_action')
+async def handle_no_action(callback: CallbackQuery):
+    """Обработка неактивных кнопок (номер страницы)"""
+    await callback.answer()  # Просто отвечаем, но ничего не делаем
+
+# ==================== ЗАПУСК БОТА ====================
+
+async def run_webhook():
+    """Принимать обновления через вебхук на aiohttp-сервере"""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=config.WEBHOOK_SECRET or None
+    ).register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    if config.WEBHOOK_URL:
+        await bot.set_webhook(
+            url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        )
+        logger.info("✅ Вебхук зарегистрирован: %s%s", config.WEBHOOK_URL, config.WEBHOOK_PATH)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+    await site.start()
+    logger.info("✅ Вебхук-сервер слушает %s:%s%s", config.WEBHOOK_HOST, config.WEBHOOK_PORT, config.WEBHOOK_PATH)
+
+    try:
+        # Работаем, пока процесс не остановят
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def main():
+    """
+    Основная функция запуска бота
+    """
+    await metrics.reset_carts(cart_manager)
+    
+    # Выводим информацию о запуске
+    startup_info = f"""
+{'=' * 50}
+🤖 БОТ ЗАПУЩЕН
+{'=' * 50}
+
+📊 Загруженные данные:
+• 📁 Категорий: {len(db.categories)}
+• 📦 Товаров: {len(db.products)}
+• 👥 Пользователей: {metrics.users}
+• 💳 Покупок: {db.get_purchase_stats()['count']}
+• ⏳ Ожидающих заказов: {metrics.pending_orders}
+• 🛍️ Активных корзин: {metrics.carts}
+
+⚙️ Конфигурация:
+• 👨‍💼 Администраторы: {config.ADMIN_IDS}
+• 💳 Оплата: Только Ozon (СБП/Карта)
+• 🌐 Режим обновлений: {config.RUN_MODE}
+• 📊 Каналы: Заказы - {config.ORDER_CHANNEL_ID}
+
+🎉 НОВАЯ ФУНКЦИЯ:
+• 🛍️ Корзина для покупки нескольких товаров
+
+{'=' * 50}
+✅ Бот готов к работе!
+✅ Оплата только через Ozon (СБП/Карта)
+✅ Корзина активирована!
+{'=' * 50}
+"""
+    print(startup_info)
+
+    # Проверяем канал заказов один раз при старте, дальше работает кэш
+    if await order_channel.check():
+        logger.info("✅ Канал заказов доступен: %s", order_channel.title)
+    else:
+        logger.error("❌ Канал заказов %s недоступен: %s. "
+                     "Проверьте ORDER_CHANNEL_ID и что бот добавлен в канал администратором",
+                     config.ORDER_CHANNEL_ID, order_channel.error)
+    
+    # Продолжаем рассылку, если бот был остановлен посреди нее
+    broadcaster.resume()
+    
+    try:
+        if config.RUN_MODE == 'webhook':
+            await run_webhook()
+        else:
+            # Запускаем polling
+            await dp.start_polling(
+                bot,
+                skip_updates=True
+            )
+        
+    except KeyboardInterrupt:
+        logger.info("🛑 Бот остановлен пользователем")
+    except Exception as e:
+        logger.exception("❌ Критическая ошибка при запуске бота: %s", e)
+    finally:
+        # Прерываем рассылку (продолжится после запуска) и досылаем уведомления из очереди
+        await broadcaster.close()
+        await outbox.close()
+        
+        # Сохраняем данные корзины перед выходом
+        cart_manager.flush()
+        # Сворачиваем журнал пользователей в снимок
+        if db.journal:
+            db.compact_journal()
+        await persistence.flush()
+        logger.info("✅ Данные сохранены")
+
+        # Закрываем хранилище состояний FSM
+        await storage.close()
+
+        # Закрываем сессию бота
+        await bot.session.close()
+        logger.info("✅ Сессия бота закрыта")
+        log_listener.stop()
+
+if __name__ == "__main__":
+    # Запускаем бота
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        # В режиме вебхука Ctrl+C отменяет main(), данные уже сохранены в finally
+        print("\n\n🛑 Бот остановлен пользователем")
+
@@ -0,0 +1,188 @@
+"""
+Нагрузочный тест вебхук-режима без Telegram.
+
+Отправляет синтетические обновления (команды и нажатия кнопок) на локальный
+вебхук бота и печатает пропускную способность и задержки ответа.
+
+Запуск бота:    RUN_MODE=webhook WEBHOOK_SECRET=test python nnd.py
+Запуск теста:   python webhook_loadtest.py --secret test --count 5000 --concurrency 50
+
+Чтобы обработчики не ходили в настоящий Telegram, можно поднять заглушку Bot API
+и запустить бота с TELEGRAM_API_URL=http://127.0.0.1:8081:
+                python webhook_loadtest.py --fake-api 8081
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from typing import Dict, List
+
+import aiohttp
+from aiohttp import web
+
+# Нажатия кнопок каталога и корзины, которые чаще всего встречаются в реальном трафике
+CALLBACK_DATA = [
+    'main_menu',
+    'view_categories',
+    'category_1',
+    'category_2',
+    'page_1_1',
+    'product_1',
+    'add_to_cart_1',
+    'view_cart',
+]
+
+COMMANDS = ['/start', '/support']
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def make_user(user_id: int) -> Dict:
+    return {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": f"Load{user_id}",
+        "username": f"load_user_{user_id}"
+    }
+
+
+def make_message_update(user_id: int, text: str) -> Dict:
+    """Обновление с текстовым сообщением (команда)"""
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": make_user(user_id),
+        "text": text
+    }
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def make_callback_update(user_id: int, data: str) -> Dict:
+    """Обновление с нажатием inline-кнопки"""
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": make_user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "🏠 Главное меню"
+            }
+        }
+    }
+
+
+def make_update(users: int) -> Dict:
+    user_id = 10_000_000 + random.randrange(users)
+    if random.random() < 0.1:
+        return make_message_update(user_id, random.choice(COMMANDS))
+    return make_callback_update(user_id, random.choice(CALLBACK_DATA))
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run(url: str, secret: str, count: int, concurrency: int, users: int):
+    headers = {}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    latencies: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(count):
+        queue.put_nowait(make_update(users))
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors
+        while True:
+            try:
+                update = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    print(f"📨 Отправлено обновлений: {count} ({concurrency} параллельно, {users} пользователей)")
+    print(f"⏱️ Время: {elapsed:.2f} с, {count / elapsed:.0f} обновлений/с")
+    print(f"📊 Задержка: p50={percentile(latencies, 50) * 1000:.1f} мс, "
+          f"p95={percentile(latencies, 95) * 1000:.1f} мс, "
+          f"p99={percentile(latencies, 99) * 1000:.1f} мс")
+    print(f"❌ Ошибок: {errors}")
+
+
+def fake_message(chat_id: int) -> Dict:
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": ""
+    }
+
+
+async def fake_api_handler(request: web.Request) -> web.Response:
+    """Минимальные ответы Bot API, достаточные для обработчиков бота"""
+    method = request.match_info['method'].lower()
+    if method == 'getme':
+        result = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+    elif method == 'getchat':
+        result = {"id": -1, "type": "channel", "title": "Load test channel"}
+    elif method.startswith('send') or method.startswith('edit'):
+        data = await request.post()
+        result = fake_message(int(data.get('chat_id') or 1))
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+def run_fake_api(port: int):
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', fake_api_handler)
+    print(f"🧪 Заглушка Bot API на http://127.0.0.1:{port}")
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест вебхука бота")
+    parser.add_argument('--fake-api', type=int, metavar='PORT',
+                        help='вместо теста запустить заглушку Bot API на указанном порту')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+    if args.fake_api:
+        run_fake_api(args.fake_api)
+        return
+    asyncio.run(run(args.url, args.secret, args.count, args.concurrency, args.users))
+
+
+if __name__ == "__main__":
+    main()